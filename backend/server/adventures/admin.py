@@ -1,7 +1,7 @@
 import os
 from django.contrib import admin
 from django.utils.html import mark_safe
-from .models import Location, Checklist, ChecklistItem, Collection, Transportation, Note, ContentImage, Visit, Category, ContentAttachment, Lodging, CollectionInvite, Trail, Activity
+from .models import Location, Checklist, ChecklistItem, Collection, Transportation, Note, ContentImage, Visit, Category, ContentAttachment, Lodging, CollectionInvite, Trail, Activity, BackgroundJob
 from worldtravel.models import Country, Region, VisitedRegion, City, VisitedCity
 from allauth.account.decorators import secure_admin_login
 
@@ -146,6 +146,12 @@ class CollectionAdmin(admin.ModelAdmin):
 class ActivityAdmin(admin.ModelAdmin):
     list_display = ('name', 'user', 'visit__location', 'sport_type', 'distance', 'elevation_gain', 'moving_time')
 
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'dedupe_key', 'status', 'attempts', 'run_after', 'updated_at')
+    list_filter = ('kind', 'status')
+    search_fields = ('dedupe_key', 'last_error')
+    readonly_fields = ('created_at', 'updated_at', 'locked_at')
+
 admin.site.register(CustomUser, CustomUserAdmin)
 admin.site.register(Location, LocationAdmin)
 admin.site.register(Collection, CollectionAdmin)
@@ -166,6 +172,7 @@ admin.site.register(Lodging)
 admin.site.register(CollectionInvite, CollectionInviteAdmin)
 admin.site.register(Trail)
 admin.site.register(Activity, ActivityAdmin)
+admin.site.register(BackgroundJob, BackgroundJobAdmin)
 
 admin.site.site_header = 'AdventureLog Admin'
 admin.site.site_title = 'AdventureLog Admin Site'
@@ -1,12 +1,26 @@
 import requests
+from adventures.utils import http_client
 import time
 import socket
+from django.contrib.gis.db.models.functions import Distance, GeometryDistance
+from django.contrib.gis.geos import Point
 from worldtravel.models import Region, City, VisitedRegion, VisitedCity
 from django.conf import settings
+from adventures.utils.geocode_cache import cached_lookup, reverse_cache_key, search_cache_key
+
+# Maximum distance (km) to the nearest known city for the local resolver to answer
+LOCAL_GEOCODE_CITY_RADIUS_KM = getattr(settings, 'LOCAL_GEOCODE_CITY_RADIUS_KM', 15)
+LOCAL_GEOCODE_REGION_RADIUS_KM = getattr(settings, 'LOCAL_GEOCODE_REGION_RADIUS_KM', 75)
 
 # -----------------
 # SEARCHING
+def _is_result_list(value):
+    return isinstance(value, list)
+
 def search_google(query):
+    return cached_lookup('google', 'search', search_cache_key(query), lambda: _search_google(query), cacheable=_is_result_list)
+
+def _search_google(query):
     try:
         api_key = settings.GOOGLE_MAPS_API_KEY
         if not api_key:
@@ -26,7 +40,7 @@ def search_google(query):
             "maxResultCount": 20  # Adjust as needed
         }
         
-        response = requests.post(url, json=payload, headers=headers, timeout=(2, 5))
+        response = http_client.post(url, json=payload, headers=headers, timeout=(2, 5))
         response.raise_for_status()
 
         data = response.json()
@@ -111,9 +125,12 @@ def _infer_addresstype(type_):
 
 
 def search_osm(query):
-    url = f"https://nominatim.openstreetmap.org/search?q={query}&format=jsonv2"
+    return cached_lookup('nominatim', 'search', search_cache_key(query), lambda: _search_osm(query), cacheable=_is_result_list)
+
+def _search_osm(query):
+    url = "https://nominatim.openstreetmap.org/search"
     headers = {'User-Agent': 'AdventureLog Server'}
-    response = requests.get(url, headers=headers)
+    response = http_client.get(url, params={'q': query, 'format': 'jsonv2'}, headers=headers)
     data = response.json()
 
     return [{
@@ -195,6 +212,79 @@ def is_host_resolvable(hostname: str) -> bool:
         return False
 
 def reverse_geocode(lat, lon, user):
+    """
+    Resolve the region and city of a point. Answers from the local world travel
+    data when possible and only calls the remote provider as a fallback.
+    """
+    local_result = reverse_geocode_local(lat, lon, user)
+    if "error" not in local_result:
+        return local_result
+    return reverse_geocode_remote(lat, lon, user)
+
+def reverse_geocode_local(lat, lon, user):
+    """
+    Offline resolver using a nearest-neighbour search over the spatially indexed
+    city points (and region centroids for regions without nearby cities).
+    Returns the same structure as extractIsoCode.
+    """
+    try:
+        point = Point(float(lon), float(lat), srid=4326)
+    except (TypeError, ValueError):
+        return {"error": "Invalid coordinates"}
+
+    nearest_city = (
+        City.objects.filter(point__isnull=False)
+        .select_related('region__country')
+        .annotate(distance=Distance('point', point))
+        .order_by(GeometryDistance('point', point))
+        .first()
+    )
+
+    city = None
+    region = None
+    if nearest_city:
+        distance_km = nearest_city.distance.km
+        if distance_km <= LOCAL_GEOCODE_CITY_RADIUS_KM:
+            city = nearest_city
+            region = nearest_city.region
+        elif distance_km <= LOCAL_GEOCODE_REGION_RADIUS_KM:
+            region = nearest_city.region
+
+    if region is None:
+        nearest_region = (
+            Region.objects.filter(point__isnull=False)
+            .select_related('country')
+            .annotate(distance=Distance('point', point))
+            .order_by(GeometryDistance('point', point))
+            .first()
+        )
+        if nearest_region and nearest_region.distance.km <= LOCAL_GEOCODE_REGION_RADIUS_KM:
+            region = nearest_region
+
+    if region is None:
+        return {"error": "No region found"}
+
+    return _build_geocode_result(user, region, city)
+
+def _build_geocode_result(user, region, city, location_name=None):
+    country_code = region.id[:2]
+    region_visited = VisitedRegion.objects.filter(region=region, user=user).exists()
+    city_visited = bool(city) and VisitedCity.objects.filter(city=city, user=user).exists()
+    display_name = f"{city.name}, {region.name}, {country_code}" if city else None
+    return {
+        "region_id": region.id,
+        "region": region.name,
+        "country": region.country.name,
+        "country_id": region.country.country_code,
+        "region_visited": region_visited,
+        "display_name": display_name,
+        "city": city.name if city else None,
+        "city_id": city.id if city else None,
+        "city_visited": city_visited,
+        "location_name": location_name,
+    }
+
+def reverse_geocode_remote(lat, lon, user):
     if getattr(settings, 'GOOGLE_MAPS_API_KEY', None):
         google_result = reverse_geocode_google(lat, lon, user)
         if "error" not in google_result:
@@ -209,13 +299,17 @@ def reverse_geocode_osm(lat, lon, user):
     connect_timeout = 1
     read_timeout = 5
 
-    if not is_host_resolvable("nominatim.openstreetmap.org"):
-        return {"error": "DNS resolution failed"}
+    def fetch():
+        if not is_host_resolvable("nominatim.openstreetmap.org"):
+            return None
+        response = http_client.get(url, headers=headers, timeout=(connect_timeout, read_timeout))
+        response.raise_for_status()
+        return response.json()
 
     try:
-        response = requests.get(url, headers=headers, timeout=(connect_timeout, read_timeout))
-        response.raise_for_status()
-        data = response.json()
+        data = cached_lookup('nominatim', 'reverse', reverse_cache_key(lat, lon), fetch)
+        if data is None:
+            return {"error": "DNS resolution failed"}
         return extractIsoCode(user, data)
     except Exception:
         return {"error": "An internal error occurred while processing the request"}
@@ -228,12 +322,16 @@ def reverse_geocode_google(lat, lon, user):
     url = "https://maps.googleapis.com/maps/api/geocode/json"
     params = {"latlng": f"{lat},{lon}", "key": api_key}
 
-    try:
-        response = requests.get(url, params=params)
+    def fetch():
+        response = http_client.get(url, params=params)
         response.raise_for_status()
         data = response.json()
+        # Only successful responses are cached
+        return data if data.get("status") == "OK" else None
 
-        if data.get("status") != "OK":
+    try:
+        data = cached_lookup('google', 'reverse', reverse_cache_key(lat, lon), fetch)
+        if data is None:
             return {"error": "Geocoding failed"}
 
         # Convert Google schema to Nominatim-style for extractIsoCode
@@ -0,0 +1,225 @@
+"""
+Persistent background job queue.
+
+Jobs are stored as BackgroundJob rows and executed by a fixed-size pool of worker
+threads started with `python manage.py run_workers`. Pending jobs are deduplicated
+per (kind, dedupe_key), failures are retried with exponential backoff and jitter,
+and jobs left "running" by a crashed worker are picked up again once their lease
+expires.
+"""
+import logging
+import random
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, close_old_connections, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from adventures.models import BackgroundJob
+
+logger = logging.getLogger(__name__)
+
+# Job kind -> dotted path of the callable that runs it. The callable receives the
+# job payload as keyword arguments.
+JOB_HANDLERS = {
+    'geocode_location': 'adventures.models.background_geocode_and_assign',
+    'refresh_visited_status': 'adventures.utils.get_is_visited.refresh_all_visited_status',
+    'build_backup_export': 'adventures.utils.backup_export.build_backup_export',
+    'cleanup_backup_exports': 'adventures.utils.backup_export.cleanup_backup_exports',
+    'process_image': 'adventures.utils.image_processing.process_image',
+    'cleanup_blobs': 'adventures.utils.blobs.cleanup_blobs',
+    'prune_immich_cache': 'integrations.immich_cache.prune_immich_cache',
+    'refresh_poi_tiles': 'adventures.utils.poi_cache.refresh_poi_tiles',
+    'convert_gpx_geometries': 'adventures.utils.geojson.convert_gpx_geometries',
+}
+
+# Job kind -> interval in seconds. The workers keep one pending job of each kind queued.
+PERIODIC_JOBS = {
+    'refresh_visited_status': getattr(settings, 'VISITED_STATUS_REFRESH_INTERVAL', 60 * 60),
+    'cleanup_backup_exports': 60 * 60,
+    'cleanup_blobs': 60 * 60,
+    'prune_immich_cache': 10 * 60,
+}
+PERIODIC_SCHEDULE_INTERVAL = 60  # seconds between checks that periodic jobs are queued
+
+RETRY_BASE_DELAY = 30  # seconds
+RETRY_MAX_DELAY = 60 * 60  # 1 hour
+LEASE_TIMEOUT = getattr(settings, 'JOB_QUEUE_LEASE_TIMEOUT', 60 * 15)  # 15 minutes
+
+
+def enqueue_job(kind, dedupe_key, payload=None, delay=0):
+    """
+    Queue a job unless an identical one is already pending.
+    Returns the pending BackgroundJob.
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+
+    defaults = {
+        'payload': payload or {},
+        'run_after': timezone.now() + timedelta(seconds=delay),
+    }
+    try:
+        with transaction.atomic():
+            job, _ = BackgroundJob.objects.get_or_create(
+                kind=kind,
+                dedupe_key=dedupe_key,
+                status=BackgroundJob.STATUS_PENDING,
+                defaults=defaults,
+            )
+    except IntegrityError:
+        # Another request queued the same job concurrently
+        job = BackgroundJob.objects.filter(
+            kind=kind, dedupe_key=dedupe_key, status=BackgroundJob.STATUS_PENDING
+        ).first()
+    return job
+
+
+def enqueue_jobs(kind, jobs):
+    """
+    Queue many jobs in a single INSERT. `jobs` is an iterable of
+    (dedupe_key, payload); keys that already have a pending job are skipped.
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+
+    now = timezone.now()
+    BackgroundJob.objects.bulk_create(
+        [BackgroundJob(kind=kind, dedupe_key=key, payload=payload or {}, run_after=now) for key, payload in jobs],
+        ignore_conflicts=True,
+    )
+
+
+def schedule_periodic_jobs():
+    """Queue the next run of every periodic job that has no pending run yet."""
+    for kind, interval in PERIODIC_JOBS.items():
+        enqueue_job(kind, 'periodic', delay=interval)
+
+
+def claim_next_job():
+    """Lock and mark the next runnable job as running, or return None."""
+    now = timezone.now()
+    lease_expired = now - timedelta(seconds=LEASE_TIMEOUT)
+
+    with transaction.atomic():
+        job = (
+            BackgroundJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                Q(status=BackgroundJob.STATUS_PENDING, run_after__lte=now) |
+                Q(status=BackgroundJob.STATUS_RUNNING, locked_at__lt=lease_expired)
+            )
+            .order_by('run_after')
+            .first()
+        )
+        if job is None:
+            return None
+
+        job.status = BackgroundJob.STATUS_RUNNING
+        job.locked_at = now
+        job.attempts += 1
+        job.save(update_fields=['status', 'locked_at', 'attempts', 'updated_at'])
+    return job
+
+
+def run_job(job):
+    """Execute a claimed job, deleting it on success and scheduling a retry on failure."""
+    try:
+        handler = import_string(JOB_HANDLERS[job.kind])
+        handler(**job.payload)
+    except Exception as e:
+        logger.warning(f"[Job Queue] {job.kind} ({job.dedupe_key}) failed on attempt {job.attempts}: {e}")
+        _handle_failure(job, e)
+    else:
+        job.delete()
+
+
+def _retry_delay(attempts):
+    """Exponential backoff with full jitter."""
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** (attempts - 1)))
+    return random.uniform(delay / 2, delay)
+
+
+def _handle_failure(job, error):
+    job.last_error = str(error)
+    job.locked_at = None
+
+    if job.attempts >= job.max_attempts:
+        job.status = BackgroundJob.STATUS_FAILED
+        job.save(update_fields=['status', 'locked_at', 'last_error', 'updated_at'])
+        logger.error(f"[Job Queue] {job.kind} ({job.dedupe_key}) gave up after {job.attempts} attempts")
+        return
+
+    job.status = BackgroundJob.STATUS_PENDING
+    job.run_after = timezone.now() + timedelta(seconds=_retry_delay(job.attempts))
+    try:
+        with transaction.atomic():
+            job.save(update_fields=['status', 'run_after', 'locked_at', 'last_error', 'updated_at'])
+    except IntegrityError:
+        # A fresh job for the same object was queued while this one ran; let it do the work
+        job.delete()
+
+
+class WorkerPool:
+    """Fixed number of threads, each polling the queue with its own DB connection."""
+
+    def __init__(self, num_workers, poll_interval=2.0, exit_when_empty=False):
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self.exit_when_empty = exit_when_empty
+        self._stop = threading.Event()
+        self._threads = []
+        self._schedule_lock = threading.Lock()
+        self._last_scheduled = float('-inf')
+
+    def start(self):
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self):
+        # Short timeouts keep the main thread responsive to signals
+        while any(thread.is_alive() for thread in self._threads):
+            for thread in self._threads:
+                thread.join(timeout=1)
+
+    def _schedule_periodic_jobs(self):
+        now = time.monotonic()
+        with self._schedule_lock:
+            if now - self._last_scheduled < PERIODIC_SCHEDULE_INTERVAL:
+                return
+            self._last_scheduled = now
+        schedule_periodic_jobs()
+
+    def _work(self):
+        try:
+            while not self._stop.is_set():
+                close_old_connections()
+                try:
+                    if not self.exit_when_empty:
+                        self._schedule_periodic_jobs()
+                    job = claim_next_job()
+                except DatabaseError as e:
+                    # e.g. the database is restarting or migrations have not run yet
+                    logger.error(f"[Job Queue] Could not claim job: {e}")
+                    connection.close()
+                    self._stop.wait(self.poll_interval)
+                    continue
+
+                if job is None:
+                    if self.exit_when_empty:
+                        return
+                    self._stop.wait(self.poll_interval)
+                    continue
+
+                run_job(job)
+        finally:
+            connection.close()
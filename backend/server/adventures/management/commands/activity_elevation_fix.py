@@ -1,21 +1,57 @@
 """
 Django management command to recalculate elevation data for all activities with GPX files.
 
+Activities are walked in primary key order. After every batch the last processed
+id is written to a checkpoint file, so an interrupted run continues where it
+stopped instead of starting from zero. The checkpoint is removed once a run
+completes.
+
 Usage:
-    python manage.py recalculate_elevation
-    python manage.py recalculate_elevation --dry-run
-    python manage.py recalculate_elevation --activity-id 123
+    python manage.py activity_elevation_fix
+    python manage.py activity_elevation_fix --dry-run
+    python manage.py activity_elevation_fix --activity-id <uuid>
+    python manage.py activity_elevation_fix --workers 4
+    python manage.py activity_elevation_fix --restart
 """
 
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction
+from django.db import connections, transaction
+from django.utils import timezone
+
 from adventures.models import Activity
-import gpxpy
-from typing import Tuple
-import logging
+from adventures.utils.track_analytics import analyze_gpx
 
 logger = logging.getLogger(__name__)
 
+ELEVATION_FIELDS = ['elevation_gain', 'elevation_loss', 'elev_high', 'elev_low']
+DEFAULT_CHECKPOINT = os.path.join(settings.BASE_DIR, '.activity_elevation_fix.checkpoint')
+
+
+def _analyze_file(task):
+    """
+    Runs in a worker process. Takes (activity id, file path or bytes) and returns
+    (activity id, elevation values or None, error message or None). Workers never
+    touch the database, they only parse GPX files.
+    """
+    activity_id, source = task
+    try:
+        if isinstance(source, bytes):
+            from io import BytesIO
+            stats = analyze_gpx(BytesIO(source), include_splits=False)
+        else:
+            with open(source, 'rb') as gpx_file:
+                stats = analyze_gpx(gpx_file, include_splits=False)
+        return activity_id, tuple(stats[field] for field in ELEVATION_FIELDS), None
+    except Exception as e:
+        return activity_id, None, str(e)
+
 
 class Command(BaseCommand):
     help = 'Recalculate elevation data for activities with GPX files'
@@ -28,7 +64,7 @@ class Command(BaseCommand):
         )
         parser.add_argument(
             '--activity-id',
-            type=int,
+            type=str,
             help='Recalculate elevation for a specific activity ID only',
         )
         parser.add_argument(
@@ -37,11 +73,29 @@ class Command(BaseCommand):
             default=100,
             help='Number of activities to process in each batch (default: 100)',
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of processes parsing GPX files in parallel (default: 1)',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default=DEFAULT_CHECKPOINT,
+            help='File storing the last processed activity id, used to resume interrupted runs',
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore an existing checkpoint and process all activities again',
+        )
 
     def handle(self, *args, **options):
         dry_run = options['dry_run']
         activity_id = options.get('activity_id')
-        batch_size = options['batch_size']
+        batch_size = max(1, options['batch_size'])
+        workers = max(1, options['workers'])
+        checkpoint_path = options['checkpoint']
 
         if dry_run:
             self.stdout.write(
@@ -50,47 +104,74 @@ class Command(BaseCommand):
 
         # Build queryset
         queryset = Activity.objects.filter(gpx_file__isnull=False).exclude(gpx_file='')
-        
+
         if activity_id:
             queryset = queryset.filter(id=activity_id)
             if not queryset.exists():
                 raise CommandError(f'Activity with ID {activity_id} not found or has no GPX file')
 
+        # Single activity and dry runs never read or write the checkpoint
+        use_checkpoint = not activity_id and not dry_run
+        if options['restart'] and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+        cursor = self._read_checkpoint(checkpoint_path) if use_checkpoint else None
+        if cursor:
+            self.stdout.write(self.style.WARNING(f'Resuming after activity {cursor} (use --restart to start over)'))
+            queryset = queryset.filter(id__gt=cursor)
+
         total_count = queryset.count()
-        
+
         if total_count == 0:
             self.stdout.write(
                 self.style.WARNING('No activities found with GPX files')
             )
+            if use_checkpoint:
+                self._clear_checkpoint(checkpoint_path)
             return
 
-        self.stdout.write(f'Found {total_count} activities with GPX files to process')
+        self.stdout.write(f'Found {total_count} activities with GPX files to process ({workers} worker(s))')
 
         updated_count = 0
         error_count = 0
-        
-        # Process in batches to avoid memory issues with large datasets
-        for i in range(0, total_count, batch_size):
-            batch = queryset[i:i + batch_size]
-            
-            for activity in batch:
-                try:
-                    if self._process_activity(activity, dry_run):
-                        updated_count += 1
-                    
-                    # Progress indicator
-                    if (updated_count + error_count) % 50 == 0:
-                        self.stdout.write(
-                            f'Processed {updated_count + error_count}/{total_count} activities...'
-                        )
-                        
-                except Exception as e:
-                    error_count += 1
-                    self.stdout.write(
-                        self.style.ERROR(
-                            f'Error processing activity {activity.id}: {str(e)}'
-                        )
-                    )
+        processed_count = 0
+        started = time.monotonic()
+
+        executor = None
+        if workers > 1:
+            # Forked workers must not share the parent's database connections
+            connections.close_all()
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+
+        try:
+            queryset = queryset.only('id', 'gpx_file', *ELEVATION_FIELDS).order_by('id')
+            while True:
+                batch = list(queryset.filter(id__gt=cursor)[:batch_size] if cursor else queryset[:batch_size])
+                if not batch:
+                    break
+
+                updated, errors = self._process_batch(batch, executor, dry_run)
+                updated_count += updated
+                error_count += errors
+                processed_count += len(batch)
+                cursor = batch[-1].id
+
+                if use_checkpoint:
+                    self._write_checkpoint(checkpoint_path, cursor)
+
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'Processed {processed_count}/{total_count} activities '
+                    f'({processed_count / elapsed if elapsed else 0:.1f} tracks/s)...'
+                )
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
+
+        if use_checkpoint:
+            self._clear_checkpoint(checkpoint_path)
+
+        elapsed = time.monotonic() - started
 
         # Summary
         self.stdout.write('\n' + '='*50)
@@ -106,65 +187,73 @@ class Command(BaseCommand):
                     f'Successfully updated {updated_count} activities'
                 )
             )
-        
+        self.stdout.write(
+            f'Processed {processed_count} tracks in {elapsed:.1f}s '
+            f'({processed_count / elapsed if elapsed else 0:.1f} tracks/s)'
+        )
+
         if error_count > 0:
             self.stdout.write(
                 self.style.WARNING(f'Encountered errors with {error_count} activities')
             )
 
-    def _process_activity(self, activity, dry_run=False):
-        """Process a single activity and return True if it was updated."""
-        try:
-            # Get elevation data from GPX file
-            elevation_gain, elevation_loss, elevation_high, elevation_low = \
-                self._get_elevation_data_from_gpx(activity.gpx_file)
-
-            # Check if values would actually change
-            current_values = (
-                getattr(activity, 'elevation_gain', None) or 0,
-                getattr(activity, 'elevation_loss', None) or 0,
-                getattr(activity, 'elev_high', None) or 0,
-                getattr(activity, 'elev_low', None) or 0,
-            )
-            
-            new_values = (elevation_gain, elevation_loss, elevation_high, elevation_low)
-            
+    def _process_batch(self, batch, executor, dry_run=False):
+        """Analyze a batch of activities and bulk update the changed ones. Returns (updated, errors)."""
+        tasks = [(activity.id, self._file_source(activity)) for activity in batch]
+        if executor:
+            results = executor.map(_analyze_file, tasks)
+        else:
+            results = map(_analyze_file, tasks)
+
+        activities = {activity.id: activity for activity in batch}
+        changed = []
+        error_count = 0
+        for activity_id, new_values, error in results:
+            activity = activities[activity_id]
+            if error:
+                error_count += 1
+                logger.error(f'Error processing activity {activity_id}: {error}')
+                self.stdout.write(
+                    self.style.ERROR(f'Error processing activity {activity_id}: {error}')
+                )
+                continue
+
+            current_values = tuple(getattr(activity, field) or 0 for field in ELEVATION_FIELDS)
+
             # Only update if values are different (with small tolerance for floating point)
-            if self._values_significantly_different(current_values, new_values):
-                
-                if dry_run:
-                    self.stdout.write(
-                        f'Activity {activity.id}: '
-                        f'gain: {current_values[0]:.1f} → {new_values[0]:.1f}, '
-                        f'loss: {current_values[1]:.1f} → {new_values[1]:.1f}, '
-                        f'high: {current_values[2]:.1f} → {new_values[2]:.1f}, '
-                        f'low: {current_values[3]:.1f} → {new_values[3]:.1f}'
-                    )
-                    return True
-                else:
-                    # Update the activity
-                    with transaction.atomic():
-                        activity.elevation_gain = elevation_gain
-                        activity.elevation_loss = elevation_loss
-                        activity.elev_high = elevation_high
-                        activity.elev_low = elevation_low
-                        activity.save(update_fields=[
-                            'elevation_gain', 'elevation_loss', 'elev_high', 'elev_low'
-                        ])
-                    
-                    self.stdout.write(
-                        f'Updated activity {activity.id}: '
-                        f'gain: {elevation_gain:.1f}m, loss: {elevation_loss:.1f}m, '
-                        f'high: {elevation_high:.1f}m, low: {elevation_low:.1f}m'
-                    )
-                    return True
+            if not self._values_significantly_different(current_values, new_values):
+                continue
+
+            if dry_run:
+                self.stdout.write(
+                    f'Activity {activity.id}: '
+                    f'gain: {current_values[0]:.1f} → {new_values[0]:.1f}, '
+                    f'loss: {current_values[1]:.1f} → {new_values[1]:.1f}, '
+                    f'high: {current_values[2]:.1f} → {new_values[2]:.1f}, '
+                    f'low: {current_values[3]:.1f} → {new_values[3]:.1f}'
+                )
             else:
-                # Values are the same, skip
-                return False
-                
-        except Exception as e:
-            logger.error(f'Error processing activity {activity.id}: {str(e)}')
-            raise
+                for field, value in zip(ELEVATION_FIELDS, new_values):
+                    setattr(activity, field, value)
+            changed.append(activity)
+
+        if changed and not dry_run:
+            # bulk_update does not run auto_now; delta exports pick rows up by updated_at
+            now = timezone.now()
+            for activity in changed:
+                activity.updated_at = now
+            with transaction.atomic():
+                Activity.objects.bulk_update(changed, [*ELEVATION_FIELDS, 'updated_at'])
+
+        return len(changed), error_count
+
+    def _file_source(self, activity):
+        """Path of the GPX file, or its bytes for storages without local paths."""
+        try:
+            return activity.gpx_file.path
+        except NotImplementedError:
+            with activity.gpx_file.open('rb') as gpx_file:
+                return gpx_file.read()
 
     def _values_significantly_different(self, current, new, tolerance=0.1):
         """Check if elevation values are significantly different."""
@@ -173,71 +262,20 @@ class Command(BaseCommand):
                 return True
         return False
 
-    def _get_elevation_data_from_gpx(self, gpx_file) -> Tuple[float, float, float, float]:
-        """
-        Extract elevation data from a GPX file.
-        Returns: (elevation_gain, elevation_loss, elevation_high, elevation_low)
-        """
+    def _read_checkpoint(self, path):
         try:
-            # Parse the GPX file
-            gpx_file.seek(0)  # Reset file pointer if needed
-            gpx = gpxpy.parse(gpx_file)
-            
-            elevations = []
-            
-            # Extract all elevation points from tracks and track segments
-            for track in gpx.tracks:
-                for segment in track.segments:
-                    for point in segment.points:
-                        if point.elevation is not None:
-                            elevations.append(point.elevation)
-            
-            # Also check waypoints for elevation data
-            for waypoint in gpx.waypoints:
-                if waypoint.elevation is not None:
-                    elevations.append(waypoint.elevation)
-            
-            # If no elevation data found, return zeros
-            if not elevations:
-                return 0.0, 0.0, 0.0, 0.0
-            
-            # Calculate basic stats
-            elevation_high = max(elevations)
-            elevation_low = min(elevations)
-            
-            # Calculate gain and loss by comparing consecutive points
-            elevation_gain = 0.0
-            elevation_loss = 0.0
-            
-            # Apply simple smoothing to reduce GPS noise (optional)
-            smoothed_elevations = self._smooth_elevations(elevations)
-            
-            for i in range(1, len(smoothed_elevations)):
-                diff = smoothed_elevations[i] - smoothed_elevations[i-1]
-                if diff > 0:
-                    elevation_gain += diff
-                else:
-                    elevation_loss += abs(diff)
-            
-            return elevation_gain, elevation_loss, elevation_high, elevation_low
-            
-        except Exception as e:
-            logger.error(f"Error parsing GPX file: {e}")
-            raise
-
-    def _smooth_elevations(self, elevations, window_size=3):
-        """
-        Apply simple moving average smoothing to reduce GPS elevation noise.
-        """
-        if len(elevations) < window_size:
-            return elevations
-        
-        smoothed = []
-        half_window = window_size // 2
-        
-        for i in range(len(elevations)):
-            start = max(0, i - half_window)
-            end = min(len(elevations), i + half_window + 1)
-            smoothed.append(sum(elevations[start:end]) / (end - start))
-        
-        return smoothed
\ No newline at end of file
+            with open(path) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _write_checkpoint(self, path, activity_id):
+        # Write then rename, so an interruption never leaves a truncated checkpoint
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(activity_id))
+        os.replace(tmp_path, path)
+
+    def _clear_checkpoint(self, path):
+        if os.path.exists(path):
+            os.remove(path)
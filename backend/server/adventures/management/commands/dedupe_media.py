@@ -0,0 +1,101 @@
+"""
+Django management command to move images, attachments and GPX files stored
+before content addressing to their content-addressed names (see
+adventures/utils/blobs.py), so identical files are stored once.
+
+Each file is hard-linked to its new name before the rows are updated and only
+removed afterwards, so the command can be interrupted and run again at any time.
+Renditions of moved images are deleted and rendered again on first request.
+
+Usage:
+    python manage.py dedupe_media
+    python manage.py dedupe_media --dry-run
+"""
+
+import os
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from adventures.models import Activity, ContentAttachment, ContentImage
+from adventures.utils import media_acl
+from adventures.utils.blobs import acquire_blobs, blob_name_for_file, is_blob_name
+from adventures.utils.image_derivatives import delete_derivatives
+
+# (model, file field, storage directory)
+MEDIA_FIELDS = [
+    (ContentImage, 'image', 'images'),
+    (ContentAttachment, 'file', 'attachments'),
+    (Activity, 'gpx_file', 'activities'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Store existing images, attachments and GPX files by content hash'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report how many files would be moved and how much space would be saved',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        started = time.monotonic()
+        moved_count = 0
+        duplicate_count = 0
+        saved_bytes = 0
+        missing_count = 0
+        seen = set()
+
+        for model, field, directory in MEDIA_FIELDS:
+            names = [
+                name for name in model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+                .values_list(field, flat=True).distinct().order_by().iterator(chunk_size=1000)
+                if not is_blob_name(name)
+            ]
+            self.stdout.write(f'{model.__name__}: {len(names)} files to move')
+
+            for processed, name in enumerate(names, start=1):
+                path = default_storage.path(name)
+                if not os.path.isfile(path):
+                    missing_count += 1
+                    self.stdout.write(self.style.WARNING(f'Missing file {name}, skipped'))
+                    continue
+
+                blob_name = blob_name_for_file(path, directory, os.path.splitext(name)[1])
+                target = default_storage.path(blob_name)
+                if blob_name in seen or os.path.exists(target):
+                    duplicate_count += 1
+                    saved_bytes += os.path.getsize(path)
+                seen.add(blob_name)
+                moved_count += 1
+                if dry_run:
+                    continue
+
+                try:
+                    os.link(path, target)
+                except FileExistsError:
+                    pass  # Same content is already stored
+                with transaction.atomic():
+                    updated = model.objects.filter(**{field: name}).update(**{field: blob_name})
+                    acquire_blobs([blob_name] * updated)
+                media_acl.forget_paths([name])
+                os.remove(path)
+                if directory == 'images':
+                    delete_derivatives(name)
+
+                if processed % 100 == 0:
+                    self.stdout.write(f'Processed {processed}/{len(names)} files...')
+
+        elapsed = time.monotonic() - started
+        verb = 'Would move' if dry_run else 'Moved'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {moved_count} files in {elapsed:.1f}s; {duplicate_count} duplicates, '
+            f'{saved_bytes / (1024 * 1024):.1f} MB saved'
+        ))
+        if missing_count:
+            self.stdout.write(self.style.WARNING(f'{missing_count} files referenced by the database are missing'))
@@ -0,0 +1,130 @@
+"""
+Django management command to render the resized renditions (thumb, card, full)
+of existing images.
+
+Renditions are otherwise rendered on their first request; running this after
+an upgrade or a restore keeps the first page views fast. Existing renditions are
+skipped unless --force is given.
+
+Usage:
+    python manage.py image_derivatives
+    python manage.py image_derivatives --workers 4
+    python manage.py image_derivatives --rendition thumb --rendition card
+    python manage.py image_derivatives --format avif
+    python manage.py image_derivatives --force
+"""
+
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from PIL import features
+
+from adventures.models import ContentImage
+from adventures.utils.image_derivatives import (
+    DERIVATIVE_FORMATS, RENDITIONS, derivative_format, derivative_name, generate_derivative,
+)
+
+
+def _render(task):
+    """
+    Runs in a worker process. Takes (original name, renditions, format, force) and
+    returns (original name, renditions rendered, error message or None).
+    """
+    original_name, renditions, fmt, force = task
+    rendered = 0
+    try:
+        if not default_storage.exists(original_name):
+            return original_name, 0, 'original file is missing'
+        for rendition in renditions:
+            if force or not default_storage.exists(derivative_name(original_name, rendition, fmt)):
+                generate_derivative(original_name, rendition, fmt)
+                rendered += 1
+        return original_name, rendered, None
+    except Exception as e:
+        return original_name, rendered, str(e)
+
+
+class Command(BaseCommand):
+    help = 'Render resized renditions of all uploaded images'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rendition',
+            action='append',
+            choices=list(RENDITIONS),
+            help='Rendition to render, may be repeated (default: all)',
+        )
+        parser.add_argument(
+            '--format',
+            choices=list(DERIVATIVE_FORMATS),
+            help='Output format (default: IMAGE_DERIVATIVE_FORMAT)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of processes rendering images in parallel (default: 1)',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Render renditions again even if they already exist',
+        )
+
+    def handle(self, *args, **options):
+        renditions = options['rendition'] or list(RENDITIONS)
+        fmt = options['format'] or derivative_format()
+        workers = max(1, options['workers'])
+
+        if fmt == 'avif' and not features.check('avif'):
+            raise CommandError('This Pillow build cannot write AVIF images')
+
+        names = list(
+            ContentImage.objects.exclude(image='').exclude(image__isnull=True)
+            .values_list('image', flat=True)
+        )
+        if not names:
+            self.stdout.write(self.style.WARNING('No images found'))
+            return
+
+        self.stdout.write(
+            f'Rendering {", ".join(renditions)} ({fmt}) for {len(names)} images ({workers} worker(s))'
+        )
+        tasks = [(name, renditions, fmt, options['force']) for name in names]
+
+        executor = None
+        if workers > 1:
+            # Forked workers must not share the parent's database connections
+            connections.close_all()
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+
+        rendered_count = 0
+        error_count = 0
+        started = time.monotonic()
+        try:
+            results = executor.map(_render, tasks, chunksize=16) if executor else map(_render, tasks)
+            for processed, (name, rendered, error) in enumerate(results, start=1):
+                rendered_count += rendered
+                if error:
+                    error_count += 1
+                    self.stdout.write(self.style.ERROR(f'Error rendering {name}: {error}'))
+                if processed % 100 == 0:
+                    elapsed = time.monotonic() - started
+                    self.stdout.write(
+                        f'Processed {processed}/{len(names)} images '
+                        f'({processed / elapsed if elapsed else 0:.1f} images/s)...'
+                    )
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Rendered {rendered_count} renditions for {len(names)} images in {elapsed:.1f}s'
+        ))
+        if error_count:
+            self.stdout.write(self.style.WARNING(f'Encountered errors with {error_count} images'))
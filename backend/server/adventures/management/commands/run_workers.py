@@ -0,0 +1,61 @@
+"""
+Django management command to run the background job workers.
+
+Usage:
+    python manage.py run_workers
+    python manage.py run_workers --workers 4
+    python manage.py run_workers --once
+"""
+
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from adventures.jobs import WorkerPool
+
+
+class Command(BaseCommand):
+    help = 'Run a fixed-size pool of workers that process queued background jobs (geocoding, ...)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=getattr(settings, 'JOB_QUEUE_WORKERS', 2),
+            help='Number of worker threads (default: JOB_QUEUE_WORKERS setting)',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=2.0,
+            help='Seconds to wait between polls when the queue is empty (default: 2)',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Drain the queue and exit instead of polling forever',
+        )
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if workers < 1:
+            raise CommandError('--workers must be at least 1')
+
+        pool = WorkerPool(
+            num_workers=workers,
+            poll_interval=options['poll_interval'],
+            exit_when_empty=options['once'],
+        )
+
+        def _shutdown(signum, frame):
+            self.stdout.write(self.style.WARNING('Stopping workers after their current job...'))
+            pool.stop()
+
+        signal.signal(signal.SIGTERM, _shutdown)
+        signal.signal(signal.SIGINT, _shutdown)
+
+        self.stdout.write(f'Starting {workers} job worker(s)')
+        pool.start()
+        pool.join()
+        self.stdout.write(self.style.SUCCESS('Job workers stopped'))
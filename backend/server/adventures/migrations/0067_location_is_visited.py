@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adventures', '0066_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='is_visited',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='location',
+            index=models.Index(fields=['user', 'is_visited'], name='location_user_visited_idx'),
+        ),
+        migrations.RunSQL(
+            sql="""
+                UPDATE adventures_location l
+                SET is_visited = EXISTS (
+                    SELECT 1 FROM adventures_visit v
+                    WHERE v.location_id = l.id
+                    AND (v.start_date AT TIME ZONE 'UTC')::date <= (now() AT TIME ZONE 'UTC')::date
+                );
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,34 @@
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adventures', '0067_location_is_visited'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GpxGeometry',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, unique=True)),
+                ('content_hash', models.CharField(max_length=64, unique=True)),
+                ('geojson', models.JSONField()),
+                ('simplified', models.JSONField(default=dict)),
+                ('point_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='gpx_geometry',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='adventures.gpxgeometry'),
+        ),
+        migrations.AddField(
+            model_name='contentattachment',
+            name='gpx_geometry',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='adventures.gpxgeometry'),
+        ),
+    ]
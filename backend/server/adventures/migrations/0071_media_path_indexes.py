@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adventures', '0070_delta_backups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contentimage',
+            index=models.Index(fields=['image'], name='contentimage_image_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contentattachment',
+            index=models.Index(fields=['file'], name='contentattachment_file_idx'),
+        ),
+    ]
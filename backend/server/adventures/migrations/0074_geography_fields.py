@@ -0,0 +1,64 @@
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+def _point(longitude, latitude):
+    return f"ST_SetSRID(ST_MakePoint({longitude}, {latitude}), 4326)::geography"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adventures', '0073_blob'),
+    ]
+
+    operations = [
+        # Geography fields get a GiST index (spatial_index defaults to True)
+        migrations.AddField(
+            model_name='location',
+            name='point',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, editable=False, geography=True, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='lodging',
+            name='point',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, editable=False, geography=True, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='transportation',
+            name='origin_point',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, editable=False, geography=True, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='transportation',
+            name='destination_point',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, editable=False, geography=True, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='transportation',
+            name='route',
+            field=django.contrib.gis.db.models.fields.LineStringField(blank=True, editable=False, geography=True, null=True, srid=4326),
+        ),
+        # Backfill the indexed columns from the existing coordinates
+        migrations.RunSQL(
+            sql=f"""
+                UPDATE adventures_location
+                SET point = {_point('longitude', 'latitude')}
+                WHERE longitude IS NOT NULL AND latitude IS NOT NULL;
+                UPDATE adventures_lodging
+                SET point = {_point('longitude', 'latitude')}
+                WHERE longitude IS NOT NULL AND latitude IS NOT NULL;
+                UPDATE adventures_transportation
+                SET origin_point = {_point('origin_longitude', 'origin_latitude')}
+                WHERE origin_longitude IS NOT NULL AND origin_latitude IS NOT NULL;
+                UPDATE adventures_transportation
+                SET destination_point = {_point('destination_longitude', 'destination_latitude')}
+                WHERE destination_longitude IS NOT NULL AND destination_latitude IS NOT NULL;
+                UPDATE adventures_transportation
+                SET route = ST_MakeLine(origin_point::geometry, destination_point::geometry)::geography
+                WHERE origin_point IS NOT NULL AND destination_point IS NOT NULL
+                    AND NOT ST_Equals(origin_point::geometry, destination_point::geometry);
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
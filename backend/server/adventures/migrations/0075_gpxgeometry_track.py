@@ -0,0 +1,33 @@
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adventures', '0074_geography_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gpxgeometry',
+            name='track',
+            field=django.contrib.gis.db.models.fields.MultiLineStringField(blank=True, null=True, srid=4326),
+        ),
+        # Backfill the indexed tracks from the stored GeoJSON
+        migrations.RunSQL(
+            sql="""
+                UPDATE adventures_gpxgeometry
+                SET track = lines.track
+                FROM (
+                    SELECT g.id, ST_Multi(ST_Collect(ST_Force2D(ST_SetSRID(ST_GeomFromGeoJSON(feature->'geometry'), 4326)))) AS track
+                    FROM adventures_gpxgeometry g,
+                        jsonb_array_elements(g.geojson->'features') AS feature
+                    WHERE jsonb_array_length(feature->'geometry'->'coordinates') >= 2
+                    GROUP BY g.id
+                ) AS lines
+                WHERE adventures_gpxgeometry.id = lines.id;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+def queue_gpx_conversion(apps, schema_editor):
+    """Convert the GPX files stored before conversions were kept in a worker, not on their first read."""
+    ContentAttachment = apps.get_model('adventures', 'ContentAttachment')
+    Activity = apps.get_model('adventures', 'Activity')
+    BackgroundJob = apps.get_model('adventures', 'BackgroundJob')
+
+    pending = (
+        ContentAttachment.objects.filter(gpx_geometry__isnull=True, file__iendswith='.gpx').exists()
+        or Activity.objects.filter(gpx_geometry__isnull=True, gpx_file__isnull=False).exclude(gpx_file='').exists()
+    )
+    if pending:
+        BackgroundJob.objects.get_or_create(
+            kind='convert_gpx_geometries', dedupe_key='convert_gpx_geometries', status='pending',
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adventures', '0075_gpxgeometry_track'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gpxgeometry',
+            name='error',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.RunPython(queue_gpx_conversion, migrations.RunPython.noop),
+    ]
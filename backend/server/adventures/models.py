@@ -4,58 +4,80 @@ import uuid
 from django.db import models
 from django.utils.deconstruct import deconstructible
 from adventures.managers import LocationManager
-import threading
+import logging
 from django.contrib.auth import get_user_model
 from django.contrib.postgres.fields import ArrayField
 from django.forms import ValidationError
 from django_resized import ResizedImageField
-from worldtravel.models import City, Country, Region, VisitedCity, VisitedRegion
+from worldtravel.models import City, Country, Region, VisitedCity, VisitedRegion, point_from_lat_lon
+from django.contrib.gis.db import models as gis_models
+from django.contrib.gis.geos import LineString
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from adventures.utils.timezones import TIMEZONES
 from adventures.utils.sports_types import SPORT_TYPE_CHOICES
-from adventures.utils.get_is_visited import is_location_visited
+from adventures.utils.get_is_visited import visited_exists
+from adventures.utils.image_derivatives import delete_derivatives
+from adventures.utils.blobs import acquire_blobs, is_blob_name, release_blobs
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericRelation
+from django.db.models import Q
+
+logger = logging.getLogger(__name__)
+
+class GeocodeError(Exception):
+    """Raised when the geocoding provider could not be reached, so the job is retried."""
+
 
 def background_geocode_and_assign(location_id: str):
-    print(f"[Location Geocode Thread] Starting geocode for location {location_id}")
-    try:
-        location = Location.objects.get(id=location_id)
-        if not (location.latitude and location.longitude):
+    """
+    Resolve the city/region/country of a location and mark them as visited.
+
+    Runs as the `geocode_location` background job (see adventures.jobs); provider
+    failures raise GeocodeError so the job queue can retry with backoff.
+    """
+    logger.info(f"[Location Geocode] Starting geocode for location {location_id}")
+    location = Location.objects.filter(id=location_id).select_related('user').first()
+    if not location or not (location.latitude and location.longitude):
+        return
+
+    from adventures.geocoding import reverse_geocode  # or wherever you defined it
+    is_visited = location.is_visited_status()
+    result = reverse_geocode(location.latitude, location.longitude, location.user)
+
+    if 'error' in result:
+        # "No region found" is a definitive answer, anything else is a provider failure
+        if result['error'] == 'No region found':
             return
-        
-        from adventures.geocoding import reverse_geocode  # or wherever you defined it
-        is_visited = location.is_visited_status()
-        result = reverse_geocode(location.latitude, location.longitude, location.user)
-
-        if 'region_id' in result:
-            region = Region.objects.filter(id=result['region_id']).first()
-            if region:
-                location.region = region
-                if is_visited:
-                    VisitedRegion.objects.get_or_create(user=location.user, region=region)
-
-        if 'city_id' in result:
-            city = City.objects.filter(id=result['city_id']).first()
-            if city:
-                location.city = city
-                if is_visited:
-                    VisitedCity.objects.get_or_create(user=location.user, city=city)
-
-        if 'country_id' in result:
-            country = Country.objects.filter(country_code=result['country_id']).first()
-            if country:
-                location.country = country
-
-        # Save updated location info
-        # Save updated location info, skip geocode threading
-        location.save(update_fields=["region", "city", "country"], _skip_geocode=True)
-
-    except Exception as e:
-        # Optional: log or print the error
-        print(f"[Location Geocode Thread] Error processing {location_id}: {e}")
+        raise GeocodeError(result['error'])
+
+    if 'region_id' in result:
+        region = Region.objects.filter(id=result['region_id']).first()
+        if region:
+            location.region = region
+            if is_visited:
+                VisitedRegion.objects.get_or_create(user=location.user, region=region)
+
+    if 'city_id' in result:
+        city = City.objects.filter(id=result['city_id']).first()
+        if city:
+            location.city = city
+            if is_visited:
+                VisitedCity.objects.get_or_create(user=location.user, city=city)
+
+    if 'country_id' in result:
+        country = Country.objects.filter(country_code=result['country_id']).first()
+        if country:
+            location.country = country
+
+    # Save updated location info, skip enqueueing another geocode job
+    location.save(update_fields=["region", "city", "country"], _skip_geocode=True)
+
+def enqueue_location_geocode(location_id):
+    """Queue a (deduplicated) geocode job for the given location."""
+    from adventures.jobs import enqueue_job
+    enqueue_job('geocode_location', str(location_id), {'location_id': str(location_id)})
 
 def validate_file_extension(value):
     import os
@@ -121,6 +143,26 @@ default_user = 1  # Replace with an actual user ID
 
 User = get_user_model()
 
+class GeographyMixin:
+    """
+    Keeps the spatially indexed geography columns (SRID 4326, GiST) in sync with
+    the lat/lon DecimalFields, so bounding box, radius and nearest-neighbour
+    queries are index scans. Bulk writes must call sync_geometry() themselves.
+    """
+    COORDINATE_FIELDS = ()
+    GEOMETRY_FIELDS = ()
+
+    def geometry_values(self):
+        raise NotImplementedError
+
+    def sync_geometry(self, update_fields=None):
+        """Set the geography fields; returns update_fields extended by them if coordinates are being saved."""
+        for field, value in self.geometry_values().items():
+            setattr(self, field, value)
+        if update_fields is not None and set(update_fields) & set(self.COORDINATE_FIELDS):
+            update_fields = [*update_fields, *self.GEOMETRY_FIELDS]
+        return update_fields
+
 class Visit(models.Model):
     id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True, primary_key=True)
     location = models.ForeignKey('Location', on_delete=models.CASCADE, related_name='visits')
@@ -160,7 +202,7 @@ class Visit(models.Model):
     def __str__(self):
         return f"{self.location.name} - {self.start_date} to {self.end_date}"
 
-class Location(models.Model):
+class Location(GeographyMixin, models.Model):
     id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True, primary_key=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, default=default_user)
     category = models.ForeignKey('Category', on_delete=models.SET_NULL, blank=True, null=True)
@@ -173,6 +215,8 @@ class Location(models.Model):
     is_public = models.BooleanField(default=False)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    # Spatially indexed copy of latitude/longitude, see GeographyMixin
+    point = gis_models.PointField(geography=True, srid=4326, null=True, blank=True, editable=False)
     city = models.ForeignKey(City, on_delete=models.SET_NULL, blank=True, null=True)
     region = models.ForeignKey(Region, on_delete=models.SET_NULL, blank=True, null=True)
     country = models.ForeignKey(Country, on_delete=models.SET_NULL, blank=True, null=True)
@@ -217,6 +261,9 @@ class Location(models.Model):
     best_season_end = models.IntegerField(null=True, blank=True, help_text="Best season end month (1-12)")
 
     collections = models.ManyToManyField('Collection', blank=True, related_name='locations')
+    # Denormalized from visits; kept current by the Visit signals and the
+    # periodic refresh_visited_status job (visits starting in the future)
+    is_visited = models.BooleanField(default=False, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -226,8 +273,19 @@ class Location(models.Model):
 
     objects = LocationManager()
 
+    COORDINATE_FIELDS = ('latitude', 'longitude')
+    GEOMETRY_FIELDS = ('point',)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "is_visited"], name="location_user_visited_idx"),
+        ]
+
     def is_visited_status(self):
-        return is_location_visited(self)
+        return self.is_visited
+
+    def geometry_values(self):
+        return {'point': point_from_lat_lon(self.latitude, self.longitude)}
 
     def clean(self, skip_shared_validation=False):
         """
@@ -267,6 +325,11 @@ class Location(models.Model):
             )
             self.category = category
 
+        # Recompute rather than trust the in-memory flag, which may predate visit changes
+        if not self._state.adding and (update_fields is None or 'is_visited' in update_fields):
+            self.is_visited = Location.objects.filter(pk=self.pk).filter(visited_exists()).exists()
+
+        update_fields = self.sync_geometry(update_fields)
         result = super().save(force_insert, force_update, using, update_fields)
 
         # Validate collections after saving (since M2M relationships require saved instance)
@@ -278,14 +341,12 @@ class Location(models.Model):
                 # For now, we'll re-raise the error
                 raise e
 
-        # ⛔ Skip threading if called from geocode background thread
+        # ⛔ Skip queueing if called from the geocode job itself
         if _skip_geocode:
             return result
 
         if self.latitude and self.longitude:
-            thread = threading.Thread(target=background_geocode_and_assign, args=(str(self.id),))
-            thread.daemon = True  # Allows the thread to exit when the main program ends
-            thread.start()
+            enqueue_location_geocode(self.id)
 
         return result
 
@@ -379,7 +440,7 @@ class Collection(models.Model):
     def __str__(self):
         return self.name
     
-class Transportation(models.Model):
+class Transportation(GeographyMixin, models.Model):
     id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True, primary_key=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, default=default_user)
     type = models.CharField(max_length=100, choices=TRANSPORTATION_TYPES)
@@ -397,6 +458,10 @@ class Transportation(models.Model):
     origin_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     destination_latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     destination_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    # Spatially indexed copies of the coordinates, see GeographyMixin
+    origin_point = gis_models.PointField(geography=True, srid=4326, null=True, blank=True, editable=False)
+    destination_point = gis_models.PointField(geography=True, srid=4326, null=True, blank=True, editable=False)
+    route = gis_models.LineStringField(geography=True, srid=4326, null=True, blank=True, editable=False)
     to_location = models.CharField(max_length=200, blank=True, null=True)
     is_public = models.BooleanField(default=False)
     collection = models.ForeignKey('Collection', on_delete=models.CASCADE, blank=True, null=True)
@@ -407,6 +472,20 @@ class Transportation(models.Model):
     images = GenericRelation('ContentImage', related_query_name='transportation')
     attachments = GenericRelation('ContentAttachment', related_query_name='transportation')
 
+    COORDINATE_FIELDS = ('origin_latitude', 'origin_longitude', 'destination_latitude', 'destination_longitude')
+    GEOMETRY_FIELDS = ('origin_point', 'destination_point', 'route')
+
+    def geometry_values(self):
+        origin = point_from_lat_lon(self.origin_latitude, self.origin_longitude)
+        destination = point_from_lat_lon(self.destination_latitude, self.destination_longitude)
+        # Geography lines follow the great circle, like a flight
+        route = LineString(origin, destination, srid=4326) if origin and destination and origin != destination else None
+        return {'origin_point': origin, 'destination_point': destination, 'route': route}
+
+    def save(self, *args, **kwargs):
+        kwargs['update_fields'] = self.sync_geometry(kwargs.get('update_fields'))
+        super().save(*args, **kwargs)
+
     def clean(self):
         if self.date and self.end_date and self.date > self.end_date:
             raise ValidationError('The start date must be before the end date. Start date: ' + str(self.date) + ' End date: ' + str(self.end_date))
@@ -515,8 +594,77 @@ class PathAndRename:
         filename = f"{uuid.uuid4()}.{ext}"
         return os.path.join(self.path, filename)
 
-class ContentImage(models.Model):
+class Blob(models.Model):
+    """
+    A content-addressed file (see adventures/utils/blobs.py) and the number of
+    objects referencing it. Unreferenced files are deleted by the cleanup_blobs job.
+    """
+    id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True, primary_key=True)
+    name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.BigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    released_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["ref_count", "released_at"], name="blob_unreferenced_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} references)"
+
+class BlobFileMixin:
+    """
+    Keeps Blob reference counts in sync with the files stored in `blob_file_fields`:
+    a reference is taken when a file is set and released when it is replaced.
+    Deletions release their references in a post_delete signal, so queryset and
+    cascade deletes are covered as well.
+    """
+    blob_file_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._blob_names = {
+            field: getattr(instance, field).name for field in cls.blob_file_fields if field in field_names
+        }
+        return instance
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        self.sync_blob_references(adding)
+
+    def sync_blob_references(self, adding=False):
+        stored = getattr(self, '_blob_names', {})
+        acquired, released = [], []
+        for field in self.blob_file_fields:
+            if field not in stored and not adding:
+                continue  # Deferred and never loaded, so unchanged
+            name = getattr(self, field).name or None
+            if name != stored.get(field):
+                acquired.append(name)
+                released.append(stored.get(field))
+            stored[field] = name
+        self._blob_names = stored
+        if acquired:
+            acquire_blobs(acquired)
+            release_blobs(released)
+
+class ContentImage(BlobFileMixin, models.Model):
     """Generic image model that can be attached to any content type"""
+    # Uploads are stored as received and resized by a background job (adventures/utils/image_processing.py)
+    STATUS_PROCESSING = 'processing'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_READY, 'Ready'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
     id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True, primary_key=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, default=default_user)
     image = ResizedImageField(
@@ -528,17 +676,29 @@ class ContentImage(models.Model):
     )
     immich_id = models.CharField(max_length=200, null=True, blank=True)
     is_primary = models.BooleanField(default=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_READY)
+
+    # Read from the EXIF data of uploads
+    taken_at = models.DateTimeField(null=True, blank=True)
+    latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     
     # Generic foreign key fields
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, related_name='content_images')
     object_id = models.UUIDField()
     content_object = GenericForeignKey('content_type', 'object_id')
 
+    updated_at = models.DateTimeField(auto_now=True)
+
+    blob_file_fields = ('image',)
+
     class Meta:
         verbose_name = "Content Image"
         verbose_name_plural = "Content Images"
         indexes = [
             models.Index(fields=["content_type", "object_id"]),
+            # Permission checks for unsigned media URLs look images up by path
+            models.Index(fields=["image"], name="contentimage_image_idx"),
         ]
 
     def clean(self):
@@ -562,36 +722,117 @@ class ContentImage(models.Model):
         super().save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
-        # Remove file from disk when deleting image
-        if self.image and os.path.isfile(self.image.path):
-            os.remove(self.image.path)
+        # Content-addressed files may be shared and are released in post_delete instead
+        if self.image and not is_blob_name(self.image.name):
+            if os.path.isfile(self.image.path):
+                os.remove(self.image.path)
+            delete_derivatives(self.image.name)
         super().delete(*args, **kwargs)
 
     def __str__(self):
         content_name = getattr(self.content_object, 'name', 'Unknown')
         return f"Image for {self.content_type.model}: {content_name}"
 
-class ContentAttachment(models.Model):
+class GpxGeometry(models.Model):
+    """
+    GeoJSON converted from a GPX file, with Douglas-Peucker simplified variants.
+    Shared by every activity/attachment whose file has the same content hash.
+    Files that cannot be parsed get a row with `error` set, so they are parsed once.
+    """
+    LEVELS = ['high', 'medium', 'low']
+    DEFAULT_LEVEL = 'medium'
+
+    id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True, primary_key=True)
+    content_hash = models.CharField(max_length=64, unique=True)
+    geojson = models.JSONField()
+    simplified = models.JSONField(default=dict)  # level -> FeatureCollection
+    # Spatially indexed copy of the full track, used for vector tiles
+    track = gis_models.MultiLineStringField(srid=4326, null=True, blank=True)
+    point_count = models.IntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def for_level(self, level):
+        """Full resolution for 'full', otherwise the requested (or default) simplified level."""
+        if self.error:
+            return {"error": self.error, "message": "Failed to convert GPX to GeoJSON"}
+        if level == 'full':
+            return self.geojson
+        if level not in self.LEVELS:
+            level = self.DEFAULT_LEVEL
+        return self.simplified.get(level, self.geojson)
+
+    def __str__(self):
+        return f"GPX geometry {self.content_hash[:12]} ({self.point_count} points)"
+
+class GpxGeometryMixin:
+    """
+    Keeps `gpx_geometry` in sync with the GPX file stored in `gpx_field_name`,
+    converting it once when the file is uploaded or replaced.
+    """
+    gpx_field_name = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if cls.gpx_field_name in field_names:
+            instance._gpx_geometry_source = getattr(instance, cls.gpx_field_name).name
+        return instance
+
+    def is_gpx_file(self):
+        field_file = getattr(self, self.gpx_field_name)
+        return bool(field_file) and field_file.name.lower().endswith('.gpx')
+
+    def sync_gpx_geometry(self, force=False):
+        field_file = getattr(self, self.gpx_field_name)
+        name = field_file.name if field_file else None
+        if not force and getattr(self, '_gpx_geometry_source', None) == name:
+            return
+
+        from adventures.utils.geojson import get_gpx_geometry
+        geometry = None
+        if self.is_gpx_file():
+            try:
+                geometry = get_gpx_geometry(field_file)
+            except OSError as e:
+                logger.warning(f"Could not read GPX file {name}: {e}")
+
+        type(self).objects.filter(pk=self.pk).update(gpx_geometry=geometry)
+        self.gpx_geometry = geometry
+        self._gpx_geometry_source = name
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.sync_gpx_geometry()
+
+class ContentAttachment(BlobFileMixin, GpxGeometryMixin, models.Model):
     """Generic attachment model that can be attached to any content type"""
     id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True, primary_key=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, default=default_user)
     file = models.FileField(upload_to=PathAndRename('attachments/'), validators=[validate_file_extension])
     name = models.CharField(max_length=200, null=True, blank=True)
+    gpx_geometry = models.ForeignKey(GpxGeometry, on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+')
     
     # Generic foreign key fields
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, related_name='content_attachments')
     object_id = models.UUIDField()
     content_object = GenericForeignKey('content_type', 'object_id')
 
+    updated_at = models.DateTimeField(auto_now=True)
+
+    gpx_field_name = 'file'
+    blob_file_fields = ('file',)
+
     class Meta:
         verbose_name = "Content Attachment"
         verbose_name_plural = "Content Attachments"
         indexes = [
             models.Index(fields=["content_type", "object_id"]),
+            models.Index(fields=["file"], name="contentattachment_file_idx"),
         ]
 
     def delete(self, *args, **kwargs):
-        if self.file and os.path.isfile(self.file.path):
+        if self.file and not is_blob_name(self.file.name) and os.path.isfile(self.file.path):
             os.remove(self.file.path)
         super().delete(*args, **kwargs)
 
@@ -620,7 +861,7 @@ class Category(models.Model):
     def __str__(self):
         return self.name + ' - ' + self.display_name + ' - ' + self.icon
     
-class Lodging(models.Model):
+class Lodging(GeographyMixin, models.Model):
     id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True, primary_key=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, default=default_user)
     name = models.CharField(max_length=200)
@@ -635,6 +876,8 @@ class Lodging(models.Model):
     price = models.DecimalField(max_digits=9, decimal_places=2, blank=True, null=True)
     latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    # Spatially indexed copy of latitude/longitude, see GeographyMixin
+    point = gis_models.PointField(geography=True, srid=4326, null=True, blank=True, editable=False)
     location = models.CharField(max_length=200, blank=True, null=True)
     is_public = models.BooleanField(default=False)
     collection = models.ForeignKey('Collection', on_delete=models.CASCADE, blank=True, null=True)
@@ -645,6 +888,16 @@ class Lodging(models.Model):
     images = GenericRelation('ContentImage', related_query_name='lodging')
     attachments = GenericRelation('ContentAttachment', related_query_name='lodging')
 
+    COORDINATE_FIELDS = ('latitude', 'longitude')
+    GEOMETRY_FIELDS = ('point',)
+
+    def geometry_values(self):
+        return {'point': point_from_lat_lon(self.latitude, self.longitude)}
+
+    def save(self, *args, **kwargs):
+        kwargs['update_fields'] = self.sync_geometry(kwargs.get('update_fields'))
+        super().save(*args, **kwargs)
+
     def clean(self):
         if self.check_in and self.check_out and self.check_in > self.check_out:
             raise ValidationError('The start date must be before the end date. Start date: ' + str(self.check_in) + ' End date: ' + str(self.check_out))
@@ -681,6 +934,7 @@ class Trail(models.Model):
     wanderer_id = models.CharField("Wanderer Trail ID", max_length=100, blank=True, null=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = "Trail"
@@ -702,7 +956,7 @@ class Trail(models.Model):
     def __str__(self):
         return f"{self.name} ({'Wanderer' if self.wanderer_id else 'External'})"
     
-class Activity(models.Model):
+class Activity(BlobFileMixin, GpxGeometryMixin, models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, unique=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, default=default_user)
     visit = models.ForeignKey(Visit, on_delete=models.CASCADE, related_name='activities')
@@ -710,6 +964,7 @@ class Activity(models.Model):
 
     # GPX File
     gpx_file = models.FileField(upload_to=PathAndRename('activities/'), validators=[validate_file_extension], blank=True, null=True)
+    gpx_geometry = models.ForeignKey(GpxGeometry, on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+')
 
     # Descriptive
     name = models.CharField(max_length=200)
@@ -749,9 +1004,150 @@ class Activity(models.Model):
     # Optional links
     external_service_id = models.CharField(max_length=100, blank=True, null=True)  # E.g., Strava ID
 
+    updated_at = models.DateTimeField(auto_now=True)
+
+    gpx_field_name = 'gpx_file'
+    blob_file_fields = ('gpx_file',)
+
+    def is_gpx_file(self):
+        # Activity files are always GPX tracks, whatever their extension
+        return bool(self.gpx_file)
+
     def __str__(self):
         return f"{self.name} ({self.sport_type})"
 
     class Meta:
         verbose_name = "Activity"
-        verbose_name_plural = "Activities"
\ No newline at end of file
+        verbose_name_plural = "Activities"
+
+class BackgroundJob(models.Model):
+    """
+    Persistent unit of deferred work, executed by the `run_workers` management command.
+    At most one pending job exists per (kind, dedupe_key), so repeated saves of the
+    same object collapse into a single job.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, unique=True)
+    kind = models.CharField(max_length=100)
+    dedupe_key = models.CharField(max_length=255)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Background Job"
+        verbose_name_plural = "Background Jobs"
+        indexes = [
+            models.Index(fields=["status", "run_after"], name="backgroundjob_status_run_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["kind", "dedupe_key"],
+                condition=Q(status='pending'),
+                name="unique_pending_background_job",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} ({self.dedupe_key}) - {self.status}"
+
+
+class BackupExport(models.Model):
+    """
+    A backup archive built in the background. The finished ZIP is stored under
+    MEDIA_ROOT/exports/ and deleted once `expires_at` has passed.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='backup_exports')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    # Delta exports only contain changes made after this time
+    since = models.DateTimeField(blank=True, null=True)
+    # Storage name relative to MEDIA_ROOT, e.g. exports/<random>.zip
+    file = models.CharField(max_length=255, blank=True, null=True)
+    size = models.BigIntegerField(default=0)
+    files_total = models.PositiveIntegerField(default=0)
+    files_done = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+    expires_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "created_at"], name="backupexport_user_created_idx"),
+            models.Index(fields=["expires_at"], name="backupexport_expires_idx"),
+        ]
+
+    @property
+    def progress(self):
+        if self.status == self.STATUS_COMPLETED:
+            return 100
+        if not self.files_total:
+            return 0
+        return int(self.files_done * 100 / self.files_total)
+
+    def __str__(self):
+        return f"Backup export for {self.user.username} - {self.status}"
+
+
+class Tombstone(models.Model):
+    """
+    Record of a deleted object, so incremental (delta) backups can tell an
+    importer what to remove. Written by the post_delete signals in signals.py
+    and pruned after BACKUP_TOMBSTONE_RETENTION.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tombstones')
+    model = models.CharField(max_length=50)
+    object_id = models.UUIDField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "deleted_at"], name="tombstone_user_deleted_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.model} {self.object_id} deleted at {self.deleted_at}"
+
+
+# Models whose deletions are recorded as tombstones, by their name in backups
+TOMBSTONE_MODELS = {
+    'location': Location,
+    'visit': Visit,
+    'activity': Activity,
+    'trail': Trail,
+    'image': ContentImage,
+    'attachment': ContentAttachment,
+    'collection': Collection,
+    'transportation': Transportation,
+    'note': Note,
+    'checklist': Checklist,
+    'checklist_item': ChecklistItem,
+    'lodging': Lodging,
+}
@@ -1,28 +1,46 @@
 import os
-from .models import Location, ContentImage, ChecklistItem, Collection, Note, Transportation, Checklist, Visit, Category, ContentAttachment, Lodging, CollectionInvite, Trail, Activity
+from .models import Location, ContentImage, ChecklistItem, Collection, Note, Transportation, Checklist, Visit, Category, ContentAttachment, Lodging, CollectionInvite, Trail, Activity, GpxGeometry
+from django.db.models import Count, F, Prefetch, Q
 from rest_framework import serializers
 from main.utils import CustomModelSerializer
 from users.serializers import CustomUserDetailsSerializer
+from worldtravel.models import Country, Region, City
 from worldtravel.serializers import CountrySerializer, RegionSerializer, CitySerializer
 from geopy.distance import geodesic
 from integrations.models import ImmichIntegration
-from adventures.utils.geojson import gpx_to_geojson
+from adventures.utils.media_signing import signed_media_url
+from adventures.utils.image_derivatives import RENDITIONS, derivative_name
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def get_geometry_level(context):
+    """Track geometry level requested with ?geometry=full|high|medium|low (default: medium)."""
+    request = context.get('request')
+    level = request.query_params.get('geometry') if request is not None and hasattr(request, 'query_params') else None
+    return level or GpxGeometry.DEFAULT_LEVEL
+
+
+def get_track_geojson(obj, context):
+    """GeoJSON of an activity or attachment GPX file, from the stored conversion."""
+    if not obj.is_gpx_file() or obj.gpx_geometry is None:
+        # Files stored before conversions were kept are converted by the convert_gpx_geometries job
+        return None
+    return obj.gpx_geometry.for_level(get_geometry_level(context))
+
+
 class ContentImageSerializer(CustomModelSerializer):
     class Meta:
         model = ContentImage
-        fields = ['id', 'image', 'is_primary', 'user', 'immich_id']
-        read_only_fields = ['id', 'user']
+        fields = ['id', 'image', 'is_primary', 'user', 'immich_id', 'status', 'taken_at', 'latitude', 'longitude']
+        read_only_fields = ['id', 'user', 'status', 'taken_at', 'latitude', 'longitude']
 
     def to_representation(self, instance):
         # If immich_id is set, check for user integration once
         integration = None
         if instance.immich_id:
-            integration = ImmichIntegration.objects.filter(user=instance.user).first()
+            integration = self._get_immich_integration(instance.user_id)
             if not integration:
                 return None  # Skip if Immich image but no integration
 
@@ -34,12 +52,30 @@ class ContentImageSerializer(CustomModelSerializer):
 
         if instance.immich_id:
             # Use Immich integration URL
-            representation['image'] = f"{public_url}/api/integrations/immich/{integration.id}/get/{instance.immich_id}"
+            immich_url = f"{public_url}/api/integrations/immich/{integration.id}/get/{instance.immich_id}"
+            representation['image'] = immich_url
+            # Immich renders a small thumbnail and a larger preview
+            representation['srcset'] = {
+                rendition: immich_url if rendition != 'thumb' else f"{immich_url}?size=thumbnail"
+                for rendition in RENDITIONS
+            }
         elif instance.image:
-            # Use local image URL
-            representation['image'] = f"{public_url}/media/{instance.image.name}"
+            # Signed local image URL, served without a permission query
+            representation['image'] = signed_media_url(public_url, instance.image.name)
+            # Resized renditions for lists and cards, rendered on first request
+            representation['srcset'] = {
+                rendition: signed_media_url(public_url, derivative_name(instance.image.name, rendition))
+                for rendition in RENDITIONS
+            }
 
         return representation
+
+    def _get_immich_integration(self, user_id):
+        """Look up each user's integration once per serialization instead of once per image"""
+        integrations = self.context.setdefault('_immich_integrations', {})
+        if user_id not in integrations:
+            integrations[user_id] = ImmichIntegration.objects.filter(user_id=user_id).first()
+        return integrations[user_id]
     
 class AttachmentSerializer(CustomModelSerializer):
     extension = serializers.SerializerMethodField()
@@ -59,13 +95,11 @@ class AttachmentSerializer(CustomModelSerializer):
             #print(public_url)
             # remove any  ' from the url
             public_url = public_url.replace("'", "")
-            representation['file'] = f"{public_url}/media/{instance.file.name}"
+            representation['file'] = signed_media_url(public_url, instance.file.name)
         return representation
 
     def get_geojson(self, obj):
-        if obj.file and obj.file.name.endswith('.gpx'):
-            return gpx_to_geojson(obj.file)
-        return None
+        return get_track_geojson(obj, self.context)
     
 class CategorySerializer(serializers.ModelSerializer):
     num_locations = serializers.SerializerMethodField()
@@ -91,6 +125,9 @@ class CategorySerializer(serializers.ModelSerializer):
         return instance
     
     def get_num_locations(self, obj):
+        # Annotated by LocationSerializer.optimize_queryset when available
+        if hasattr(obj, 'location_count'):
+            return obj.location_count
         return Location.objects.filter(category=obj, user=obj.user).count()
     
 class TrailSerializer(CustomModelSerializer):
@@ -209,7 +246,7 @@ class ActivitySerializer(CustomModelSerializer):
         return representation
     
     def get_geojson(self, obj):
-        return gpx_to_geojson(obj.gpx_file)
+        return get_track_geojson(obj, self.context)
 
 class VisitSerializer(serializers.ModelSerializer):
 
@@ -260,25 +297,84 @@ class LocationSerializer(CustomModelSerializer):
         ]
         read_only_fields = ['id', 'created_at', 'updated_at', 'user', 'is_visited']
 
+    # Fields left out of the slim nested representation unless listed in allowed_nested_fields
+    NESTED_EXCLUDED_FIELDS = [
+        'visits', 'attachments', 'trails', 'collections',
+        'user', 'city', 'country', 'region'
+    ]
+
+    @classmethod
+    def _excluded_fields(cls, context):
+        if not context.get('nested', False):
+            return set()
+        allowed_nested_fields = set(context.get('allowed_nested_fields', []))
+        return {field for field in cls.NESTED_EXCLUDED_FIELDS if field not in allowed_nested_fields}
+
+    def get_fields(self):
+        # Drop excluded fields up front so they are never computed
+        fields = super().get_fields()
+        for field in self._excluded_fields(self.context):
+            fields.pop(field, None)
+        return fields
+
+    @classmethod
+    def optimize_queryset(cls, queryset, context=None):
+        """
+        Add the select_related/prefetch_related calls and count annotations needed
+        to serialize the locations in queryset with a fixed number of queries.
+        Only relations kept for the given context (nested, allowed_nested_fields)
+        are loaded.
+        """
+        context = context or {}
+        excluded = cls._excluded_fields(context)
+        request = context.get('request')
+        user = getattr(request, 'user', None)
+
+        prefetches = [
+            Prefetch('category', queryset=Category.objects.annotate(
+                location_count=Count('location', filter=Q(location__user=F('user')))
+            )),
+            Prefetch('images', queryset=ContentImage.objects.select_related('user')),
+        ]
+        # Only load the stored track variant that will be returned
+        unused_geometry = 'gpx_geometry__simplified' if get_geometry_level(context) == 'full' else 'gpx_geometry__geojson'
+        if 'visits' not in excluded:
+            prefetches.append(Prefetch('visits', queryset=Visit.objects.prefetch_related(
+                Prefetch('activities', queryset=Activity.objects.select_related('user', 'gpx_geometry').defer(unused_geometry))
+            )))
+        if 'attachments' not in excluded:
+            prefetches.append(Prefetch('attachments', queryset=ContentAttachment.objects.select_related('user', 'gpx_geometry').defer(unused_geometry)))
+        if 'trails' not in excluded:
+            prefetches.append(Prefetch('trails', queryset=Trail.objects.select_related('user')))
+        if 'collections' not in excluded:
+            prefetches.append('collections')
+        if 'country' not in excluded:
+            countries = Country.objects.annotate(region_count=Count('region', distinct=True))
+            if user and user.is_authenticated:
+                countries = countries.annotate(visit_count=Count(
+                    'region__visitedregion',
+                    filter=Q(region__visitedregion__user=user),
+                    distinct=True,
+                ))
+            prefetches.append(Prefetch('country', queryset=countries))
+        if 'region' not in excluded:
+            prefetches.append(Prefetch('region', queryset=Region.objects.select_related('country').annotate(
+                city_count=Count('city')
+            )))
+        if 'city' not in excluded:
+            prefetches.append(Prefetch('city', queryset=City.objects.select_related('region__country')))
+
+        return queryset.select_related('user').prefetch_related(*prefetches)
+
     # Makes it so the whole user object is returned in the serializer instead of just the user uuid
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        is_nested = self.context.get('nested', False)
-        allowed_nested_fields = set(self.context.get('allowed_nested_fields', []))
-
-        if not is_nested:
+        if not self.context.get('nested', False):
             # Full representation for standalone locations
             representation['user'] = CustomUserDetailsSerializer(instance.user, context=self.context).data
-        else:
-            # Slim representation for nested contexts, but keep allowed fields
-            fields_to_remove = [
-                'visits', 'attachments', 'trails', 'collections',
-                'user', 'city', 'country', 'region'
-            ]
-            for field in fields_to_remove:
-                # Keep field if explicitly allowed for nested mode
-                if field not in allowed_nested_fields:
-                    representation.pop(field, None)
+        elif 'user' in self._excluded_fields(self.context):
+            # CustomModelSerializer adds the user uuid back in
+            representation.pop('user', None)
 
         return representation
 
@@ -438,16 +534,65 @@ class LocationSerializer(CustomModelSerializer):
         return instance
     
 class MapPinSerializer(serializers.ModelSerializer):
-    is_visited = serializers.SerializerMethodField()
+    # Denormalized column, no per-pin visit lookup
+    is_visited = serializers.BooleanField(read_only=True)
     category = CategorySerializer(read_only=True, required=False)
     
     class Meta:
         model = Location
         fields = ['id', 'name', 'latitude', 'longitude', 'is_visited', 'category']
         read_only_fields = ['id', 'name', 'latitude', 'longitude', 'is_visited', 'category']
-    
-    def get_is_visited(self, obj):
-        return obj.is_visited_status()
+
+class NearbyLocationSerializer(MapPinSerializer):
+    distance_km = serializers.SerializerMethodField()
+
+    class Meta(MapPinSerializer.Meta):
+        fields = MapPinSerializer.Meta.fields + [
+            'location', 'is_public', 'elevation', 'difficulty_level', 'point_type', 'distance_km'
+        ]
+        read_only_fields = fields
+
+    def get_distance_km(self, obj):
+        return round(obj.distance.km, 3)
+
+
+class NearbyLodgingSerializer(serializers.ModelSerializer):
+    distance_km = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Lodging
+        fields = ['id', 'name', 'type', 'latitude', 'longitude', 'location', 'is_public', 'distance_km']
+        read_only_fields = fields
+
+    def get_distance_km(self, obj):
+        return round(obj.distance.km, 3)
+
+
+class TrailReportSerializer(serializers.ModelSerializer):
+    location = serializers.SerializerMethodField()
+    distance_km = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Visit
+        fields = [
+            'id', 'start_date', 'end_date', 'weather_conditions', 'trail_conditions', 'snow_level',
+            'completed', 'abandoned_reason', 'location', 'distance_km'
+        ]
+        read_only_fields = fields
+
+    def get_location(self, obj):
+        location = obj.location
+        return {
+            'id': str(location.id),
+            'name': location.name,
+            'latitude': location.latitude,
+            'longitude': location.longitude,
+            'point_type': location.point_type,
+            'difficulty_level': location.difficulty_level,
+        }
+
+    def get_distance_km(self, obj):
+        return round(obj.distance.km, 3)
 
 class TransportationSerializer(CustomModelSerializer):
     distance = serializers.SerializerMethodField()
@@ -630,16 +775,43 @@ class CollectionSerializer(CustomModelSerializer):
         ]
         read_only_fields = ['id', 'created_at', 'updated_at', 'user', 'shared_with']
 
+    @staticmethod
+    def _locations_context(context):
+        if context.get('nested', False):
+            allowed_nested_fields = set(context.get('allowed_nested_fields', []))
+            return {**context, 'nested': True, 'allowed_nested_fields': allowed_nested_fields}
+        return context
+
+    @classmethod
+    def optimize_queryset(cls, queryset, context=None):
+        """
+        Prefetch the locations (planned by LocationSerializer) and the other
+        related rows of every collection in queryset, so a page of collections
+        is serialized with a fixed number of queries.
+        """
+        context = context or {}
+        locations = LocationSerializer.optimize_queryset(Location.objects.all(), cls._locations_context(context))
+        prefetches = [Prefetch('locations', queryset=locations), 'shared_with']
+        if not context.get('nested', False):
+            attachments = ContentAttachment.objects.select_related('gpx_geometry')
+            prefetches += [
+                'note_set',
+                'checklist_set__checklistitem_set',
+                'transportation_set__images',
+                Prefetch('transportation_set__attachments', queryset=attachments),
+                'lodging_set__images',
+                Prefetch('lodging_set__attachments', queryset=attachments),
+            ]
+        return queryset.select_related('user').prefetch_related(*prefetches)
+
     def get_locations(self, obj):
-        if self.context.get('nested', False):
-            allowed_nested_fields = set(self.context.get('allowed_nested_fields', []))
-            return LocationSerializer(
-            obj.locations.all(), 
-            many=True, 
-            context={**self.context, 'nested': True, 'allowed_nested_fields': allowed_nested_fields}
-        ).data
-        
-        return LocationSerializer(obj.locations.all(), many=True, context=self.context).data
+        context = self._locations_context(self.context)
+        if 'locations' in getattr(obj, '_prefetched_objects_cache', {}):
+            locations = obj.locations.all()
+        else:
+            # Collections that were not loaded through optimize_queryset()
+            locations = LocationSerializer.optimize_queryset(obj.locations.all(), context)
+        return LocationSerializer(locations, many=True, context=context).data
 
     def get_transportations(self, obj):
         # Only include transportations if not in nested context
@@ -706,23 +878,26 @@ class UltraSlimCollectionSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = fields  # All fields are read-only for listing
 
+    @classmethod
+    def optimize_queryset(cls, queryset):
+        """Prefetch the locations, their images and the shared users of every collection in queryset"""
+        locations = Location.objects.only('id').prefetch_related(
+            Prefetch('images', queryset=ContentImage.objects.select_related('user'))
+        )
+        return queryset.select_related('user').prefetch_related(
+            Prefetch('locations', queryset=locations), 'shared_with'
+        )
+
     def get_location_images(self, obj):
-        """Get primary images from locations in this collection, optimized with select_related"""
-        # Filter first, then slice (removed slicing)
-        images = ContentImage.objects.filter(
-            location__collections=obj
-        ).select_related('user').prefetch_related('location')
-
-        return ContentImageSerializer(
-            images,
-            many=True,
-            context={'request': self.context.get('request')}
-        ).data
+        """Get the images of the locations in this collection, from the prefetched locations"""
+        images = [image for location in obj.locations.all() for image in location.images.all()]
+
+        # Shares the response context so Immich integrations are looked up once per user
+        return ContentImageSerializer(images, many=True, context=self.context).data
 
     def get_location_count(self, obj):
         """Get count of locations in this collection"""
-        # This uses the cached count if available, or does a simple count query
-        return obj.locations.count()
+        return len(obj.locations.all())
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
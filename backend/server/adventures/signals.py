@@ -1,6 +1,19 @@
-from django.db.models.signals import m2m_changed
+import threading
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.db.models import QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
-from adventures.models import Location
+from adventures.models import (
+    Location, Visit, Tombstone, TOMBSTONE_MODELS, Collection, Transportation, Note, Lodging,
+    ContentImage, ContentAttachment, Activity, Category,
+)
+from adventures.utils import media_acl, vector_tiles
+from adventures.utils.blobs import release_blobs
+from adventures.utils.get_is_visited import refresh_visited_status
+from adventures.utils.image_derivatives import derivative_names
+from worldtravel.models import VisitedCity, VisitedRegion
 
 @receiver(m2m_changed, sender=Location.collections.through)
 def update_adventure_publicity(sender, instance, action, **kwargs):
@@ -24,3 +37,203 @@ def update_adventure_publicity(sender, instance, action, **kwargs):
             elif not has_public_collection and instance.is_public:
                 instance.is_public = False
                 instance.save(update_fields=['is_public'])
+
+@receiver(post_save, sender=Visit)
+@receiver(post_delete, sender=Visit)
+def update_location_visited_status(sender, instance, **kwargs):
+    """
+    Keep the denormalized Location.is_visited flag in sync when a visit is
+    created, edited or deleted.
+    """
+    locations = Location.objects.filter(pk=instance.location_id)
+    refresh_visited_status(locations)
+
+    # Keep an already loaded location instance (e.g. the one being serialized) in sync
+    if Visit.location.is_cached(instance):
+        instance.location.is_visited = locations.values_list('is_visited', flat=True).first() or False
+
+
+_tombstones = threading.local()
+
+
+@contextmanager
+def suppress_tombstones():
+    """Delete without recording tombstones, e.g. when an account is wiped before a full restore."""
+    previous = getattr(_tombstones, 'suppressed', False)
+    _tombstones.suppressed = True
+    try:
+        yield
+    finally:
+        _tombstones.suppressed = previous
+
+
+def record_tombstone(sender, instance, origin=None, **kwargs):
+    """Remember deleted objects so delta backups can carry the deletion."""
+    if getattr(_tombstones, 'suppressed', False):
+        return
+    User = get_user_model()
+    # Deleting an account removes its tombstones as well
+    if isinstance(origin, User) or (isinstance(origin, QuerySet) and origin.model is User):
+        return
+
+    if sender is Visit:
+        user_id = Location.objects.filter(pk=instance.location_id).values_list('user_id', flat=True).first()
+    else:
+        user_id = instance.user_id
+    if user_id is None:
+        return
+    Tombstone.objects.create(user_id=user_id, model=_TOMBSTONE_LABELS[sender], object_id=instance.pk)
+
+
+_TOMBSTONE_LABELS = {model: label for label, model in TOMBSTONE_MODELS.items()}
+for _label, _model in TOMBSTONE_MODELS.items():
+    post_delete.connect(record_tombstone, sender=_model, dispatch_uid=f'record_tombstone_{_label}')
+
+
+# Media permission cache (see adventures/utils/media_acl.py)
+
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+@receiver(post_save, sender=Transportation)
+@receiver(post_delete, sender=Transportation)
+@receiver(post_save, sender=Note)
+@receiver(post_delete, sender=Note)
+@receiver(post_save, sender=Lodging)
+@receiver(post_delete, sender=Lodging)
+def invalidate_media_acl_object(sender, instance, **kwargs):
+    """Publicity or ownership of an object with media may have changed."""
+    media_acl.invalidate_objects(sender, [instance.pk])
+
+
+@receiver(post_save, sender=Collection)
+@receiver(pre_delete, sender=Collection)
+def invalidate_media_acl_collection(sender, instance, **kwargs):
+    """Access through a collection goes to every object in it."""
+    media_acl.invalidate_objects(Location, instance.locations.values_list('id', flat=True))
+    for model in (Transportation, Note, Lodging):
+        media_acl.invalidate_objects(model, model.objects.filter(collection=instance).values_list('id', flat=True))
+
+
+@receiver(m2m_changed, sender=Location.collections.through)
+def invalidate_media_acl_location_collections(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove'):
+        location_ids = pk_set if reverse else [instance.pk]
+    elif action == 'pre_clear' and reverse:
+        location_ids = instance.locations.values_list('id', flat=True)
+    elif action == 'post_clear' and not reverse:
+        location_ids = [instance.pk]
+    else:
+        return
+    media_acl.invalidate_objects(Location, location_ids)
+
+
+@receiver(m2m_changed, sender=Collection.shared_with.through)
+def invalidate_media_acl_shared_users(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove'):
+        user_ids = [instance.pk] if reverse else pk_set
+    elif action == 'pre_clear':
+        user_ids = [instance.pk] if reverse else instance.shared_with.values_list('id', flat=True)
+    else:
+        return
+    media_acl.invalidate_users(user_ids)
+
+
+@receiver(post_save, sender=ContentImage)
+@receiver(post_delete, sender=ContentImage)
+def forget_media_acl_image_path(sender, instance, **kwargs):
+    if instance.image:
+        media_acl.forget_paths([instance.image.name, *derivative_names(instance.image.name)])
+
+
+@receiver(post_save, sender=ContentAttachment)
+@receiver(post_delete, sender=ContentAttachment)
+def forget_media_acl_attachment_path(sender, instance, **kwargs):
+    media_acl.forget_paths([instance.file.name if instance.file else None])
+
+
+@receiver(post_save, sender=Visit)
+def forget_media_acl_visit_paths(sender, instance, created, **kwargs):
+    """Files of a visit are checked against its location, which may have changed."""
+    if created:
+        return
+    images = [name for name in instance.images.values_list('image', flat=True) if name]
+    media_acl.forget_paths(
+        images + [name for image in images for name in derivative_names(image)] +
+        list(instance.attachments.values_list('file', flat=True))
+    )
+
+
+@receiver(post_delete, sender=ContentImage)
+@receiver(post_delete, sender=ContentAttachment)
+@receiver(post_delete, sender=Activity)
+def release_blob_references(sender, instance, **kwargs):
+    """Deleted objects release their content-addressed files, see BlobFileMixin."""
+    release_blobs([getattr(instance, field).name for field in sender.blob_file_fields])
+
+
+# Vector tile cache (see adventures/utils/vector_tiles.py)
+
+@receiver(post_save, sender=Location)
+@receiver(pre_delete, sender=Location)
+@receiver(post_save, sender=Visit)
+@receiver(post_delete, sender=Visit)
+def invalidate_tiles_location(sender, instance, **kwargs):
+    location_id = instance.pk if sender is Location else instance.location_id
+    vector_tiles.invalidate_locations([location_id])
+
+
+@receiver(post_save, sender=Activity)
+@receiver(post_delete, sender=Activity)
+def invalidate_tiles_activity(sender, instance, **kwargs):
+    location_ids = Visit.objects.filter(pk=instance.visit_id).values_list('location_id', flat=True)
+    vector_tiles.invalidate_users({instance.user_id, *vector_tiles.users_seeing_locations(location_ids)})
+
+
+@receiver(pre_delete, sender=Collection)
+def invalidate_tiles_collection(sender, instance, **kwargs):
+    vector_tiles.invalidate_collection(instance)
+
+
+@receiver(m2m_changed, sender=Location.collections.through)
+def invalidate_tiles_location_collections(sender, instance, action, reverse, pk_set, **kwargs):
+    """Locations appear on (or disappear from) the maps of the collection's users."""
+    if action in ('post_add', 'post_remove'):
+        location_ids = pk_set if reverse else [instance.pk]
+        collections = [instance] if reverse else Collection.objects.filter(pk__in=pk_set)
+    elif action == 'pre_clear':
+        location_ids = instance.locations.values_list('id', flat=True) if reverse else [instance.pk]
+        collections = [instance] if reverse else instance.collections.all()
+    else:
+        return
+    vector_tiles.invalidate_locations(location_ids)
+    for collection in collections:
+        vector_tiles.invalidate_collection(collection)
+
+
+@receiver(m2m_changed, sender=Collection.shared_with.through)
+def invalidate_tiles_shared_users(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove'):
+        user_ids = [instance.pk] if reverse else pk_set
+    elif action == 'pre_clear':
+        user_ids = [instance.pk] if reverse else instance.shared_with.values_list('id', flat=True)
+    else:
+        return
+    vector_tiles.invalidate_users(user_ids)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_tiles_category(sender, instance, **kwargs):
+    """Category names and icons are shown to the owner and to the users of their shared collections."""
+    shared_user_ids = Collection.objects.filter(
+        user_id=instance.user_id, shared_with__isnull=False,
+    ).values_list('shared_with', flat=True)
+    vector_tiles.invalidate_users([instance.user_id, *shared_user_ids])
+
+
+@receiver(post_save, sender=VisitedRegion)
+@receiver(post_delete, sender=VisitedRegion)
+@receiver(post_save, sender=VisitedCity)
+@receiver(post_delete, sender=VisitedCity)
+def invalidate_tiles_visited(sender, instance, **kwargs):
+    vector_tiles.invalidate_users([instance.user_id])
@@ -1,3 +1,722 @@
-from django.test import TestCase
+import io
+import math
+import shutil
+import tempfile
+import time
+import zipfile
+from datetime import timedelta
+from collections import OrderedDict
+from unittest import mock
+from urllib.parse import parse_qs
 
-# Create your tests here.
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+import numpy as np
+import requests
+from rest_framework.test import APITestCase
+
+from users.models import CustomUser
+from worldtravel.models import Country, Region, City, VisitedRegion
+from .models import Location, Visit, Trail, Collection, ContentAttachment, ContentImage, Blob, Activity, BackgroundJob
+from . import jobs
+from .serializers import get_track_geojson
+from .utils import media_acl, poi_cache
+from .utils.file_permissions import checkFilePermission
+from .utils.backup_export import previously_exported_names
+from .utils.backup_import import import_backup
+from .utils.blobs import BLOB_CLEANUP_GRACE, cleanup_blobs
+from .utils.geojson import convert_gpx_geometries
+from .utils import http_client, track_analytics
+from .utils.media_signing import MEDIA_URL_TTL, sign_media_path, verify_media_signature
+
+
+class LocationQueryCountTestCase(APITestCase):
+    """
+    Serializing locations must take a fixed number of queries, no matter how
+    many locations (and visits, trails, ...) are on the page.
+    """
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username='querycount', email='querycount@example.com', password='testpassword'
+        )
+        self.client.force_authenticate(user=self.user)
+
+        self.country = Country.objects.create(name='Testland', country_code='TL')
+        self.region = Region.objects.create(id='TL-01', name='Test Region', country=self.country)
+        self.city = City.objects.create(id='TL-01-01', name='Test City', region=self.region)
+        VisitedRegion.objects.create(user=self.user, region=self.region)
+        self.collection = Collection.objects.create(user=self.user, name='Test Collection')
+
+    def _create_locations(self, count):
+        for i in range(count):
+            # No coordinates, so no geocoding jobs are queued
+            location = Location.objects.create(
+                user=self.user, name=f'Location {i}',
+                country=self.country, region=self.region, city=self.city,
+            )
+            location.collections.add(self.collection)
+            Visit.objects.create(location=location, start_date=timezone.now(), end_date=timezone.now())
+            Visit.objects.create(location=location, start_date=timezone.now(), end_date=timezone.now())
+            Trail.objects.create(user=self.user, location=location, name=f'Trail {i}', link='https://example.com/trail')
+
+    def _count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_list_query_count_is_constant(self):
+        self._create_locations(2)
+        small_page = self._count_queries('/api/locations/')
+
+        self._create_locations(23)
+        full_page = self._count_queries('/api/locations/')
+
+        self.assertEqual(small_page, full_page)
+        self.assertLessEqual(full_page, 20)
+
+    def test_nested_all_query_count_is_constant(self):
+        url = '/api/locations/all/?include_collections=true&nested=true&allowed_nested_fields=visits,country'
+        self._create_locations(2)
+        few = self._count_queries(url)
+
+        self._create_locations(23)
+        many = self._count_queries(url)
+
+        self.assertEqual(few, many)
+
+    def test_nested_response_omits_excluded_fields(self):
+        self._create_locations(1)
+        response = self.client.get('/api/locations/all/?include_collections=true&nested=true&allowed_nested_fields=visits')
+        location = response.json()[0]
+        self.assertIn('visits', location)
+        for field in ('attachments', 'trails', 'collections', 'user', 'city', 'country', 'region'):
+            self.assertNotIn(field, location)
+
+    def test_collection_retrieve_query_count_is_constant(self):
+        url = f'/api/collections/{self.collection.id}/'
+        self._create_locations(2)
+        few = self._count_queries(url)
+
+        self._create_locations(23)
+        many = self._count_queries(url)
+
+        self.assertEqual(few, many)
+
+    def test_collection_list_query_count_is_constant(self):
+        self._create_locations(2)
+        few = self._count_queries('/api/collections/')
+
+        for i in range(5):
+            collection = Collection.objects.create(user=self.user, name=f'Collection {i}')
+            collection.locations.add(*Location.objects.filter(user=self.user))
+        self._create_locations(10)
+        many = self._count_queries('/api/collections/')
+
+        self.assertEqual(few, many)
+
+    def test_counts_match_unoptimized_values(self):
+        self._create_locations(1)
+        location = self.client.get('/api/locations/').json()['results'][0]
+        self.assertTrue(location['is_visited'])
+        self.assertEqual(location['category']['num_locations'], 1)
+        self.assertEqual(location['country']['num_regions'], 1)
+        self.assertEqual(location['country']['num_visits'], 1)
+        self.assertEqual(location['region']['num_cities'], 1)
+        self.assertEqual(len(location['visits']), 2)
+
+
+class MediaTestCase(TestCase):
+    """Runs with MEDIA_ROOT in a temporary directory."""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def _create_attachment(self, user, content, location=None, filename='file.txt'):
+        location = location or Location.objects.create(user=user, name='Private')
+        attachment = ContentAttachment(
+            user=user, name='file', content_type=ContentType.objects.get_for_model(Location), object_id=location.id,
+        )
+        attachment.file.save(filename, ContentFile(content), save=False)
+        attachment.save()
+        return attachment
+
+
+class BackupImportBlobTestCase(MediaTestCase):
+    """A backup must not be able to claim stored files by their content-addressed name alone."""
+
+    def setUp(self):
+        super().setUp()
+        self.owner = CustomUser.objects.create_user(username='owner', email='owner@example.com', password='pw')
+        self.importer = CustomUser.objects.create_user(username='importer', email='importer@example.com', password='pw')
+        self.secret = self._create_attachment(self.owner, b'private content')
+
+    def _import(self, user, members=None):
+        filename = self.secret.file.name.split('/')[-1]
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zip_file:
+            for name, content in (members or {}).items():
+                zip_file.writestr(name, content)
+        backup = {'locations': [{'name': 'Imported', 'attachments': [{'name': 'file', 'filename': filename}]}]}
+        with zipfile.ZipFile(buffer) as zip_file:
+            import_backup(backup, zip_file, user)
+        return ContentAttachment.objects.filter(user=user, object_id__in=Location.objects.filter(
+            user=user, name='Imported').values('id'))
+
+    def test_foreign_blob_name_without_file_is_not_attached(self):
+        self.assertFalse(self._import(self.importer).exists())
+
+    def test_foreign_blob_name_with_other_content_is_stored_separately(self):
+        filename = self.secret.file.name.split('/')[-1]
+        attachments = self._import(self.importer, {f'attachments/{filename}': b'forged'})
+        self.assertEqual(attachments.count(), 1)
+        self.assertNotEqual(attachments.get().file.name, self.secret.file.name)
+
+    def test_blob_with_matching_content_is_reused(self):
+        filename = self.secret.file.name.split('/')[-1]
+        attachments = self._import(self.importer, {f'attachments/{filename}': b'private content'})
+        self.assertEqual(attachments.get().file.name, self.secret.file.name)
+
+    def test_own_blob_left_out_of_delta_is_reused(self):
+        self.assertEqual(self._import(self.owner).get().file.name, self.secret.file.name)
+
+
+GPX_TRACK = b"""<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" creator="test" xmlns="http://www.topografix.com/GPX/1/1">
+  <trk><name>Hike</name><trkseg>
+    <trkpt lat="46.5" lon="7.9"><ele>1000</ele></trkpt>
+    <trkpt lat="46.51" lon="7.91"><ele>1010</ele></trkpt>
+  </trkseg></trk>
+</gpx>
+"""
+
+
+class BackupImportGpxTestCase(MediaTestCase):
+    """Imported GPX files are converted by a job, since bulk writes skip save()."""
+
+    def test_imported_gpx_file_gets_a_geometry(self):
+        user = CustomUser.objects.create_user(username='gpximport', email='gpximport@example.com', password='pw')
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zip_file:
+            zip_file.writestr('gpx/track.gpx', GPX_TRACK)
+        backup = {'locations': [{'name': 'Imported', 'visits': [{'activities': [
+            {'name': 'Hike', 'sport_type': 'General', 'gpx_filename': 'track.gpx'},
+        ]}]}]}
+        with self.captureOnCommitCallbacks(execute=True):
+            with zipfile.ZipFile(buffer) as zip_file:
+                import_backup(backup, zip_file, user)
+        self.assertTrue(BackgroundJob.objects.filter(kind='convert_gpx_geometries').exists())
+
+        convert_gpx_geometries()
+        activity = Activity.objects.get(user=user)
+        self.assertEqual(activity.gpx_geometry.point_count, 2)
+
+
+class DeltaExportFilesTestCase(MediaTestCase):
+    def test_file_shared_with_an_older_upload_is_not_previously_exported(self):
+        other = CustomUser.objects.create_user(username='other', email='other@example.com', password='pw')
+        user = CustomUser.objects.create_user(username='delta', email='delta@example.com', password='pw')
+        old = self._create_attachment(other, b'same bytes')
+        since = timezone.now()
+        new = self._create_attachment(user, b'same bytes')
+        self.assertEqual(old.file.name, new.file.name)
+
+        self.assertNotIn(new.file.name, previously_exported_names(user, since))
+        self.assertIn(new.file.name, previously_exported_names(user, timezone.now()))
+
+
+class GpxGeometryTestCase(MediaTestCase):
+    """GPX files are converted when they are stored, never while they are serialized."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(username='gpx', email='gpx@example.com', password='pw')
+
+    def test_unparseable_file_is_marked_on_upload(self):
+        attachment = self._create_attachment(self.user, b'not a gpx file', filename='track.gpx')
+        self.assertTrue(attachment.gpx_geometry.error)
+
+        with CaptureQueriesContext(connection) as queries:
+            geojson = get_track_geojson(attachment, {})
+        self.assertIn('error', geojson)
+        self.assertEqual(len(queries), 0)
+
+    def test_backfill_converts_files_without_geometry(self):
+        attachment = self._create_attachment(self.user, b'not a gpx file', filename='track.gpx')
+        ContentAttachment.objects.filter(pk=attachment.pk).update(gpx_geometry=None)
+        attachment.refresh_from_db()
+        self.assertIsNone(get_track_geojson(attachment, {}))
+
+        convert_gpx_geometries()
+        attachment.refresh_from_db()
+        self.assertIsNotNone(attachment.gpx_geometry_id)
+
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MediaAclCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='acl', email='acl@example.com', password='pw')
+        self.checks = 0
+
+    def _permission(self, allowed=True):
+        def check(ref, user):
+            self.checks += 1
+            return allowed
+        return media_acl.cached_permission('images/a.webp', self.user, lambda: ['1:a'], check)
+
+    def test_decision_is_reused_while_tokens_are_unchanged(self):
+        self._permission()  # maps the path
+        self._permission()
+        self._permission()
+        self.assertEqual(self.checks, 2)
+
+    def test_evicted_token_does_not_revive_a_decision(self):
+        self._permission()
+        self._permission()
+        cache.delete(media_acl._object_token_key('1:a'))
+        self.assertFalse(self._permission(allowed=False))
+        self.assertEqual(self.checks, 3)
+
+
+class MediaSigningTestCase(SimpleTestCase):
+    """Signed media URLs grant access to one path until they expire."""
+
+    path = 'images/a.webp'
+    now = 1_700_000_000
+
+    def _signed(self, path):
+        query = parse_qs(sign_media_path(path, now=self.now))
+        return query['expires'][0], query['signature'][0]
+
+    def test_valid_signature(self):
+        expires, signature = self._signed(self.path)
+        self.assertGreaterEqual(verify_media_signature(self.path, expires, signature, now=self.now), MEDIA_URL_TTL)
+
+    def test_expired_signature(self):
+        expires, signature = self._signed(self.path)
+        self.assertIsNone(verify_media_signature(self.path, expires, signature, now=int(expires)))
+
+    def test_signature_is_bound_to_path(self):
+        expires, signature = self._signed(self.path)
+        self.assertIsNone(verify_media_signature('images/b.webp', expires, signature, now=self.now))
+        self.assertIsNone(verify_media_signature('attachments/a.webp', expires, signature, now=self.now))
+
+    def test_signature_is_bound_to_expiry(self):
+        expires, signature = self._signed(self.path)
+        self.assertIsNone(verify_media_signature(self.path, int(expires) + 3600, signature, now=self.now))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RenditionPermissionTestCase(TestCase):
+    """A rendition may be seen by whoever may see any image stored under its original's name."""
+
+    stem = 'a' * 64
+
+    def setUp(self):
+        cache.clear()
+        self.owner = CustomUser.objects.create_user(username='owner', email='owner@example.com', password='pw')
+        self.friend = CustomUser.objects.create_user(username='friend', email='friend@example.com', password='pw')
+        self.stranger = CustomUser.objects.create_user(username='stranger', email='stranger@example.com', password='pw')
+
+        location_type = ContentType.objects.get_for_model(Location)
+        # Two uploads of the same content share one content-addressed file
+        ContentImage.objects.bulk_create([
+            ContentImage(
+                user=user, image=f'images/{self.stem}.webp', content_type=location_type,
+                object_id=Location.objects.create(user=user, name='Private').id,
+            )
+            for user in (self.owner, self.friend)
+        ])
+
+    def test_rendition_follows_every_image_of_the_blob(self):
+        rendition = f'{self.stem}.thumb.webp'
+        self.assertTrue(checkFilePermission(rendition, self.owner, 'images/'))
+        self.assertTrue(checkFilePermission(rendition, self.friend, 'images/'))
+        self.assertFalse(checkFilePermission(rendition, self.stranger, 'images/'))
+
+    def test_rendition_without_original_is_denied(self):
+        self.assertFalse(checkFilePermission(f'{"b" * 64}.thumb.webp', self.owner, 'images/'))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BlobReleaseTestCase(MediaTestCase):
+    """Deleting an object releases its reference to the stored file, however it is deleted."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(username='blobs', email='blobs@example.com', password='pw')
+        self.first = self._create_attachment(self.user, b'shared content')
+        self.second = self._create_attachment(self.user, b'shared content')
+
+    def _blob(self):
+        return Blob.objects.get(name=self.first.file.name)
+
+    def test_uploads_of_the_same_content_share_a_blob(self):
+        self.assertEqual(self.first.file.name, self.second.file.name)
+        self.assertEqual(self._blob().ref_count, 2)
+
+    def test_delete_releases_reference(self):
+        self.first.delete()
+        blob = self._blob()
+        self.assertEqual(blob.ref_count, 1)
+        self.assertIsNone(blob.released_at)
+
+        self.second.delete()
+        blob = self._blob()
+        self.assertEqual(blob.ref_count, 0)
+        self.assertIsNotNone(blob.released_at)
+
+    def test_cascade_delete_releases_references(self):
+        Location.objects.filter(user=self.user).delete()
+        self.assertFalse(ContentAttachment.objects.exists())
+        self.assertEqual(self._blob().ref_count, 0)
+
+    def test_file_stored_again_survives_cleanup_before_it_is_referenced(self):
+        name = self.first.file.name
+        Location.objects.filter(user=self.user).delete()
+        Blob.objects.filter(name=name).update(released_at=timezone.now() - timedelta(seconds=BLOB_CLEANUP_GRACE + 60))
+
+        # The upload reuses the file; its reference is only taken after the save
+        self.assertEqual(default_storage.save('attachments/again.txt', ContentFile(b'shared content')), name)
+        cleanup_blobs()
+        self.assertTrue(default_storage.exists(name))
+        self.assertTrue(Blob.objects.filter(name=name).exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class VectorTileVisibilityTestCase(APITestCase):
+    """A map tile shows a location only to its owner and the users of its collections."""
+
+    url = '/api/tiles/locations/0/0/0.mvt'
+
+    def setUp(self):
+        cache.clear()
+        self.owner = CustomUser.objects.create_user(username='owner', email='owner@example.com', password='pw')
+        self.collaborator = CustomUser.objects.create_user(username='collaborator', email='collaborator@example.com', password='pw')
+        self.stranger = CustomUser.objects.create_user(username='stranger', email='stranger@example.com', password='pw')
+
+        self.collection = Collection.objects.create(user=self.owner, name='Trip')
+        self.collection.shared_with.add(self.collaborator)
+        location = Location.objects.create(user=self.owner, name='Private', latitude='46.5', longitude='7.9')
+        location.collections.add(self.collection)
+
+    def _tile(self, user):
+        self.client.force_authenticate(user=user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response.content
+
+    def test_owner_and_collaborator_see_the_location(self):
+        self.assertTrue(self._tile(self.owner))
+        self.assertTrue(self._tile(self.collaborator))
+
+    def test_other_users_do_not_see_the_location(self):
+        self.assertEqual(self._tile(self.stranger), b'')
+
+    def test_removed_collaborator_stops_seeing_the_location(self):
+        self.assertTrue(self._tile(self.collaborator))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.collection.shared_with.remove(self.collaborator)
+        self.assertEqual(self._tile(self.collaborator), b'')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PoiRefreshTestCase(TestCase):
+    """The background refresh fetches stale tiles again, although they are still cached."""
+
+    tile = 'u0m'
+
+    def setUp(self):
+        cache.clear()
+        self.fetches = []
+
+        def fetch(category, tiles):
+            self.fetches.append(list(tiles))
+            return {tile: [{'name': 'Hut'}] for tile in tiles}
+        patcher = mock.patch.dict(poi_cache.PROVIDERS, {'overpass': fetch})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _fetched_at(self):
+        return poi_cache._load('overpass', 'lodging', 1000, [self.tile])[self.tile][1]
+
+    def test_stale_tile_is_refetched_and_restamped(self):
+        with mock.patch.object(poi_cache.time, 'time', return_value=time.time() - poi_cache.POI_CACHE_TTL - 60):
+            poi_cache._store('overpass', 'lodging', 1000, {self.tile: []})
+        stale = self._fetched_at()
+
+        poi_cache.refresh_poi_tiles('overpass', 'lodging', 1000, [self.tile])
+
+        self.assertEqual(self.fetches, [[self.tile]])
+        self.assertGreater(self._fetched_at(), stale + poi_cache.POI_CACHE_TTL)
+
+    def test_cached_tile_is_served_without_a_fetch(self):
+        poi_cache._store('overpass', 'lodging', 1000, {self.tile: []})
+        self.assertEqual(poi_cache._fetch_locked('overpass', 'lodging', 1000, [self.tile]), {self.tile: []})
+        self.assertEqual(self.fetches, [])
+
+
+class TrackAnalyticsTestCase(SimpleTestCase):
+    """Distance, elevation, moving time and splits computed from track arrays."""
+
+    METERS_PER_DEGREE = track_analytics.EARTH_RADIUS_M * math.pi / 180
+
+    def _track(self, lat, lon=None, ele=None, times=None, segment_start=None):
+        count = len(lat)
+        nan = np.full(count, np.nan)
+        starts = np.zeros(count, dtype=bool) if segment_start is None else np.array(segment_start)
+        starts[0] = True
+        return track_analytics.Track(
+            np.array(lat, dtype=np.float64),
+            np.zeros(count) if lon is None else np.array(lon, dtype=np.float64),
+            nan if ele is None else np.array(ele, dtype=np.float64),
+            nan if times is None else np.array(times, dtype=np.float64),
+            starts,
+        )
+
+    def _north(self, distances, **kwargs):
+        """Track along the meridian, with points at the given distances (m) from the start."""
+        return self._track([d / self.METERS_PER_DEGREE for d in distances], **kwargs)
+
+    def test_haversine_known_distances(self):
+        self.assertAlmostEqual(track_analytics.haversine(0, 0, 1, 0), self.METERS_PER_DEGREE, places=3)
+        # Paris to London
+        self.assertAlmostEqual(track_analytics.haversine(48.8566, 2.3522, 51.5074, -0.1278), 343_560, delta=500)
+
+    def test_no_distance_across_segment_start(self):
+        track = self._north([0, 100, 5000, 5100], segment_start=[True, False, True, False])
+        self.assertAlmostEqual(track_analytics.analyze_track(track)['distance'], 200, places=3)
+
+    def test_elevation_gain_loss(self):
+        profile = np.array([0, 10, 5, 15], dtype=np.float64)
+        self.assertEqual(track_analytics.elevation_gain_loss(profile, window=1, hysteresis=0), (20.0, 5.0))
+        # The 5 m dip and the following 10 m climb back stay within the threshold of the last counted point
+        self.assertEqual(track_analytics.elevation_gain_loss(profile, window=1, hysteresis=6), (10.0, 0.0))
+
+    def test_noisy_flat_profile(self):
+        noisy = np.array([100, 101] * 50, dtype=np.float64)
+        gain, loss = track_analytics.elevation_gain_loss(noisy, window=1, hysteresis=0)
+        self.assertEqual((gain, loss), (50.0, 49.0))
+        self.assertEqual(track_analytics.elevation_gain_loss(noisy, window=1, hysteresis=2), (0.0, 0.0))
+
+    def test_splits_end_after_each_kilometre_and_keep_the_partial_one(self):
+        distances = list(range(0, 2401, 300))
+        track = self._north(distances, times=[60 * i for i in range(len(distances))])
+        splits = track_analytics.analyze_track(track)['splits']
+
+        self.assertEqual([split['split'] for split in splits], [1, 2, 3])
+        self.assertEqual([split['distance'] for split in splits], [1200.0, 900.0, 300.0])
+        self.assertEqual([split['elapsed_time'] for split in splits], [240.0, 180.0, 60.0])
+        self.assertEqual(splits[0]['pace'], 200.0)
+
+    def test_slow_steps_do_not_count_as_moving(self):
+        slow = track_analytics.MOVING_SPEED_THRESHOLD * 10 / 2  # half the threshold over 10 s
+        track = self._north([0, 100, 100 + slow, 200 + slow], times=[0, 10, 20, 30])
+        result = track_analytics.analyze_track(track)
+
+        self.assertEqual(result['elapsed_time'], 30.0)
+        self.assertEqual(result['moving_time'], 20.0)
+        self.assertAlmostEqual(result['average_speed'], 10.0, places=3)
+
+    def test_track_without_times_or_elevations(self):
+        result = track_analytics.analyze_track(self._north([0, 600, 1500]))
+
+        self.assertAlmostEqual(result['distance'], 1500, places=3)
+        self.assertIsNone(result['elapsed_time'])
+        self.assertIsNone(result['moving_time'])
+        self.assertIsNone(result['average_speed'])
+        self.assertEqual((result['elevation_gain'], result['elevation_loss']), (0.0, 0.0))
+        self.assertEqual((result['elev_high'], result['elev_low']), (0.0, 0.0))
+        self.assertTrue(all(split['elapsed_time'] is None for split in result['splits']))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class HttpClientTestCase(SimpleTestCase):
+    """Rate limits, circuit breakers, retries and the per-host state of the shared HTTP client."""
+
+    def setUp(self):
+        cache.clear()
+        hosts = mock.patch.object(http_client, '_hosts', OrderedDict())
+        hosts.start()
+        self.addCleanup(hosts.stop)
+        self.sleeps = []
+        sleep = mock.patch.object(http_client.time, 'sleep', side_effect=self.sleeps.append)
+        sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def _respond(self, host, *responses):
+        """Let the host's session answer with the given (status, headers) pairs; returns the mock."""
+        session_request = mock.Mock(side_effect=[
+            mock.Mock(status_code=status_code, headers=headers) for status_code, headers in responses
+        ])
+        http_client._get_host(host).session.request = session_request
+        return session_request
+
+    def test_shared_rate_limit_hands_out_one_request_per_window(self):
+        # Two limiters stand for two processes drawing from the same cache
+        limiters = [http_client.SharedRateLimit('limited.test', 1, 1) for _ in range(2)]
+        with mock.patch.object(http_client.time, 'time', return_value=1000.25):
+            waits = [limiters[i % 2].acquire(5) for i in range(3)]
+            self.assertEqual(waits, [0.0, 0.75, 1.75])
+            with self.assertRaises(http_client.RateLimitExceeded):
+                limiters[0].acquire(1)
+
+    def test_rate_limit_overrun_is_a_timeout(self):
+        self.assertTrue(issubclass(http_client.RateLimitExceeded, requests.exceptions.Timeout))
+
+    def test_breaker_opens_half_opens_and_closes(self):
+        breaker = http_client.CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        with mock.patch.object(http_client.time, 'monotonic', return_value=100):
+            breaker.record_failure()
+            self.assertTrue(breaker.allow())
+            breaker.record_failure()
+            self.assertEqual(breaker.state, 'open')
+            self.assertFalse(breaker.allow())
+        with mock.patch.object(http_client.time, 'monotonic', return_value=131):
+            self.assertEqual(breaker.state, 'half-open')
+            self.assertTrue(breaker.allow())
+            # Only a single trial request at a time
+            self.assertFalse(breaker.allow())
+            breaker.record_success()
+            self.assertEqual(breaker.state, 'closed')
+            self.assertTrue(breaker.allow())
+
+    def test_failed_trial_opens_the_circuit_again(self):
+        breaker = http_client.CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        with mock.patch.object(http_client.time, 'monotonic', return_value=100):
+            breaker.record_failure()
+        with mock.patch.object(http_client.time, 'monotonic', return_value=131):
+            self.assertTrue(breaker.allow())
+            breaker.record_failure()
+            self.assertEqual(breaker.state, 'open')
+
+    def test_circuit_key_isolates_failures(self):
+        self._respond('immich.test', *[(500, {})] * http_client.CIRCUIT_FAILURE_THRESHOLD, (200, {}))
+        for _ in range(http_client.CIRCUIT_FAILURE_THRESHOLD):
+            http_client.get('https://immich.test/assets/a', retries=0, circuit_key='immich:1')
+
+        with self.assertRaises(http_client.CircuitOpenError):
+            http_client.get('https://immich.test/assets/a', circuit_key='immich:1')
+        self.assertEqual(http_client.get('https://immich.test/assets/b', circuit_key='immich:2').status_code, 200)
+
+    def test_retry_after_is_honoured(self):
+        session_request = self._respond('retry.test', (429, {'Retry-After': '3'}), (200, {}))
+        self.assertEqual(http_client.get('https://retry.test/').status_code, 200)
+        self.assertEqual(session_request.call_count, 2)
+        self.assertEqual(self.sleeps, [3])
+
+    def test_server_errors_are_retried_up_to_the_limit(self):
+        session_request = self._respond('flaky.test', (503, {}), (502, {}), (504, {}))
+        self.assertEqual(http_client.get('https://flaky.test/', retries=2).status_code, 504)
+        self.assertEqual(session_request.call_count, 3)
+        self.assertEqual(len(self.sleeps), 2)
+
+    def test_non_idempotent_requests_are_not_retried(self):
+        session_request = self._respond('post.test', (503, {}), (200, {}))
+        self.assertEqual(http_client.post('https://post.test/').status_code, 503)
+        self.assertEqual(session_request.call_count, 1)
+
+    def test_least_recently_used_host_is_evicted(self):
+        with mock.patch.object(http_client, 'MAX_HOSTS', 2):
+            first = http_client._get_host('a.test')
+            http_client._get_host('b.test')
+            self.assertIs(http_client._get_host('a.test'), first)
+            http_client._get_host('c.test')
+        self.assertEqual(list(http_client._hosts), ['a.test', 'c.test'])
+
+
+@mock.patch.dict(jobs.JOB_HANDLERS, {'test_job': 'adventures.tests.test_job'})
+class JobQueueTestCase(TestCase):
+    """Claiming, leases, retries and deduplication of the background job queue."""
+
+    def setUp(self):
+        self.handler = mock.Mock()
+        patcher = mock.patch.object(jobs, 'import_string', return_value=self.handler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _pending(self):
+        return BackgroundJob.objects.filter(kind='test_job', status=BackgroundJob.STATUS_PENDING)
+
+    def test_unknown_kind_is_rejected(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue_job('no_such_job', 'key')
+
+    def test_enqueue_job_keeps_one_pending_job_per_key(self):
+        first = jobs.enqueue_job('test_job', 'a', {'n': 1})
+        self.assertEqual(jobs.enqueue_job('test_job', 'a', {'n': 2}).pk, first.pk)
+        jobs.enqueue_job('test_job', 'b')
+        self.assertEqual(self._pending().count(), 2)
+
+    def test_enqueue_jobs_skips_pending_duplicates(self):
+        jobs.enqueue_job('test_job', 'a')
+        jobs.enqueue_jobs('test_job', [('a', {}), ('b', {}), ('c', {})])
+        jobs.enqueue_jobs('test_job', [('b', {}), ('c', {})])
+        self.assertEqual(sorted(self._pending().values_list('dedupe_key', flat=True)), ['a', 'b', 'c'])
+
+    def test_claim_leases_the_job_until_the_lease_expires(self):
+        jobs.enqueue_job('test_job', 'a')
+        job = jobs.claim_next_job()
+        self.assertEqual((job.status, job.attempts), (BackgroundJob.STATUS_RUNNING, 1))
+        self.assertIsNone(jobs.claim_next_job())
+
+        # The worker crashed; once the lease expires another one takes over
+        BackgroundJob.objects.filter(pk=job.pk).update(
+            locked_at=timezone.now() - timedelta(seconds=jobs.LEASE_TIMEOUT + 1)
+        )
+        reclaimed = jobs.claim_next_job()
+        self.assertEqual((reclaimed.pk, reclaimed.attempts), (job.pk, 2))
+
+    def test_delayed_job_is_not_claimed_early(self):
+        jobs.enqueue_job('test_job', 'a', delay=60)
+        self.assertIsNone(jobs.claim_next_job())
+
+    def test_successful_job_is_deleted(self):
+        jobs.enqueue_job('test_job', 'a', {'n': 1})
+        jobs.run_job(jobs.claim_next_job())
+        self.handler.assert_called_once_with(n=1)
+        self.assertFalse(BackgroundJob.objects.exists())
+
+    def test_failures_back_off_until_max_attempts(self):
+        self.handler.side_effect = RuntimeError('boom')
+        job = jobs.enqueue_job('test_job', 'a')
+
+        for attempt in range(1, job.max_attempts + 1):
+            BackgroundJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+            started = timezone.now()
+            jobs.run_job(jobs.claim_next_job())
+            job.refresh_from_db()
+            self.assertEqual((job.attempts, job.last_error), (attempt, 'boom'))
+            if attempt < job.max_attempts:
+                delay = min(jobs.RETRY_MAX_DELAY, jobs.RETRY_BASE_DELAY * 2 ** (attempt - 1))
+                self.assertEqual(job.status, BackgroundJob.STATUS_PENDING)
+                self.assertGreaterEqual(job.run_after, started + timedelta(seconds=delay / 2))
+                self.assertLessEqual(job.run_after, timezone.now() + timedelta(seconds=delay))
+        self.assertEqual(job.status, BackgroundJob.STATUS_FAILED)
+        self.assertIsNone(jobs.claim_next_job())
+
+    def test_periodic_jobs_are_queued_once(self):
+        started = timezone.now()
+        jobs.schedule_periodic_jobs()
+        jobs.schedule_periodic_jobs()
+
+        for kind, interval in jobs.PERIODIC_JOBS.items():
+            pending = BackgroundJob.objects.filter(kind=kind, status=BackgroundJob.STATUS_PENDING)
+            self.assertEqual(pending.count(), 1)
+            self.assertGreaterEqual(pending.get().run_after, started + timedelta(seconds=interval))
@@ -27,4 +27,5 @@ router.register(r'visits', VisitViewSet, basename='visits')
 urlpatterns = [
     # Include the router under the 'api/' prefix
     path('', include(router.urls)),
+    path('tiles/<str:layer>/<int:z>/<int:x>/<int:y>.mvt', VectorTileView.as_view(), name='vector-tile'),
 ]
@@ -0,0 +1,561 @@
+"""
+Streaming backup export.
+
+The archive is produced as a generator of bytes: data.json is serialized record
+by record from iterated querysets, and every image, attachment and GPX file is
+copied into the ZIP chunk by chunk. Entries use data descriptors and ZIP64, so
+neither the JSON document nor any file (nor the archive) is ever held in memory
+as a whole, whatever the size of the account.
+
+Exports can be incremental: given `since`, only rows changed after that time,
+tombstones of deleted rows and files not already exported are included. Every
+row carries its id so the importer can merge the delta into existing data.
+"""
+import json
+import logging
+import os
+import secrets
+import time
+import zipfile
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.storage import default_storage
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from adventures.models import (
+    Activity, BackgroundJob, BackupExport, ChecklistItem, ContentAttachment, ContentImage, Location, Tombstone,
+    Trail, Visit,
+)
+
+logger = logging.getLogger(__name__)
+
+QUERYSET_CHUNK_SIZE = 200
+FILE_CHUNK_SIZE = 64 * 1024
+EXPORTS_DIR = 'exports'
+# Seconds a finished background export stays downloadable
+BACKUP_EXPORT_TTL = getattr(settings, 'BACKUP_EXPORT_TTL', 60 * 60 * 24)
+# Seconds deletions are remembered for delta exports; older `since` values need a full export
+BACKUP_TOMBSTONE_RETENTION = getattr(settings, 'BACKUP_TOMBSTONE_RETENTION', 60 * 60 * 24 * 90)
+PROGRESS_INTERVAL = 5  # seconds between progress writes (and job lease renewals)
+# Already compressed formats are stored as-is instead of spending CPU deflating them
+STORED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'webp', 'avif', 'heic', 'zip', 'gz', 'mp4', 'mov', 'pdf'}
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _float(value):
+    return float(value) if value else None
+
+
+def _str(value):
+    return str(value) if value else None
+
+
+def _filename(field_file):
+    return field_file.name.split('/')[-1] if field_file else None
+
+
+def serialize_activity(activity):
+    return {
+        'id': str(activity.id),
+        'name': activity.name,
+        'sport_type': activity.sport_type,
+        'distance': _float(activity.distance),
+        'moving_time': activity.moving_time.total_seconds() if activity.moving_time else None,
+        'elapsed_time': activity.elapsed_time.total_seconds() if activity.elapsed_time else None,
+        'rest_time': activity.rest_time.total_seconds() if activity.rest_time else None,
+        'elevation_gain': _float(activity.elevation_gain),
+        'elevation_loss': _float(activity.elevation_loss),
+        'elev_high': _float(activity.elev_high),
+        'elev_low': _float(activity.elev_low),
+        'start_date': _iso(activity.start_date),
+        'start_date_local': _iso(activity.start_date_local),
+        'timezone': activity.timezone,
+        'average_speed': _float(activity.average_speed),
+        'max_speed': _float(activity.max_speed),
+        'average_cadence': _float(activity.average_cadence),
+        'calories': _float(activity.calories),
+        'start_lat': _float(activity.start_lat),
+        'start_lng': _float(activity.start_lng),
+        'end_lat': _float(activity.end_lat),
+        'end_lng': _float(activity.end_lng),
+        'external_service_id': activity.external_service_id,
+        'trail_name': activity.trail.name if activity.trail else None,  # Link by trail name
+        'gpx_filename': _filename(activity.gpx_file),
+    }
+
+
+def serialize_location(location, export_id, collection_name_to_id):
+    return {
+        'export_id': export_id,
+        'id': str(location.id),
+        'name': location.name,
+        'location': location.location,
+        'tags': location.tags,
+        'description': location.description,
+        'rating': location.rating,
+        'link': location.link,
+        'is_public': location.is_public,
+        'longitude': _str(location.longitude),
+        'latitude': _str(location.latitude),
+        'city': location.city_id,
+        'region': location.region_id,
+        'country': location.country_id,
+        'category_name': location.category.name if location.category else None,
+        'collection_export_ids': [
+            collection_name_to_id[col.name] for col in location.collections.all() if col.name in collection_name_to_id
+        ],
+        # Lets delta imports link collections that are not part of the delta
+        'collection_ids': [str(col.id) for col in location.collections.all()],
+        'visits': [
+            {
+                'export_id': visit_idx,
+                'id': str(visit.id),
+                'start_date': _iso(visit.start_date),
+                'end_date': _iso(visit.end_date),
+                'timezone': visit.timezone,
+                'notes': visit.notes,
+                'activities': [serialize_activity(activity) for activity in visit.activities.all()],
+            }
+            for visit_idx, visit in enumerate(location.visits.all())
+        ],
+        'trails': [
+            {
+                'id': str(trail.id),
+                'name': trail.name,
+                'link': trail.link,
+                'wanderer_id': trail.wanderer_id,
+                'created_at': _iso(trail.created_at),
+            }
+            for trail in location.trails.all()
+        ],
+        'images': [
+            {
+                'id': str(image.id),
+                'immich_id': image.immich_id,
+                'is_primary': image.is_primary,
+                'filename': _filename(image.image),
+            }
+            for image in location.images.all()
+        ],
+        'attachments': [
+            {'id': str(attachment.id), 'name': attachment.name, 'filename': _filename(attachment.file)}
+            for attachment in location.attachments.all()
+        ],
+    }
+
+
+def serialize_transportation(transport, collection_name_to_id):
+    return {
+        'id': str(transport.id),
+        'type': transport.type,
+        'name': transport.name,
+        'description': transport.description,
+        'rating': transport.rating,
+        'link': transport.link,
+        'date': _iso(transport.date),
+        'end_date': _iso(transport.end_date),
+        'start_timezone': transport.start_timezone,
+        'end_timezone': transport.end_timezone,
+        'flight_number': transport.flight_number,
+        'from_location': transport.from_location,
+        'origin_latitude': _str(transport.origin_latitude),
+        'origin_longitude': _str(transport.origin_longitude),
+        'destination_latitude': _str(transport.destination_latitude),
+        'destination_longitude': _str(transport.destination_longitude),
+        'to_location': transport.to_location,
+        'is_public': transport.is_public,
+        'collection_export_id': collection_name_to_id.get(transport.collection.name) if transport.collection else None,
+        'collection_id': str(transport.collection_id) if transport.collection_id else None,
+    }
+
+
+def serialize_note(note, collection_name_to_id):
+    return {
+        'id': str(note.id),
+        'name': note.name,
+        'content': note.content,
+        'links': note.links,
+        'date': _iso(note.date),
+        'is_public': note.is_public,
+        'collection_export_id': collection_name_to_id.get(note.collection.name) if note.collection else None,
+        'collection_id': str(note.collection_id) if note.collection_id else None,
+    }
+
+
+def serialize_checklist(checklist, collection_name_to_id):
+    return {
+        'id': str(checklist.id),
+        'name': checklist.name,
+        'date': _iso(checklist.date),
+        'is_public': checklist.is_public,
+        'collection_export_id': collection_name_to_id.get(checklist.collection.name) if checklist.collection else None,
+        'collection_id': str(checklist.collection_id) if checklist.collection_id else None,
+        'items': [
+            {'id': str(item.id), 'name': item.name, 'is_checked': item.is_checked}
+            for item in checklist.checklistitem_set.all()
+        ],
+    }
+
+
+def serialize_lodging(lodging, collection_name_to_id):
+    return {
+        'id': str(lodging.id),
+        'name': lodging.name,
+        'type': lodging.type,
+        'description': lodging.description,
+        'rating': lodging.rating,
+        'link': lodging.link,
+        'check_in': _iso(lodging.check_in),
+        'check_out': _iso(lodging.check_out),
+        'timezone': lodging.timezone,
+        'reservation_number': lodging.reservation_number,
+        'price': _str(lodging.price),
+        'latitude': _str(lodging.latitude),
+        'longitude': _str(lodging.longitude),
+        'location': lodging.location,
+        'is_public': lodging.is_public,
+        'collection_export_id': collection_name_to_id.get(lodging.collection.name) if lodging.collection else None,
+        'collection_id': str(lodging.collection_id) if lodging.collection_id else None,
+    }
+
+
+def _iterate(queryset):
+    # iterator() keeps memory flat; prefetches are applied per chunk
+    return queryset.iterator(chunk_size=QUERYSET_CHUNK_SIZE)
+
+
+def _changed(queryset, since, *related):
+    """
+    Rows updated at or after `since`, or with a related row that was. `related`
+    are querysets of child rows with an `OuterRef('pk')` filter.
+    """
+    if since is None:
+        return queryset
+    condition = Q(updated_at__gte=since)
+    for children in related:
+        condition |= Q(Exists(children.filter(updated_at__gte=since)))
+    return queryset.filter(condition)
+
+
+def changed_locations(user, since=None):
+    """The user's locations, or for delta exports those where anything in the location's tree changed."""
+    content_type = ContentType.objects.get_for_model(Location)
+    return _changed(
+        user.location_set.all(), since,
+        Visit.objects.filter(location=OuterRef('pk')),
+        Activity.objects.filter(visit__location=OuterRef('pk')),
+        Trail.objects.filter(location=OuterRef('pk')),
+        ContentImage.objects.filter(content_type=content_type, object_id=OuterRef('pk')),
+        ContentAttachment.objects.filter(content_type=content_type, object_id=OuterRef('pk')),
+    )
+
+
+def export_sections(user, since=None):
+    """
+    (key, records) pairs of the backup document in order. Records are lazy
+    generators over the user's querysets.
+
+    With `since`, only rows changed at or after that time are included (a location
+    or checklist is included as a whole when any of its children changed), plus
+    tombstones of deletions. Visited regions/cities and categories are small and
+    always included in full.
+    """
+    collections_queryset = _changed(user.collection_set.all(), since)
+    collections = list(collections_queryset.order_by('id').values_list('id', 'name'))
+    # Collections are referenced by name, as in earlier exports
+    collection_name_to_id = {name: idx for idx, (_, name) in enumerate(collections)}
+
+    def collections_records():
+        queryset = collections_queryset.order_by('id').prefetch_related('shared_with')
+        for idx, collection in enumerate(_iterate(queryset)):
+            yield {
+                'export_id': idx,
+                'id': str(collection.id),
+                'name': collection.name,
+                'description': collection.description,
+                'is_public': collection.is_public,
+                'start_date': _iso(collection.start_date),
+                'end_date': _iso(collection.end_date),
+                'is_archived': collection.is_archived,
+                'link': collection.link,
+                'shared_with_user_ids': [str(u.uuid) for u in collection.shared_with.all()],
+            }
+
+    def locations_records():
+        queryset = changed_locations(user, since).order_by('id').select_related('category').prefetch_related(
+            'collections', 'trails', 'images', 'attachments', 'visits__activities__trail',
+        )
+        for idx, location in enumerate(_iterate(queryset)):
+            yield serialize_location(location, idx, collection_name_to_id)
+
+    def simple_records(queryset, serialize):
+        for obj in _iterate(queryset):
+            yield serialize(obj, collection_name_to_id)
+
+    sections = [
+        ('visited_cities', ({'city': city_id} for city_id in user.visitedcity_set.values_list('city_id', flat=True).iterator())),
+        ('visited_regions', ({'region': region_id} for region_id in user.visitedregion_set.values_list('region_id', flat=True).iterator())),
+        ('categories', (
+            {'name': name, 'display_name': display_name, 'icon': icon}
+            for name, display_name, icon in user.category_set.values_list('name', 'display_name', 'icon').iterator()
+        )),
+        ('collections', collections_records()),
+        ('locations', locations_records()),
+        ('transportation', simple_records(
+            _changed(user.transportation_set.select_related('collection'), since), serialize_transportation
+        )),
+        ('notes', simple_records(_changed(user.note_set.select_related('collection'), since), serialize_note)),
+        ('checklists', simple_records(
+            _changed(
+                user.checklist_set.select_related('collection').prefetch_related('checklistitem_set'), since,
+                ChecklistItem.objects.filter(checklist=OuterRef('pk')),
+            ),
+            serialize_checklist,
+        )),
+        ('lodging', simple_records(_changed(user.lodging_set.select_related('collection'), since), serialize_lodging)),
+    ]
+    if since is not None:
+        sections.append(('tombstones', (
+            {'model': model, 'id': str(object_id), 'deleted_at': _iso(deleted_at)}
+            for model, object_id, deleted_at in user.tombstones.filter(deleted_at__gte=since)
+            .order_by('deleted_at').values_list('model', 'object_id', 'deleted_at').iterator()
+        )))
+    return sections
+
+
+def iter_export_json(user, header=None, since=None):
+    """Yield data.json as text fragments, one record at a time."""
+    if header is None:
+        header = {
+            'version': settings.ADVENTURELOG_RELEASE_VERSION,
+            'export_date': datetime.now().isoformat(),
+            'user_email': user.email,
+            'user_username': user.username,
+        }
+        if since is not None:
+            header.update({'delta': True, 'since': since.isoformat()})
+    yield '{\n'
+    for key, value in header.items():
+        yield f'  {json.dumps(key)}: {json.dumps(value)},\n'
+
+    sections = export_sections(user, since)
+    for section_idx, (key, records) in enumerate(sections):
+        yield f'  {json.dumps(key)}: ['
+        for idx, record in enumerate(records):
+            yield (',\n    ' if idx else '\n    ') + json.dumps(record)
+        yield '\n  ]' + (',\n' if section_idx < len(sections) - 1 else '\n')
+    yield '}\n'
+
+
+def _export_file_sources(user, since=None):
+    locations = changed_locations(user, since).values('id')
+    return [
+        ('images', ContentImage.objects.filter(location__in=locations).exclude(image='').values_list('image', flat=True)),
+        ('attachments', ContentAttachment.objects.filter(location__in=locations).exclude(file='').values_list('file', flat=True)),
+        ('gpx', Activity.objects.filter(visit__location__in=locations).exclude(gpx_file='').values_list('gpx_file', flat=True)),
+    ]
+
+
+def count_export_files(user, since=None):
+    return sum(names.distinct().order_by().count() for _, names in _export_file_sources(user, since))
+
+
+def iter_export_files(user, since=None):
+    """
+    Yield (archive name, storage name) for every file referenced by the export, once each.
+    Files are stored by content hash, so identical files are archived once as well.
+    """
+    for folder, names in _export_file_sources(user, since):
+        for name in names.distinct().order_by().iterator(chunk_size=1000):
+            if name:
+                yield f"{folder}/{name.split('/')[-1]}", name
+
+
+class _StreamBuffer:
+    """Write-only, non-seekable sink for ZipFile; drained after every write."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _compress_type(arcname):
+    extension = arcname.rsplit('.', 1)[-1].lower() if '.' in arcname else ''
+    return zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+def _zip_info(arcname):
+    info = zipfile.ZipInfo(arcname, date_time=datetime.now().timetuple()[:6])
+    info.compress_type = _compress_type(arcname)
+    info.external_attr = 0o644 << 16
+    return info
+
+
+def previously_exported_names(user, since):
+    """
+    Stored names of the files the user's export taken at `since` contained: those
+    referenced by the user's rows that have not changed since. Files are stored
+    by content hash and shared between users, so the file's own modification
+    time says nothing about whether it was in this user's earlier export.
+    """
+    names = set()
+    for model, field, owner in (
+        (ContentImage, 'image', 'location__user'),
+        (ContentAttachment, 'file', 'location__user'),
+        (Activity, 'gpx_file', 'visit__location__user'),
+    ):
+        names.update(
+            model.objects.filter(**{owner: user, 'updated_at__lt': since}).exclude(**{field: ''})
+            .values_list(field, flat=True).distinct().order_by().iterator(chunk_size=1000)
+        )
+    names.discard(None)
+    return names
+
+
+def stream_backup(user, header=None, files=None, since=None):
+    """
+    Yield the backup ZIP as byte chunks. `files` defaults to iter_export_files(user)
+    and may be any iterable of (archive name, storage name).
+
+    For delta exports (`since`), files that were already in the archive of an
+    earlier export are left out. manifest.json lists every file the backup
+    references and whether it is included.
+    """
+    buffer = _StreamBuffer()
+    # The sink is not seekable, so zipfile writes data descriptors after every entry
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zip_file:
+        with zip_file.open(_zip_info('data.json'), 'w', force_zip64=True) as entry:
+            pending = []
+            pending_size = 0
+            for fragment in iter_export_json(user, header, since):
+                data = fragment.encode('utf-8')
+                pending.append(data)
+                pending_size += len(data)
+                if pending_size >= FILE_CHUNK_SIZE:
+                    entry.write(b''.join(pending))
+                    pending, pending_size = [], 0
+                    yield buffer.drain()
+            entry.write(b''.join(pending))
+        yield buffer.drain()
+
+        manifest = {'files': [], 'previously_exported': []}
+        exported = previously_exported_names(user, since) if since is not None else set()
+        for arcname, name in (files if files is not None else iter_export_files(user, since)):
+            if name in exported:
+                manifest['previously_exported'].append(arcname)
+                continue
+            try:
+                source = default_storage.open(name, 'rb')
+            except Exception as e:
+                logger.warning(f"Error adding file {name} to export: {e}")
+                continue
+            with source, zip_file.open(_zip_info(arcname), 'w', force_zip64=True) as entry:
+                for chunk in source.chunks(FILE_CHUNK_SIZE):
+                    entry.write(chunk)
+                    yield buffer.drain()
+            manifest['files'].append(arcname)
+            yield buffer.drain()
+
+        zip_file.writestr(_zip_info('manifest.json'), json.dumps(manifest))
+        yield buffer.drain()
+    # Central directory
+    yield buffer.drain()
+
+
+def build_backup_export(export_id):
+    """
+    Job handler: write the backup of a BackupExport to MEDIA_ROOT/exports/ and
+    record progress while doing so. The archive is written to a .part file and
+    only renamed into place once complete.
+    """
+    export = BackupExport.objects.select_related('user').filter(id=export_id).first()
+    if export is None or export.status == BackupExport.STATUS_COMPLETED:
+        return
+
+    export.status = BackupExport.STATUS_RUNNING
+    export.files_total = count_export_files(export.user, export.since)
+    export.files_done = 0
+    export.error = None
+    export.save(update_fields=['status', 'files_total', 'files_done', 'error'])
+
+    # Unguessable name; access is still checked in checkFilePermission
+    name = f"{EXPORTS_DIR}/{secrets.token_urlsafe(24)}.zip"
+    path = os.path.join(settings.MEDIA_ROOT, name)
+    tmp_path = f"{path}.part"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    files_done = 0
+    size = 0
+    last_progress = time.monotonic()
+
+    def tracked_files():
+        nonlocal files_done
+        for item in iter_export_files(export.user, export.since):
+            yield item
+            files_done += 1
+
+    try:
+        with open(tmp_path, 'wb') as archive:
+            for chunk in stream_backup(export.user, files=tracked_files(), since=export.since):
+                archive.write(chunk)
+                size += len(chunk)
+                if time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+                    last_progress = time.monotonic()
+                    BackupExport.objects.filter(id=export.id).update(files_done=files_done, size=size)
+                    # Renew the lease so long exports are not picked up by a second worker
+                    BackgroundJob.objects.filter(
+                        kind='build_backup_export', dedupe_key=str(export.id), status=BackgroundJob.STATUS_RUNNING,
+                    ).update(locked_at=timezone.now())
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.error(f"Backup export {export.id} failed: {e}", exc_info=True)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        export.status = BackupExport.STATUS_FAILED
+        export.error = 'The export could not be created'
+        export.expires_at = timezone.now() + timedelta(seconds=BACKUP_EXPORT_TTL)
+        export.save(update_fields=['status', 'error', 'expires_at'])
+        return
+
+    now = timezone.now()
+    export.status = BackupExport.STATUS_COMPLETED
+    export.file = name
+    export.size = size
+    export.files_done = files_done
+    export.completed_at = now
+    export.expires_at = now + timedelta(seconds=BACKUP_EXPORT_TTL)
+    export.save(update_fields=['status', 'file', 'size', 'files_done', 'completed_at', 'expires_at'])
+
+
+def delete_export_file(export):
+    if export.file:
+        path = os.path.join(settings.MEDIA_ROOT, export.file)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def cleanup_backup_exports():
+    """Periodic job: delete expired exports and their archives, and old tombstones."""
+    expired = BackupExport.objects.filter(expires_at__lt=timezone.now())
+    for export in expired.iterator():
+        delete_export_file(export)
+    expired.delete()
+
+    Tombstone.objects.filter(deleted_at__lt=timezone.now() - timedelta(seconds=BACKUP_TOMBSTONE_RETENTION)).delete()
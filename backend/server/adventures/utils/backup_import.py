@@ -0,0 +1,745 @@
+"""
+Set-based backup import.
+
+Instead of saving every row on its own, the importer
+- resolves countries, regions, cities, shared users and categories with a few
+  `in_bulk` style queries into in-memory maps,
+- builds unsaved model instances (UUID primary keys are assigned in Python, so
+  children can point at their parents before anything is written),
+- inserts each model with one `bulk_create` per batch, in dependency order,
+- extracts images, attachments and GPX files from the ZIP into storage with a
+  thread pool, skipping content-addressed files that are already stored,
+- defers reverse geocoding of locations without region data to background jobs
+  queued in a single insert once the import has committed.
+
+Rows keep the ids they have in the backup (unless another account already uses
+them), so a later delta backup can be merged: in merge mode rows that already
+exist for the user are updated with `bulk_update`, new rows are inserted and the
+backup's tombstones are deleted, instead of clearing the account first.
+
+Model save() hooks and signals do not run for bulk inserts; their effects
+(default category, is_visited, collection publicity) are applied as set-based
+updates at the end. GPX files are converted by a convert_gpx_geometries job
+queued once the import has committed.
+"""
+import hashlib
+import logging
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from adventures.models import (
+    Location, Collection, Transportation, Note, Checklist, ChecklistItem,
+    ContentImage, ContentAttachment, Category, Lodging, Visit, Trail, Activity,
+    Tombstone, TOMBSTONE_MODELS, GeographyMixin, GpxGeometryMixin,
+)
+from adventures.utils import media_acl, vector_tiles
+from adventures.utils.blobs import BLOB_NAME_PATTERN, acquire_blobs, is_blob_name, release_blobs
+from adventures.utils.get_is_visited import refresh_visited_status
+from worldtravel.models import VisitedCity, VisitedRegion, City, Region, Country
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+BULK_BATCH_SIZE = 500
+IMPORT_FILE_WORKERS = getattr(settings, 'IMPORT_FILE_WORKERS', 4)
+
+# Field the owning user is reached through, when it is not `user`
+OWNER_FIELDS = {Visit: 'location__user'}
+
+# Models whose media permissions are cached, and the file field of media models
+MEDIA_CONTENT_MODELS = (Location, Transportation, Note, Lodging)
+MEDIA_FILE_FIELDS = {ContentImage: 'image', ContentAttachment: 'file'}
+
+# Fields set from the backup, i.e. the fields updated when merging into an existing row
+UPDATE_FIELDS = {
+    Collection: ['name', 'description', 'is_public', 'start_date', 'end_date', 'is_archived', 'link'],
+    Location: [
+        'name', 'location', 'tags', 'description', 'rating', 'link', 'is_public',
+        'longitude', 'latitude', 'city', 'region', 'country', 'category',
+    ],
+    Trail: ['location', 'name', 'link', 'wanderer_id'],
+    Visit: ['location', 'start_date', 'end_date', 'timezone', 'notes'],
+    Activity: [
+        'visit', 'trail', 'name', 'sport_type', 'distance', 'moving_time', 'elapsed_time', 'rest_time',
+        'elevation_gain', 'elevation_loss', 'elev_high', 'elev_low', 'start_date', 'start_date_local',
+        'timezone', 'average_speed', 'max_speed', 'average_cadence', 'calories',
+        'start_lat', 'start_lng', 'end_lat', 'end_lng', 'external_service_id',
+    ],
+    ContentImage: ['immich_id', 'is_primary', 'content_type', 'object_id'],
+    ContentAttachment: ['name', 'content_type', 'object_id'],
+    Transportation: [
+        'type', 'name', 'description', 'rating', 'link', 'date', 'end_date', 'start_timezone', 'end_timezone',
+        'flight_number', 'from_location', 'origin_latitude', 'origin_longitude', 'destination_latitude',
+        'destination_longitude', 'to_location', 'is_public', 'collection',
+    ],
+    Note: ['name', 'content', 'links', 'date', 'is_public', 'collection'],
+    Checklist: ['name', 'date', 'is_public', 'collection'],
+    ChecklistItem: ['checklist', 'name', 'is_checked'],
+    Lodging: [
+        'name', 'type', 'description', 'rating', 'link', 'check_in', 'check_out', 'timezone',
+        'reservation_number', 'price', 'latitude', 'longitude', 'location', 'is_public', 'collection',
+    ],
+}
+
+
+def _seconds(value):
+    return timedelta(seconds=value) if value is not None else None
+
+
+def _parse_uuid(value):
+    try:
+        return uuid.UUID(str(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class BackupImporter:
+    """Imports one parsed data.json (plus the files in its ZIP) for a user."""
+
+    def __init__(self, backup_data, zip_file, user, merge=False):
+        self.data = backup_data
+        self.zip_file = zip_file
+        self.user = user
+        self.merge = merge
+        self.summary = {
+            'categories': 0, 'collections': 0, 'locations': 0,
+            'transportation': 0, 'notes': 0, 'checklists': 0,
+            'checklist_items': 0, 'lodging': 0, 'images': 0,
+            'attachments': 0, 'visited_cities': 0, 'visited_regions': 0,
+            'trails': 0, 'activities': 0, 'gpx_files': 0, 'deleted': 0
+        }
+        # (instance, field name, zip member name) of every file to extract
+        self.pending_files = []
+        self.file_instances = set()
+        # Per model: ids of the user's existing rows, ids used by other accounts, ids assigned so far
+        self.own_ids = defaultdict(set)
+        self.foreign_ids = defaultdict(set)
+        self.used_ids = defaultdict(set)
+        self.convert_gpx_files = False
+
+    def run(self):
+        # Before tombstones delete any rows, so files left out of a delta stay reusable
+        self.user_blob_names = self._referenced_blob_names()
+        if self.merge:
+            self._apply_tombstones()
+        self._load_existing_ids()
+
+        self._import_visited()
+        self.category_map = self._import_categories()
+        self.collection_map = self._import_collections()
+        self._import_locations()
+        self._import_transportation()
+        self._import_notes()
+        self._import_checklists()
+        self._import_lodging()
+
+        # Rows that were deleted and are now back must not be deleted by later deltas
+        imported = [object_id for ids in self.used_ids.values() for object_id in ids]
+        if imported:
+            Tombstone.objects.filter(user=self.user, object_id__in=imported).delete()
+
+        # Bulk writes send no signals
+        shared_user_ids = Collection.objects.filter(
+            user=self.user, shared_with__isnull=False,
+        ).values_list('shared_with', flat=True)
+        vector_tiles.invalidate_users([self.user.pk, *shared_user_ids])
+        if self.convert_gpx_files:
+            self._defer_gpx_conversion()
+        return self.summary
+
+    # Ids
+
+    def _record_ids(self):
+        """Model -> ids referenced by the backup."""
+        ids = defaultdict(set)
+
+        def add(model, record):
+            record_id = _parse_uuid(record.get('id'))
+            if record_id:
+                ids[model].add(record_id)
+
+        for collection in self._items('collections'):
+            add(Collection, collection)
+        for location in self._items('locations'):
+            add(Location, location)
+            for trail in location.get('trails', []):
+                add(Trail, trail)
+            for visit in location.get('visits', []):
+                add(Visit, visit)
+                for activity in visit.get('activities', []):
+                    add(Activity, activity)
+            for image in location.get('images', []):
+                add(ContentImage, image)
+            for attachment in location.get('attachments', []):
+                add(ContentAttachment, attachment)
+        for key, model in (('transportation', Transportation), ('notes', Note), ('lodging', Lodging)):
+            for record in self._items(key):
+                add(model, record)
+        for checklist in self._items('checklists'):
+            add(Checklist, checklist)
+            for item in checklist.get('items', []):
+                add(ChecklistItem, item)
+        return ids
+
+    def _load_existing_ids(self):
+        for model, ids in self._record_ids().items():
+            owner = OWNER_FIELDS.get(model, 'user')
+            for object_id, owner_id in model.objects.filter(id__in=ids).values_list('id', owner):
+                if owner_id == self.user.id:
+                    self.own_ids[model].add(object_id)
+                else:
+                    self.foreign_ids[model].add(object_id)
+        # Delta rows may point at collections that are not part of the delta
+        self.user_collection_ids = set(self.user.collection_set.values_list('id', flat=True))
+
+    def _new_id(self, model, record):
+        """The backup's id for the row, unless another account (or an earlier row) already uses it."""
+        record_id = _parse_uuid(record.get('id'))
+        if record_id is None or record_id in self.foreign_ids[model] or record_id in self.used_ids[model]:
+            record_id = uuid.uuid4()
+        self.used_ids[model].add(record_id)
+        return record_id
+
+    # Lookups
+
+    def _existing_ids(self, model, ids):
+        ids = {i for i in ids if i}
+        if not ids:
+            return set()
+        return set(model.objects.filter(id__in=ids).values_list('id', flat=True))
+
+    def _items(self, key):
+        return self.data.get(key, [])
+
+    def _collection_id(self, item):
+        if item.get('collection_export_id') is not None and item['collection_export_id'] in self.collection_map:
+            return self.collection_map[item['collection_export_id']].id
+        collection_id = _parse_uuid(item.get('collection_id'))
+        if self.merge and collection_id in self.user_collection_ids:
+            return collection_id
+        return None
+
+    # Files
+
+    def _referenced_blob_names(self):
+        """Stored files the user's own rows already reference, i.e. files the user may reuse."""
+        names = set()
+        for model, field in ((ContentImage, 'image'), (ContentAttachment, 'file'), (Activity, 'gpx_file')):
+            names.update(model.objects.filter(user=self.user).exclude(**{field: ''}).exclude(
+                **{f'{field}__isnull': True}
+            ).values_list(field, flat=True))
+        return {name for name in names if is_blob_name(name)}
+
+    def _member_matches(self, member, stored_name):
+        """Whether the ZIP member's content hashes to the content-addressed name."""
+        digest = hashlib.sha256()
+        with self.zip_file.open(member) as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest() == BLOB_NAME_PATTERN.match(stored_name).group('sha256')
+
+    def _queue_file(self, instance, field_name, member):
+        directory = instance._meta.get_field(field_name).upload_to.path.rstrip('/')
+        stored_name = f"{directory}/{member.split('/')[-1]}"
+        try:
+            self.zip_file.getinfo(member)
+            in_zip = True
+        except KeyError:
+            in_zip = False
+
+        # Content-addressed files that are already stored are referenced instead of extracted
+        # again, but only when the user can prove they have the content: blob names appear in
+        # media URLs, so a name alone must not grant access to someone else's file.
+        if is_blob_name(stored_name) and default_storage.exists(stored_name) and (
+            stored_name in self.user_blob_names or (in_zip and self._member_matches(member, stored_name))
+        ):
+            getattr(instance, field_name).name = stored_name
+            self.file_instances.add(id(instance))
+            return True
+        if not in_zip:
+            return False  # File not found in backup, e.g. left out of a delta as already exported
+        self.pending_files.append((instance, field_name, member))
+        self.file_instances.add(id(instance))
+        return True
+
+    def _extract_file(self, job):
+        instance, field_name, member = job
+        content = self.zip_file.read(member)
+        # FieldFile.save(save=False) runs upload_to and, for images, the resize to WEBP
+        getattr(instance, field_name).save(member.split('/')[-1], ContentFile(content), save=False)
+
+    def _extract_pending_files(self):
+        if not self.pending_files:
+            return
+        with ThreadPoolExecutor(max_workers=IMPORT_FILE_WORKERS) as executor:
+            # list() re-raises the first extraction error, if any
+            list(executor.map(self._extract_file, self.pending_files))
+        self.pending_files = []
+
+    # Writes
+
+    def _save(self, model, objects, file_field=None):
+        """Insert new rows and, when merging, update the user's existing ones. Returns the new rows."""
+        if issubclass(model, GeographyMixin):
+            # bulk writes skip save(), which keeps the indexed geography columns in sync
+            for obj in objects:
+                obj.sync_geometry()
+        new = [obj for obj in objects if obj.id not in self.own_ids[model]]
+        existing = [obj for obj in objects if obj.id in self.own_ids[model]]
+        if new:
+            model.objects.bulk_create(new, batch_size=BULK_BATCH_SIZE)
+            if file_field:
+                # bulk_create skips BlobFileMixin.save()
+                acquire_blobs([getattr(obj, file_field).name for obj in new])
+        if existing:
+            fields = list(UPDATE_FIELDS[model])
+            if issubclass(model, GeographyMixin):
+                fields.extend(model.GEOMETRY_FIELDS)
+            if any(field.name == 'updated_at' for field in model._meta.concrete_fields):
+                # bulk_update does not run auto_now
+                now = timezone.now()
+                for obj in existing:
+                    obj.updated_at = now
+                fields.append('updated_at')
+            # bulk_update sends no signals, so cached media permissions are dropped here
+            if model in MEDIA_CONTENT_MODELS:
+                media_acl.invalidate_objects(model, [obj.id for obj in existing])
+            elif model in MEDIA_FILE_FIELDS:
+                media_acl.forget_paths(list(model.objects.filter(
+                    id__in=[obj.id for obj in existing]
+                ).values_list(MEDIA_FILE_FIELDS[model], flat=True)))
+            # A file is only replaced when the backup contains it
+            with_file = [obj for obj in existing if file_field and id(obj) in self.file_instances]
+            without_file = [obj for obj in existing if not (file_field and id(obj) in self.file_instances)]
+            if without_file:
+                model.objects.bulk_update(without_file, fields, batch_size=BULK_BATCH_SIZE)
+            if with_file:
+                replaced = list(model.objects.filter(
+                    id__in=[obj.id for obj in with_file]
+                ).values_list(file_field, flat=True))
+                file_fields = [file_field]
+                if issubclass(model, GpxGeometryMixin):
+                    # The replaced file's conversion no longer applies
+                    for obj in with_file:
+                        obj.gpx_geometry = None
+                    file_fields.append('gpx_geometry')
+                model.objects.bulk_update(with_file, fields + file_fields, batch_size=BULK_BATCH_SIZE)
+                acquire_blobs([getattr(obj, file_field).name for obj in with_file])
+                release_blobs(replaced)
+        if issubclass(model, GpxGeometryMixin) and any(
+            id(obj) in self.file_instances and obj.is_gpx_file() for obj in objects
+        ):
+            # bulk writes skip GpxGeometryMixin.save()
+            self.convert_gpx_files = True
+        return new
+
+    def _apply_tombstones(self):
+        by_model = defaultdict(set)
+        for tombstone in self._items('tombstones'):
+            object_id = _parse_uuid(tombstone.get('id'))
+            if object_id and tombstone.get('model') in TOMBSTONE_MODELS:
+                by_model[tombstone['model']].add(object_id)
+
+        for label, ids in by_model.items():
+            model = TOMBSTONE_MODELS[label]
+            owner = OWNER_FIELDS.get(model, 'user')
+            deleted, _ = model.objects.filter(id__in=ids, **{owner: self.user}).delete()
+            self.summary['deleted'] += deleted
+
+    # Sections
+
+    def _import_visited(self):
+        city_ids = self._existing_ids(City, (item.get('city') for item in self._items('visited_cities')))
+        region_ids = self._existing_ids(Region, (item.get('region') for item in self._items('visited_regions')))
+
+        if self.merge:
+            # Visited lists are always exported in full, so they replace the current ones
+            VisitedCity.objects.filter(user=self.user).exclude(city_id__in=city_ids).delete()
+            VisitedRegion.objects.filter(user=self.user).exclude(region_id__in=region_ids).delete()
+
+        already_cities = set(VisitedCity.objects.filter(user=self.user).values_list('city_id', flat=True))
+        already_regions = set(VisitedRegion.objects.filter(user=self.user).values_list('region_id', flat=True))
+        new_cities = city_ids - already_cities
+        new_regions = region_ids - already_regions
+
+        VisitedCity.objects.bulk_create(
+            [VisitedCity(user=self.user, city_id=city_id) for city_id in new_cities],
+            batch_size=BULK_BATCH_SIZE, ignore_conflicts=True,
+        )
+        VisitedRegion.objects.bulk_create(
+            [VisitedRegion(user=self.user, region_id=region_id) for region_id in new_regions],
+            batch_size=BULK_BATCH_SIZE, ignore_conflicts=True,
+        )
+        self.summary['visited_cities'] += len(new_cities)
+        self.summary['visited_regions'] += len(new_regions)
+
+    def _import_categories(self):
+        # Categories are matched by name
+        category_map = {category.name: category for category in self.user.category_set.all()}
+        new, changed = [], []
+        for cat_data in self._items('categories'):
+            category = category_map.get(cat_data['name'])
+            if category is None:
+                category = Category(user=self.user, name=cat_data['name'])
+                new.append(category)
+            else:
+                changed.append(category)
+            category.display_name = cat_data['display_name']
+            category.icon = cat_data.get('icon', '🌍')
+            category_map[cat_data['name']] = category
+        if new:
+            Category.objects.bulk_create(new, batch_size=BULK_BATCH_SIZE)
+        if changed:
+            Category.objects.bulk_update(changed, ['display_name', 'icon'], batch_size=BULK_BATCH_SIZE)
+        self.summary['categories'] += len(new) + len(changed)
+        return category_map
+
+    def _import_collections(self):
+        collection_map = {}
+        shared = []
+        for col_data in self._items('collections'):
+            collection = Collection(
+                id=self._new_id(Collection, col_data),
+                user=self.user,
+                name=col_data['name'],
+                description=col_data.get('description', ''),
+                is_public=col_data.get('is_public', False),
+                start_date=col_data.get('start_date'),
+                end_date=col_data.get('end_date'),
+                is_archived=col_data.get('is_archived', False),
+                link=col_data.get('link')
+            )
+            collection_map[col_data['export_id']] = collection
+            shared.extend((collection, uuid) for uuid in col_data.get('shared_with_user_ids', []))
+        self._save(Collection, list(collection_map.values()))
+        self.summary['collections'] += len(collection_map)
+        self.user_collection_ids.update(collection.id for collection in collection_map.values())
+
+        # Only users with a public profile can be shared with
+        shared_users = dict(
+            User.objects.filter(uuid__in={uuid for _, uuid in shared}, public_profile=True)
+            .values_list('uuid', 'id')
+        ) if shared else {}
+        through = Collection.shared_with.through
+        through.objects.bulk_create([
+            through(collection_id=collection.id, customuser_id=shared_users[uuid])
+            for collection, uuid in shared
+            if uuid in shared_users
+        ] if shared_users else [], batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
+        return collection_map
+
+    def _import_locations(self):
+        location_data = self._items('locations')
+        if not location_data:
+            return
+
+        cities = self._existing_ids(City, (adv.get('city') for adv in location_data))
+        regions = self._existing_ids(Region, (adv.get('region') for adv in location_data))
+        countries = self._existing_ids(Country, (adv.get('country') for adv in location_data))
+
+        # Locations without a category get the user's "general" category, as in Location.save()
+        default_category = None
+        if any(adv.get('category_name') not in self.category_map for adv in location_data):
+            default_category, _ = Category.objects.get_or_create(
+                user=self.user, name='general', defaults={'display_name': 'General', 'icon': '🌍'}
+            )
+
+        content_type = ContentType.objects.get_for_model(Location)
+        locations, collection_links, trails, visits, activities, images, attachments = [], [], [], [], [], [], []
+
+        for adv_data in location_data:
+            location = Location(
+                id=self._new_id(Location, adv_data),
+                user=self.user,
+                name=adv_data['name'],
+                location=adv_data.get('location'),
+                tags=adv_data.get('tags', []),
+                description=adv_data.get('description'),
+                rating=adv_data.get('rating'),
+                link=adv_data.get('link'),
+                is_public=adv_data.get('is_public', False),
+                longitude=adv_data.get('longitude'),
+                latitude=adv_data.get('latitude'),
+                city_id=adv_data.get('city') if adv_data.get('city') in cities else None,
+                region_id=adv_data.get('region') if adv_data.get('region') in regions else None,
+                country_id=adv_data.get('country') if adv_data.get('country') in countries else None,
+                category=self.category_map.get(adv_data.get('category_name')) or default_category,
+            )
+            locations.append(location)
+
+            linked = set()
+            for collection_export_id in adv_data.get('collection_export_ids', []):
+                if collection_export_id in self.collection_map:
+                    linked.add(self.collection_map[collection_export_id].id)
+            if self.merge:
+                linked.update(
+                    collection_id for collection_id in map(_parse_uuid, adv_data.get('collection_ids', []))
+                    if collection_id in self.user_collection_ids
+                )
+            collection_links.extend((location.id, collection_id) for collection_id in linked)
+
+            trail_map = {}
+            for trail_data in adv_data.get('trails', []):
+                trail = Trail(
+                    id=self._new_id(Trail, trail_data),
+                    user=self.user,
+                    location=location,
+                    name=trail_data['name'],
+                    link=trail_data.get('link'),
+                    wanderer_id=trail_data.get('wanderer_id'),
+                    created_at=trail_data.get('created_at')
+                )
+                trail.clean()
+                trail_map[trail_data['name']] = trail
+                trails.append(trail)
+
+            for visit_data in adv_data.get('visits', []):
+                visit = Visit(
+                    id=self._new_id(Visit, visit_data),
+                    location=location,
+                    start_date=visit_data.get('start_date'),
+                    end_date=visit_data.get('end_date'),
+                    timezone=visit_data.get('timezone'),
+                    notes=visit_data.get('notes')
+                )
+                visits.append(visit)
+                for activity_data in visit_data.get('activities', []):
+                    activities.append(self._build_activity(activity_data, visit, trail_map))
+
+            for img_data in adv_data.get('images', []):
+                image = ContentImage(
+                    id=self._new_id(ContentImage, img_data),
+                    user=self.user,
+                    is_primary=img_data.get('is_primary', False),
+                    content_type=content_type,
+                    object_id=location.id,
+                )
+                if img_data.get('immich_id'):
+                    image.immich_id = img_data['immich_id']
+                elif not (img_data.get('filename') and self._queue_file(image, 'image', f"images/{img_data['filename']}")):
+                    # When merging, an existing image keeps the file it already has
+                    if image.id not in self.own_ids[ContentImage]:
+                        continue
+                images.append(image)
+
+            for att_data in adv_data.get('attachments', []):
+                attachment = ContentAttachment(
+                    id=self._new_id(ContentAttachment, att_data),
+                    user=self.user,
+                    name=att_data.get('name'),
+                    content_type=content_type,
+                    object_id=location.id,
+                )
+                has_file = att_data.get('filename') and self._queue_file(attachment, 'file', f"attachments/{att_data['filename']}")
+                if has_file or attachment.id in self.own_ids[ContentAttachment]:
+                    attachments.append(attachment)
+
+        self._extract_pending_files()
+
+        # Dependency order: locations, their collections, trails, visits, activities, media
+        self._save(Location, locations)
+        through = Location.collections.through
+        if self.merge:
+            through.objects.filter(location_id__in=[location.id for location in locations]).delete()
+        through.objects.bulk_create(
+            [through(location_id=location_id, collection_id=collection_id) for location_id, collection_id in collection_links],
+            batch_size=BULK_BATCH_SIZE, ignore_conflicts=True,
+        )
+        self._save(Trail, trails)
+        self._save(Visit, visits)
+        self._save(Activity, activities, file_field='gpx_file')
+        self._save(ContentImage, images, file_field='image')
+        self._save(ContentAttachment, attachments, file_field='file')
+
+        self.summary['locations'] += len(locations)
+        self.summary['trails'] += len(trails)
+        self.summary['activities'] += len(activities)
+        self.summary['images'] += len(images)
+        self.summary['attachments'] += len(attachments)
+
+        location_ids = [location.id for location in locations]
+        self._apply_location_hooks(location_ids)
+        self._defer_geocoding(locations)
+
+    def _build_activity(self, activity_data, visit, trail_map):
+        activity = Activity(
+            id=self._new_id(Activity, activity_data),
+            user=self.user,
+            visit=visit,
+            trail=trail_map.get(activity_data.get('trail_name')) if activity_data.get('trail_name') else None,
+            name=activity_data['name'],
+            sport_type=activity_data.get('sport_type'),
+            distance=activity_data.get('distance'),
+            moving_time=_seconds(activity_data.get('moving_time')),
+            elapsed_time=_seconds(activity_data.get('elapsed_time')),
+            rest_time=_seconds(activity_data.get('rest_time')),
+            elevation_gain=activity_data.get('elevation_gain'),
+            elevation_loss=activity_data.get('elevation_loss'),
+            elev_high=activity_data.get('elev_high'),
+            elev_low=activity_data.get('elev_low'),
+            start_date=activity_data.get('start_date'),
+            start_date_local=activity_data.get('start_date_local'),
+            timezone=activity_data.get('timezone'),
+            average_speed=activity_data.get('average_speed'),
+            max_speed=activity_data.get('max_speed'),
+            average_cadence=activity_data.get('average_cadence'),
+            calories=activity_data.get('calories'),
+            start_lat=activity_data.get('start_lat'),
+            start_lng=activity_data.get('start_lng'),
+            end_lat=activity_data.get('end_lat'),
+            end_lng=activity_data.get('end_lng'),
+            external_service_id=activity_data.get('external_service_id')
+        )
+        gpx_filename = activity_data.get('gpx_filename')
+        if gpx_filename and self._queue_file(activity, 'gpx_file', f'gpx/{gpx_filename}'):
+            self.summary['gpx_files'] += 1
+        return activity
+
+    def _apply_location_hooks(self, location_ids):
+        """Set-based equivalent of Location.save() and the Visit/collection signals."""
+        if not location_ids:
+            return
+        locations = Location.objects.filter(id__in=location_ids)
+        refresh_visited_status(locations)
+
+        # A location in a public collection is public; in only private collections it is private
+        in_collection = locations.filter(collections__isnull=False).distinct()
+        public_collection = Exists(Collection.objects.filter(locations=OuterRef('pk'), is_public=True))
+        in_collection.filter(public_collection, is_public=False).update(is_public=True)
+        in_collection.exclude(public_collection).filter(is_public=True).update(is_public=False)
+        media_acl.invalidate_objects(Location, location_ids)
+
+    def _defer_geocoding(self, locations):
+        """Queue reverse geocoding, in one insert after commit, for located rows the backup did not resolve."""
+        from adventures.jobs import enqueue_jobs
+
+        missing = [
+            str(location.id) for location in locations
+            if location.latitude and location.longitude and not (location.region_id and location.country_id)
+        ]
+        if missing:
+            transaction.on_commit(lambda: enqueue_jobs(
+                'geocode_location', [(location_id, {'location_id': location_id}) for location_id in missing]
+            ))
+
+    def _defer_gpx_conversion(self):
+        """Convert the imported GPX files, which have no geometry yet, in a worker after commit."""
+        from adventures.jobs import enqueue_job
+
+        transaction.on_commit(lambda: enqueue_job('convert_gpx_geometries', 'convert_gpx_geometries'))
+
+    def _import_transportation(self):
+        transports = [
+            Transportation(
+                id=self._new_id(Transportation, trans_data),
+                user=self.user,
+                type=trans_data['type'],
+                name=trans_data['name'],
+                description=trans_data.get('description'),
+                rating=trans_data.get('rating'),
+                link=trans_data.get('link'),
+                date=trans_data.get('date'),
+                end_date=trans_data.get('end_date'),
+                start_timezone=trans_data.get('start_timezone'),
+                end_timezone=trans_data.get('end_timezone'),
+                flight_number=trans_data.get('flight_number'),
+                from_location=trans_data.get('from_location'),
+                origin_latitude=trans_data.get('origin_latitude'),
+                origin_longitude=trans_data.get('origin_longitude'),
+                destination_latitude=trans_data.get('destination_latitude'),
+                destination_longitude=trans_data.get('destination_longitude'),
+                to_location=trans_data.get('to_location'),
+                is_public=trans_data.get('is_public', False),
+                collection_id=self._collection_id(trans_data)
+            )
+            for trans_data in self._items('transportation')
+        ]
+        self._save(Transportation, transports)
+        self.summary['transportation'] += len(transports)
+
+    def _import_notes(self):
+        notes = [
+            Note(
+                id=self._new_id(Note, note_data),
+                user=self.user,
+                name=note_data['name'],
+                content=note_data.get('content'),
+                links=note_data.get('links', []),
+                date=note_data.get('date'),
+                is_public=note_data.get('is_public', False),
+                collection_id=self._collection_id(note_data)
+            )
+            for note_data in self._items('notes')
+        ]
+        self._save(Note, notes)
+        self.summary['notes'] += len(notes)
+
+    def _import_checklists(self):
+        checklists, items = [], []
+        for check_data in self._items('checklists'):
+            checklist = Checklist(
+                id=self._new_id(Checklist, check_data),
+                user=self.user,
+                name=check_data['name'],
+                date=check_data.get('date'),
+                is_public=check_data.get('is_public', False),
+                collection_id=self._collection_id(check_data)
+            )
+            checklists.append(checklist)
+            items.extend(
+                ChecklistItem(
+                    id=self._new_id(ChecklistItem, item_data),
+                    user=self.user,
+                    checklist=checklist,
+                    name=item_data['name'],
+                    is_checked=item_data.get('is_checked', False)
+                )
+                for item_data in check_data.get('items', [])
+            )
+        self._save(Checklist, checklists)
+        self._save(ChecklistItem, items)
+        self.summary['checklists'] += len(checklists)
+        self.summary['checklist_items'] += len(items)
+
+    def _import_lodging(self):
+        lodgings = [
+            Lodging(
+                id=self._new_id(Lodging, lodg_data),
+                user=self.user,
+                name=lodg_data['name'],
+                type=lodg_data.get('type', 'other'),
+                description=lodg_data.get('description'),
+                rating=lodg_data.get('rating'),
+                link=lodg_data.get('link'),
+                check_in=lodg_data.get('check_in'),
+                check_out=lodg_data.get('check_out'),
+                timezone=lodg_data.get('timezone'),
+                reservation_number=lodg_data.get('reservation_number'),
+                price=lodg_data.get('price'),
+                latitude=lodg_data.get('latitude'),
+                longitude=lodg_data.get('longitude'),
+                location=lodg_data.get('location'),
+                is_public=lodg_data.get('is_public', False),
+                collection_id=self._collection_id(lodg_data)
+            )
+            for lodg_data in self._items('lodging')
+        ]
+        self._save(Lodging, lodgings)
+        self.summary['lodging'] += len(lodgings)
+
+
+def import_backup(backup_data, zip_file, user, merge=False):
+    """Import backup data for a user and return the per-model summary."""
+    return BackupImporter(backup_data, zip_file, user, merge=merge).run()
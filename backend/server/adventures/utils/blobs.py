@@ -0,0 +1,189 @@
+"""
+Content-addressed file storage.
+
+Images, attachments and activity GPX files are stored under the SHA-256 of
+their content (`images/<sha256>.webp`), so identical uploads, imports and Immich
+copies share a single file on disk, its renditions included, and a backup
+archive contains every distinct file once.
+
+Each stored file has a Blob row counting the objects that reference it. Objects
+take a reference when a file is set (BlobFileMixin, or acquire_blobs() after
+bulk writes) and release it when the file is replaced or the object is deleted.
+Files whose count dropped to zero are deleted by the periodic `cleanup_blobs`
+job after a grace period. Storing the same content again restarts that period
+before the existing file is reused; if a cleanup of the file is already running,
+this waits for it and writes the file again.
+"""
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+BLOB_DIRECTORIES = ('images', 'attachments', 'activities')
+BLOB_NAME_PATTERN = re.compile(r'^(?:%s)/(?P<sha256>[0-9a-f]{64})(?:\.[a-z0-9]+)?$' % '|'.join(BLOB_DIRECTORIES))
+# Seconds an unreferenced file is kept before it is deleted
+BLOB_CLEANUP_GRACE = getattr(settings, 'BLOB_CLEANUP_GRACE', 60 * 60)
+
+
+def is_blob_name(name):
+    return bool(name) and BLOB_NAME_PATTERN.match(name) is not None
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    FileSystemStorage that names files in BLOB_DIRECTORIES after the SHA-256 of
+    their content. Saving content that is already stored writes nothing and
+    returns the existing name; other directories are stored as usual.
+    """
+
+    def _save(self, name, content):
+        directory = name.split('/', 1)[0]
+        if '/' not in name or directory not in BLOB_DIRECTORIES:
+            return super()._save(name, content)
+
+        extension = os.path.splitext(name)[1].lower()
+        directory_path = self.path(directory)
+        os.makedirs(directory_path, exist_ok=True)
+
+        # Hash while writing to a temporary file in the same directory, then rename
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=directory_path, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    tmp_file.write(chunk)
+
+            blob_name = f"{directory}/{digest.hexdigest()}{extension}"
+            full_path = self.path(blob_name)
+            _keep_blob(blob_name)
+            if os.path.exists(full_path):
+                os.remove(tmp_path)
+            else:
+                if self.file_permissions_mode is not None:
+                    os.chmod(tmp_path, self.file_permissions_mode)
+                os.replace(tmp_path, full_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return blob_name
+
+
+def _keep_blob(name):
+    """
+    Restart the grace period of an unreferenced file that is stored again, so it
+    outlives the caller's acquire_blobs(). Blocks while cleanup_blobs holds the row.
+    """
+    from adventures.models import Blob
+
+    Blob.objects.filter(name=name, ref_count=0).update(released_at=timezone.now())
+
+
+def blob_name_for_file(path, directory, extension):
+    """The content-addressed name a local file would be stored under."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return f"{directory}/{digest.hexdigest()}{extension.lower()}"
+
+
+def move_into_storage(path, directory, extension):
+    """
+    Move a local file in MEDIA_ROOT (e.g. a freshly rendered temporary file or a
+    file stored under its old name) to its content-addressed name, without
+    copying it. The file is removed if that content is already stored.
+    Returns the new name.
+    """
+    name = blob_name_for_file(path, directory, extension)
+    target = default_storage.path(name)
+    _keep_blob(name)
+    if os.path.exists(target):
+        os.remove(path)
+    else:
+        os.replace(path, target)
+    return name
+
+
+def _forget_cached_paths(names):
+    # Which objects a file belongs to changed, see media_acl.py
+    from adventures.utils import media_acl
+    from adventures.utils.image_derivatives import derivative_names
+    media_acl.forget_paths([
+        path for name in names
+        for path in ([name, *derivative_names(name)] if name.startswith('images/') else [name])
+    ])
+
+
+def acquire_blobs(names):
+    """Take one reference per occurrence of a stored file name; other names are ignored."""
+    from adventures.models import Blob
+
+    counts = Counter(name for name in names if is_blob_name(name))
+    for name, count in counts.items():
+        updated = Blob.objects.filter(name=name).update(ref_count=F('ref_count') + count, released_at=None)
+        if updated:
+            continue
+        try:
+            size = default_storage.size(name)
+        except OSError:
+            size = 0
+        try:
+            with transaction.atomic():
+                Blob.objects.create(
+                    name=name, sha256=BLOB_NAME_PATTERN.match(name).group('sha256'), size=size, ref_count=count,
+                )
+        except IntegrityError:
+            # Created concurrently
+            Blob.objects.filter(name=name).update(ref_count=F('ref_count') + count, released_at=None)
+    _forget_cached_paths(list(counts))
+
+
+def release_blobs(names):
+    """Release one reference per occurrence of a stored file name."""
+    from adventures.models import Blob
+
+    counts = Counter(name for name in names if is_blob_name(name))
+    now = timezone.now()
+    for name, count in counts.items():
+        Blob.objects.filter(name=name, ref_count__gt=count).update(ref_count=F('ref_count') - count)
+        Blob.objects.filter(name=name, ref_count__lte=count).update(ref_count=0, released_at=now)
+    _forget_cached_paths(list(counts))
+
+
+def cleanup_blobs():
+    """Job handler: delete files that have been unreferenced for longer than the grace period."""
+    from adventures.models import Blob
+    from adventures.utils.image_derivatives import delete_derivatives
+
+    cutoff = timezone.now() - timedelta(seconds=BLOB_CLEANUP_GRACE)
+    deleted = 0
+    for blob_id in Blob.objects.filter(ref_count=0, released_at__lt=cutoff).values_list('id', flat=True).iterator():
+        with transaction.atomic():
+            blob = Blob.objects.select_for_update(skip_locked=True).filter(
+                id=blob_id, ref_count=0, released_at__lt=cutoff,
+            ).first()
+            if blob is None:
+                continue  # Referenced or stored again, or being cleaned up by another worker
+            if default_storage.exists(blob.name):
+                default_storage.delete(blob.name)
+            if blob.name.startswith('images/'):
+                delete_derivatives(blob.name)
+            blob.delete()
+            deleted += 1
+    if deleted:
+        logger.info(f"[Blobs] Deleted {deleted} unreferenced files")
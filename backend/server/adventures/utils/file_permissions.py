@@ -1,86 +1,80 @@
-from adventures.models import ContentImage, ContentAttachment
+from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
 
-from adventures.models import Visit
+from adventures.models import ContentImage, ContentAttachment, BackupExport, Location, Visit
+from adventures.utils.image_derivatives import original_image_prefix, parse_derivative_name
+from adventures.utils.media_acl import cached_permission, object_ref
 
-protected_paths = ['images/', 'attachments/']
+protected_paths = ['images/', 'attachments/', 'exports/']
 
 def checkFilePermission(fileId, user, mediaType):
     if mediaType not in protected_paths:
         return True
+    if mediaType == 'exports/':
+        # Backup archives are only ever available to their owner, until they expire
+        if not user.is_authenticated:
+            return False
+        return BackupExport.objects.filter(
+            file=f"exports/{fileId}", user=user, status=BackupExport.STATUS_COMPLETED,
+            expires_at__gt=timezone.now(),
+        ).exists()
     if mediaType == 'images/':
-        try:
-            # Construct the full relative path to match the database field
-            image_path = f"images/{fileId}"
-            # Fetch the ContentImage object
-            content_image = ContentImage.objects.get(image=image_path)
-            
-            # Get the content object (could be Location, Transportation, Note, etc.)
-            content_object = content_image.content_object
+        path = f"images/{fileId}"
+        derivative = parse_derivative_name(path)
+        if derivative:
+            # Renditions share the permissions of their original
+            lookup = {'image__startswith': original_image_prefix(derivative[0])}
+        else:
+            lookup = {'image': path}
+        return cached_permission(path, user, lambda: _resolve_refs(ContentImage, lookup), _check_ref)
+    elif mediaType == 'attachments/':
+        path = f"attachments/{fileId}"
+        return cached_permission(path, user, lambda: _resolve_refs(ContentAttachment, {'file': path}), _check_ref)
 
-            # handle differently when content_object is a Visit, get the location instead
-            if isinstance(content_object, Visit):
-                # check visit.location
-                if content_object.location:
-                    # continue with the location check
-                    content_object = content_object.location
 
-            # Check if content object is public
-            if hasattr(content_object, 'is_public') and content_object.is_public:
-                return True
-            
-            # Check if user owns the content object
-            if hasattr(content_object, 'user') and content_object.user == user:
-                return True
-            
-            # Check collection-based permissions
-            if hasattr(content_object, 'collections') and content_object.collections.exists():
-                # For objects with multiple collections (like Location)
-                for collection in content_object.collections.all():
-                    if collection.user == user or collection.shared_with.filter(id=user.id).exists():
-                        return True
-                return False
-            elif hasattr(content_object, 'collection') and content_object.collection:
-                # For objects with single collection (like Transportation, Note, etc.)
-                if content_object.collection.user == user or content_object.collection.shared_with.filter(id=user.id).exists():
-                    return True
-                return False
-            else:
-                return False
-                
-        except ContentImage.DoesNotExist:
-            return False
-    elif mediaType == 'attachments/':
-        try:
-            # Construct the full relative path to match the database field
-            attachment_path = f"attachments/{fileId}"
-            # Fetch the ContentAttachment object
-            content_attachment = ContentAttachment.objects.get(file=attachment_path)
-            
-            # Get the content object (could be Location, Transportation, Note, etc.)
-            content_object = content_attachment.content_object
-            
-            # Check if content object is public
-            if hasattr(content_object, 'is_public') and content_object.is_public:
-                return True
-            
-            # Check if user owns the content object
-            if hasattr(content_object, 'user') and content_object.user == user:
+def _resolve_refs(model, lookup):
+    """
+    object_ref()s of the content objects a file belongs to; files of a visit belong to its location.
+    Content-addressed files can be shared by several objects.
+    """
+    refs = []
+    for content_type_id, object_id in model.objects.filter(**lookup).values_list('content_type_id', 'object_id').distinct():
+        ref = f"{content_type_id}:{object_id}"
+        if ContentType.objects.get_for_id(content_type_id).model_class() is Visit:
+            location_id = Visit.objects.filter(pk=object_id).values_list('location_id', flat=True).first()
+            if location_id:
+                ref = object_ref(Location, location_id)
+        if ref not in refs:
+            refs.append(ref)
+    return refs
+
+
+def _check_ref(ref, user):
+    content_type_id, object_id = ref.split(':', 1)
+    model = ContentType.objects.get_for_id(int(content_type_id)).model_class()
+    content_object = model.objects.filter(pk=object_id).first()
+    if content_object is None:
+        return False
+
+    # Check if content object is public
+    if hasattr(content_object, 'is_public') and content_object.is_public:
+        return True
+
+    # Check if user owns the content object
+    if hasattr(content_object, 'user') and content_object.user == user:
+        return True
+
+    # Check collection-based permissions
+    if hasattr(content_object, 'collections') and content_object.collections.exists():
+        # For objects with multiple collections (like Location)
+        for collection in content_object.collections.all():
+            if collection.user == user or collection.shared_with.filter(id=user.id).exists():
                 return True
-            
-            # Check collection-based permissions
-            if hasattr(content_object, 'collections') and content_object.collections.exists():
-                # For objects with multiple collections (like Location)
-                for collection in content_object.collections.all():
-                    if collection.user == user or collection.shared_with.filter(id=user.id).exists():
-                        return True
-                return False
-            elif hasattr(content_object, 'collection') and content_object.collection:
-                # For objects with single collection (like Transportation, Note, etc.)
-                if content_object.collection.user == user or content_object.collection.shared_with.filter(id=user.id).exists():
-                    return True
-                return False
-            else:
-                return False
-                
-        except ContentAttachment.DoesNotExist:
-            return False
\ No newline at end of file
+        return False
+    elif hasattr(content_object, 'collection') and content_object.collection:
+        # For objects with single collection (like Transportation, Note, etc.)
+        if content_object.collection.user == user or content_object.collection.shared_with.filter(id=user.id).exists():
+            return True
+        return False
+    else:
+        return False
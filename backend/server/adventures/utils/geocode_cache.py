@@ -0,0 +1,121 @@
+"""
+Two-tier cache for geocoding provider responses.
+
+Lookups go through a small in-process LRU first and then the configured Django
+cache (memcached), so repeated lookups of the same coordinates or search query
+never leave the server. Entries are namespaced per provider and lookup kind.
+
+Only raw provider data is cached, never per-user values such as visited flags.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Decimal places kept for reverse geocoding keys (4 places is roughly 11 m)
+GEOCODE_CACHE_PRECISION = getattr(settings, 'GEOCODE_CACHE_PRECISION', 4)
+GEOCODE_CACHE_TTL = {
+    'reverse': getattr(settings, 'GEOCODE_REVERSE_CACHE_TTL', 60 * 60 * 24 * 30),  # 30 days
+    'search': getattr(settings, 'GEOCODE_SEARCH_CACHE_TTL', 60 * 60 * 24 * 7),  # 7 days
+}
+GEOCODE_LOCAL_CACHE_SIZE = getattr(settings, 'GEOCODE_LOCAL_CACHE_SIZE', 2048)
+GEOCODE_LOCAL_CACHE_TTL = 60 * 60  # 1 hour, keeps workers from serving stale data for long
+
+CACHE_KEY_PREFIX = 'geocode:v1'
+
+
+class LRUCache:
+    """Thread-safe, size-bounded LRU mapping with per-entry expiry."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_local_cache = LRUCache(GEOCODE_LOCAL_CACHE_SIZE)
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def reverse_cache_key(lat, lon):
+    """Quantize coordinates so nearby lookups share one cache entry."""
+    return f"{round(float(lat), GEOCODE_CACHE_PRECISION)},{round(float(lon), GEOCODE_CACHE_PRECISION)}"
+
+
+def search_cache_key(query):
+    """Normalize case and whitespace and hash the query (memcached keys cannot contain spaces)."""
+    normalized = ' '.join(str(query).lower().split())
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+
+def _record(provider, kind, outcome):
+    with _stats_lock:
+        counters = _stats.setdefault(f"{provider}:{kind}", {'local_hits': 0, 'shared_hits': 0, 'misses': 0})
+        counters[outcome] += 1
+
+
+def get_cache_stats():
+    """Hit/miss counters of this process, per provider namespace."""
+    with _stats_lock:
+        return {namespace: dict(counters) for namespace, counters in _stats.items()}
+
+
+def cached_lookup(provider, kind, key, fetch, cacheable=lambda value: value is not None):
+    """
+    Return the cached value for (provider, kind, key) or call fetch() and cache
+    its result when cacheable(result) is true. Errors from the shared cache are
+    ignored so a memcached outage only costs the extra provider call.
+    """
+    cache_key = f"{CACHE_KEY_PREFIX}:{provider}:{kind}:{key}"
+
+    value = _local_cache.get(cache_key)
+    if value is not None:
+        _record(provider, kind, 'local_hits')
+        return value
+
+    try:
+        value = cache.get(cache_key)
+    except Exception:
+        value = None
+    if value is not None:
+        _record(provider, kind, 'shared_hits')
+        _local_cache.set(cache_key, value, GEOCODE_LOCAL_CACHE_TTL)
+        return value
+
+    _record(provider, kind, 'misses')
+    value = fetch()
+    if cacheable(value):
+        ttl = GEOCODE_CACHE_TTL.get(kind, GEOCODE_CACHE_TTL['search'])
+        _local_cache.set(cache_key, value, min(ttl, GEOCODE_LOCAL_CACHE_TTL))
+        try:
+            cache.set(cache_key, value, ttl)
+        except Exception:
+            pass
+    return value
@@ -1,5 +1,7 @@
+import hashlib
 import gpxpy
 import geojson
+from django.contrib.gis.geos import LineString, MultiLineString
 
 def gpx_to_geojson(gpx_file):
     """
@@ -36,4 +38,129 @@ def gpx_to_geojson(gpx_file):
         return {
             "error": str(e),
             "message": "Failed to convert GPX to GeoJSON"
-        }
\ No newline at end of file
+        }
+
+# Douglas-Peucker tolerances in degrees (roughly 1 m, 10 m and 100 m)
+SIMPLIFY_TOLERANCES = {
+    'high': 0.00001,
+    'medium': 0.0001,
+    'low': 0.001,
+}
+
+
+def _perpendicular_distance(point, start, end):
+    (x, y), (x1, y1), (x2, y2) = point, start, end
+    dx, dy = x2 - x1, y2 - y1
+    if dx == 0 and dy == 0:
+        return ((x - x1) ** 2 + (y - y1) ** 2) ** 0.5
+    return abs(dy * x - dx * y + x2 * y1 - y2 * x1) / (dx * dx + dy * dy) ** 0.5
+
+
+def simplify_coords(coords, tolerance):
+    """
+    Douglas-Peucker line simplification. Iterative, so long tracks cannot hit
+    the recursion limit. Always keeps the first and last point.
+    """
+    if len(coords) < 3:
+        return list(coords)
+
+    keep = [False] * len(coords)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(coords) - 1)]
+    while stack:
+        first, last = stack.pop()
+        max_distance = 0.0
+        index = None
+        for i in range(first + 1, last):
+            distance = _perpendicular_distance(coords[i], coords[first], coords[last])
+            if distance > max_distance:
+                max_distance = distance
+                index = i
+        if index is not None and max_distance > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+
+    return [coord for coord, kept in zip(coords, keep) if kept]
+
+
+def simplify_feature_collection(collection, tolerance):
+    features = []
+    for feature in collection['features']:
+        coords = simplify_coords(feature['geometry']['coordinates'], tolerance)
+        features.append(geojson.Feature(geometry=geojson.LineString(coords), properties=feature['properties']))
+    return geojson.FeatureCollection(features)
+
+
+def get_gpx_geometry(gpx_file):
+    """
+    Return the GpxGeometry for the content of a GPX file, converting and
+    simplifying it only if no file with the same content was seen before.
+    A file that cannot be parsed gets a GpxGeometry with `error` set.
+    """
+    from adventures.models import GpxGeometry
+
+    if not gpx_file:
+        return None
+
+    with gpx_file.open('rb') as f:
+        data = f.read()
+    content_hash = hashlib.sha256(data).hexdigest()
+
+    geometry = GpxGeometry.objects.filter(content_hash=content_hash).first()
+    if geometry:
+        return geometry
+
+    try:
+        gpx = gpxpy.parse(data.decode('utf-8-sig', errors='replace'))
+    except Exception as e:
+        geometry, _ = GpxGeometry.objects.get_or_create(
+            content_hash=content_hash, defaults={'geojson': {}, 'error': str(e)},
+        )
+        return geometry
+
+    features = []
+    point_count = 0
+    for track in gpx.tracks:
+        track_name = track.name or "GPX Track"
+        for segment in track.segments:
+            coords = [(point.longitude, point.latitude) for point in segment.points]
+            if coords:
+                point_count += len(coords)
+                features.append(geojson.Feature(
+                    geometry=geojson.LineString(coords),
+                    properties={"name": track_name}
+                ))
+    full = geojson.FeatureCollection(features)
+    # A line needs two points; single point segments are left out of the 2D indexed track
+    lines = [
+        LineString([coordinate[:2] for coordinate in feature['geometry']['coordinates']], srid=4326)
+        for feature in features if len(feature['geometry']['coordinates']) >= 2
+    ]
+
+    geometry, _ = GpxGeometry.objects.get_or_create(
+        content_hash=content_hash,
+        defaults={
+            'geojson': full,
+            'simplified': {
+                level: simplify_feature_collection(full, tolerance)
+                for level, tolerance in SIMPLIFY_TOLERANCES.items()
+            },
+            'track': MultiLineString(lines, srid=4326) if lines else None,
+            'point_count': point_count,
+        },
+    )
+    return geometry
+
+
+def convert_gpx_geometries():
+    """Job handler: convert the GPX files stored before conversions were kept."""
+    from adventures.models import Activity, ContentAttachment
+
+    pending = [
+        ContentAttachment.objects.filter(gpx_geometry__isnull=True, file__iendswith='.gpx'),
+        Activity.objects.filter(gpx_geometry__isnull=True, gpx_file__isnull=False).exclude(gpx_file=''),
+    ]
+    for queryset in pending:
+        for obj in queryset.iterator():
+            obj.sync_gpx_geometry(force=True)
@@ -1,25 +1,47 @@
+from django.db.models import Exists, OuterRef
 from django.utils import timezone
 
 
-def is_location_visited(location):
+def visited_exists():
     """
-    Check if a location has been visited based on its visits.
-    
-    Args:
-        location: Location instance with visits relationship
-        
+    Exists() expression that is true when the outer Location has been visited,
+    i.e. has a visit starting today or earlier.
+    """
+    from adventures.models import Visit
+
+    return Exists(Visit.objects.filter(
+        location=OuterRef('pk'),
+        start_date__date__lte=timezone.now().date(),
+    ))
+
+
+def refresh_visited_status(queryset):
+    """
+    Bring the stored Location.is_visited flag in line with the visits of every
+    location in the queryset. Only rows whose status changed are written.
+
     Returns:
-        bool: True if location has been visited, False otherwise
+        int: Number of locations updated
     """
-    current_date = timezone.now().date()
-    
-    for visit in location.visits.all():
-        start_date = visit.start_date.date() if isinstance(visit.start_date, timezone.datetime) else visit.start_date
-        end_date = visit.end_date.date() if isinstance(visit.end_date, timezone.datetime) else visit.end_date
-        
-        if start_date and end_date and (start_date <= current_date):
-            return True
-        elif start_date and not end_date and (start_date <= current_date):
-            return True
-            
-    return False
\ No newline at end of file
+    visited = visited_exists()
+    updated = queryset.filter(is_visited=False).filter(visited).update(is_visited=True)
+    updated += queryset.filter(is_visited=True).exclude(visited).update(is_visited=False)
+    return updated
+
+
+def refresh_all_visited_status():
+    """Periodic sweep: flips locations whose visit start date has now been reached."""
+    from adventures.models import Location
+    from adventures.utils import vector_tiles
+
+    # Queryset updates send no signals, so the maps showing flipped locations are invalidated here
+    visited = visited_exists()
+    flipped = [
+        *Location.objects.filter(is_visited=False).filter(visited).values_list('id', flat=True),
+        *Location.objects.filter(is_visited=True).exclude(visited).values_list('id', flat=True),
+    ]
+    if not flipped:
+        return 0
+    updated = refresh_visited_status(Location.objects.filter(id__in=flipped))
+    vector_tiles.invalidate_locations(flipped)
+    return updated
@@ -0,0 +1,353 @@
+"""
+Shared HTTP client for all outbound integrations (geocoding, recommendations,
+Wikipedia, Immich, Strava, Wanderer, ...).
+
+Drop-in replacement for requests.get/post/request that adds, per host:
+- a pooled keep-alive Session,
+- a rate limit shared by all processes through the cache (e.g. Nominatim's
+  1 request per second policy, which applies to the whole server),
+- a circuit breaker that fails fast while a host keeps erroring; self-hosted
+  integrations pass `circuit_key` so one user's server or assets only trip
+  their own breaker,
+- retries with exponential backoff and jitter for idempotent requests,
+- latency and error metrics (see get_http_metrics()).
+
+The state of the most recently used MAX_HOSTS hosts is kept; user supplied
+hosts (Immich, Wanderer, ...) cannot grow it without bound.
+
+Failures surface as the usual requests exceptions, so existing
+`except requests.exceptions.RequestException` handlers keep working.
+"""
+import http.cookiejar
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = (3.05, 10)  # (connect, read) seconds
+DEFAULT_RETRIES = 2
+RETRY_BASE_DELAY = 0.5  # seconds
+RETRY_MAX_DELAY = 5
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+POOL_MAXSIZE = getattr(settings, 'HTTP_CLIENT_POOL_MAXSIZE', 10)
+MAX_HOSTS = getattr(settings, 'HTTP_CLIENT_MAX_HOSTS', 256)  # hosts whose session, breaker and metrics are kept
+
+CIRCUIT_FAILURE_THRESHOLD = 5  # consecutive failures before the circuit opens
+CIRCUIT_RESET_TIMEOUT = 30  # seconds before a trial request is let through
+RATE_LIMIT_MAX_WAIT = 30  # seconds a caller may wait for a rate limit token
+RATE_LIMIT_CACHE_PREFIX = 'http_rate'
+
+# host -> (requests per second, burst size). Hosts not listed are not rate limited.
+RATE_LIMITS = {
+    'nominatim.openstreetmap.org': (1, 1),
+    'overpass-api.de': (1, 2),
+    **getattr(settings, 'HTTP_CLIENT_RATE_LIMITS', {}),
+}
+
+USER_AGENT = 'AdventureLog Server'
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised without contacting the host while its circuit breaker is open."""
+
+
+class RateLimitExceeded(requests.exceptions.Timeout):
+    """
+    Raised when a rate limit token is not available within RATE_LIMIT_MAX_WAIT.
+    A Timeout, so callers that handle slow hosts handle it too.
+    """
+
+
+class _RejectCookies(http.cookiejar.DefaultCookiePolicy):
+    # Sessions are shared between users, so they must never remember cookies.
+    # Cookies passed explicitly with `cookies=` are still sent.
+    def set_ok(self, cookie, request):
+        return False
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait):
+        """Take a token, sleeping until one is available. Returns the time waited."""
+        deadline = time.monotonic() + max_wait
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self.rate
+            if now + wait > deadline:
+                raise RateLimitExceeded(f"Rate limit wait exceeded {max_wait}s")
+            time.sleep(wait)
+            waited += wait
+
+
+class SharedRateLimit:
+    """
+    Rate limit shared by every process (gunicorn workers, run_workers) through
+    the cache. Wall clock time is cut into windows of capacity / rate seconds
+    and each window hands out `capacity` requests, counted with an atomic cache
+    increment. Falls back to a per-process token bucket while the cache is
+    unavailable.
+    """
+
+    def __init__(self, host, rate, capacity):
+        self.host = host
+        self.capacity = capacity
+        self.window = capacity / rate
+        self.local = TokenBucket(rate, capacity)
+
+    def acquire(self, max_wait):
+        """Take a request slot, sleeping until its window starts. Returns the time waited."""
+        now = time.time()
+        deadline = now + max_wait
+        window = int(now // self.window)
+        # Keys of future windows must outlive the latest window a caller may wait for
+        timeout = int(max_wait + self.window) + 1
+        while True:
+            window_start = window * self.window
+            if window_start > deadline:
+                raise RateLimitExceeded(f"Rate limit wait exceeded {max_wait}s")
+            key = f'{RATE_LIMIT_CACHE_PREFIX}:{self.host}:{window}'
+            try:
+                cache.add(key, 0, timeout)
+                taken = cache.incr(key)
+            except Exception as e:
+                logger.debug(f"[HTTP] Shared rate limit unavailable for {self.host}, limiting per process: {e}")
+                return self.local.acquire(max(0.0, deadline - time.time()))
+            if taken <= self.capacity:
+                wait = max(0.0, window_start - time.time())
+                time.sleep(wait)
+                return wait
+            window += 1
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                return False
+            # Half-open: let a single trial request through
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+
+class _HostMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.rate_limit_wait = 0.0
+        self.latencies = deque(maxlen=500)
+
+
+class _Host:
+    def __init__(self, host):
+        self.session = requests.Session()
+        self.session.cookies.set_policy(_RejectCookies())
+        self.session.headers['User-Agent'] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        rate_limit = RATE_LIMITS.get(host)
+        self.bucket = SharedRateLimit(host, *rate_limit) if rate_limit else None
+        self.breakers = {}  # circuit key (the host unless the caller passes one) -> CircuitBreaker
+        self.metrics = _HostMetrics()
+        self.lock = threading.Lock()
+
+    def breaker(self, key):
+        with self.lock:
+            if key not in self.breakers:
+                self.breakers[key] = CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
+            return self.breakers[key]
+
+
+_hosts = OrderedDict()
+_hosts_lock = threading.Lock()
+
+
+def _get_host(host):
+    with _hosts_lock:
+        if host in _hosts:
+            _hosts.move_to_end(host)
+        else:
+            _hosts[host] = _Host(host)
+            if len(_hosts) > MAX_HOSTS:
+                # Requests in flight keep their reference to the evicted state
+                _hosts.popitem(last=False)
+        return _hosts[host]
+
+
+def _backoff(attempt, response=None):
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return min(RETRY_MAX_DELAY, int(retry_after))
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt))
+    return random.uniform(0, delay)
+
+
+def request(method, url, retries=None, circuit_key=None, **kwargs):
+    """
+    Send a request through the shared per-host client. Accepts the same keyword
+    arguments as requests.request; a default timeout is applied when none is given.
+    `retries` defaults to DEFAULT_RETRIES for idempotent methods and 0 otherwise.
+    `circuit_key` selects the circuit breaker failures are counted against
+    (default: the host), e.g. one per integration for self-hosted servers.
+    """
+    method = method.upper()
+    host = (urlsplit(url).hostname or '').lower()
+    state = _get_host(host)
+    breaker = state.breaker(circuit_key or host)
+    kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+    if retries is None:
+        retries = DEFAULT_RETRIES if method in IDEMPOTENT_METHODS else 0
+
+    attempt = 0
+    while True:
+        if state.bucket:
+            waited = state.bucket.acquire(RATE_LIMIT_MAX_WAIT)
+            with state.lock:
+                state.metrics.rate_limit_wait += waited
+
+        if not breaker.allow():
+            with state.lock:
+                state.metrics.rejected += 1
+            raise CircuitOpenError(f"Circuit open for {host}, not sending request")
+
+        started = time.monotonic()
+        response = None
+        error = None
+        try:
+            response = state.session.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            error = e
+        except Exception:
+            # e.g. an invalid URL; still release a half-open trial slot
+            breaker.record_failure()
+            raise
+        elapsed = time.monotonic() - started
+
+        failed = error is not None or response.status_code >= 500
+        with state.lock:
+            state.metrics.requests += 1
+            state.metrics.latencies.append(elapsed)
+            if failed:
+                state.metrics.errors += 1
+        if failed:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+        retryable = error is not None or response.status_code in RETRY_STATUS_CODES
+        if not retryable or attempt >= retries:
+            if error is not None:
+                raise error
+            return response
+
+        delay = _backoff(attempt, response)
+        logger.debug(f"[HTTP] {method} {host} failed ({error or response.status_code}), retrying in {delay:.2f}s")
+        with state.lock:
+            state.metrics.retries += 1
+        if response is not None:
+            response.close()
+        time.sleep(delay)
+        attempt += 1
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def _percentile_ms(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return round(sorted_values[index] * 1000, 1)
+
+
+def get_http_metrics():
+    """Per-host request counts, error counts and latency percentiles (ms) for this process."""
+    with _hosts_lock:
+        hosts = dict(_hosts)
+
+    metrics = {}
+    for host, state in hosts.items():
+        with state.lock:
+            m = state.metrics
+            latencies = sorted(m.latencies)
+            metrics[host] = {
+                'requests': m.requests,
+                'errors': m.errors,
+                'retries': m.retries,
+                'rejected_by_circuit': m.rejected,
+                'rate_limit_wait_seconds': round(m.rate_limit_wait, 3),
+                'latency_p50_ms': _percentile_ms(latencies, 0.5),
+                'latency_p95_ms': _percentile_ms(latencies, 0.95),
+                'latency_max_ms': _percentile_ms(latencies, 1),
+            }
+            breakers = dict(state.breakers)
+        circuits = {key: breaker.state for key, breaker in breakers.items()}
+        metrics[host]['circuit'] = circuits.get(host, 'closed')
+        # Breakers of callers passing their own circuit_key
+        metrics[host]['open_circuits'] = sum(
+            1 for key, circuit in circuits.items() if key != host and circuit != 'closed'
+        )
+    return metrics
@@ -0,0 +1,124 @@
+"""
+Resized renditions of uploaded images.
+
+ContentImage stores a single resized original, but lists and cards only need
+small versions of it. Named renditions are rendered from the original on first
+request and kept on disk next to it:
+
+    images/<uuid>.webp              original
+    images/<uuid>.thumb.webp        rendition (thumb, card or full)
+
+serve_protected_media creates a missing rendition once and then serves it like
+any other protected file, i.e. through nginx with X-Accel-Redirect.
+`python manage.py image_derivatives` renders them ahead of time.
+"""
+import logging
+import os
+import re
+import threading
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+# Rendition name -> longest side in pixels. Images are never upscaled.
+RENDITIONS = {
+    'thumb': 320,
+    'card': 800,
+    'full': 1920,
+}
+DERIVATIVE_FORMATS = {'webp': 80, 'avif': 60}  # format -> quality
+IMAGE_DERIVATIVE_FORMAT = getattr(settings, 'IMAGE_DERIVATIVE_FORMAT', 'webp')
+
+DERIVATIVE_PATTERN = re.compile(
+    r'^images/(?P<stem>[^/.]+)\.(?P<rendition>%s)\.(?P<format>%s)$'
+    % ('|'.join(RENDITIONS), '|'.join(DERIVATIVE_FORMATS))
+)
+
+
+def derivative_format():
+    """The configured output format; AVIF needs a Pillow build with libavif."""
+    if IMAGE_DERIVATIVE_FORMAT == 'avif' and features.check('avif'):
+        return 'avif'
+    return 'webp'
+
+
+def derivative_name(original_name, rendition, fmt=None):
+    stem = os.path.splitext(os.path.basename(original_name))[0]
+    return f"images/{stem}.{rendition}.{fmt or derivative_format()}"
+
+
+def derivative_names(original_name):
+    """Every rendition name an original can have, in any format."""
+    return [derivative_name(original_name, rendition, fmt) for rendition in RENDITIONS for fmt in DERIVATIVE_FORMATS]
+
+
+def parse_derivative_name(path):
+    """(stem, rendition, format) for a rendition path, or None for anything else."""
+    match = DERIVATIVE_PATTERN.match(path)
+    return match.group('stem', 'rendition', 'format') if match else None
+
+
+def original_image_prefix(stem):
+    """Originals are stored as images/<stem>.<extension>."""
+    return f"images/{stem}."
+
+
+def generate_derivative(original_name, rendition, fmt=None):
+    """Render one rendition of an original image and store it. Returns the rendition's name."""
+    fmt = fmt or derivative_format()
+    name = derivative_name(original_name, rendition, fmt)
+    target = default_storage.path(name)
+    # Unique temporary name, so concurrent renders of the same rendition never mix
+    tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with Image.open(default_storage.path(original_name)) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((RENDITIONS[rendition], RENDITIONS[rendition]), Image.Resampling.LANCZOS)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if image.mode in ('LA', 'P', 'PA') else 'RGB')
+            image.save(tmp_path, format=fmt.upper(), quality=DERIVATIVE_FORMATS[fmt])
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return name
+
+
+def ensure_derivative(path, original_name=None):
+    """
+    Make sure the rendition at `path` exists, rendering it if needed.
+    Returns False if `path` is not a rendition or its original is missing.
+    """
+    parsed = parse_derivative_name(path)
+    if parsed is None:
+        return False
+    if default_storage.exists(path):
+        return True
+
+    stem, rendition, fmt = parsed
+    if fmt == 'avif' and not features.check('avif'):
+        return False
+    if original_name is None:
+        from adventures.models import ContentImage
+        original_name = (
+            ContentImage.objects.filter(image__startswith=original_image_prefix(stem))
+            .values_list('image', flat=True).first()
+        )
+    if not original_name or not default_storage.exists(original_name):
+        return False
+
+    try:
+        generate_derivative(original_name, rendition, fmt)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not render {path}: {e}")
+        return False
+    return True
+
+
+def delete_derivatives(original_name):
+    for name in derivative_names(original_name):
+        if default_storage.exists(name):
+            default_storage.delete(name)
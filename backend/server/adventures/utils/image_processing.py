@@ -0,0 +1,174 @@
+"""
+Background processing of uploaded images.
+
+Uploads are stored exactly as received and the request returns right away with
+the image in the "processing" state. A `process_image` job then, in the
+background worker pool:
+- applies the EXIF orientation and resizes/re-encodes the image with the
+  settings of ContentImage.image (what ResizedImageField did inside the request),
+- reads the capture time and GPS position from the EXIF data,
+- renders the image renditions (see image_derivatives.py),
+and marks the image "ready", or "failed" if the file cannot be decoded.
+Files are content-addressed (see blobs.py), so the processed image gets a new
+name; the upload is released and deleted once nothing references it anymore.
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import ExifTags, Image, ImageOps, UnidentifiedImageError
+
+from adventures.models import ContentImage, PathAndRename
+from adventures.utils.blobs import acquire_blobs, is_blob_name, move_into_storage, release_blobs
+from adventures.utils.image_derivatives import (
+    RENDITIONS, delete_derivatives, derivative_name, generate_derivative,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidImage(Exception):
+    pass
+
+
+def store_upload(uploaded_file):
+    """
+    Store an uploaded image without decoding it and return its storage name.
+    Only the header is read, to reject files that are not images.
+    """
+    try:
+        with Image.open(uploaded_file) as image:
+            image_format = image.format
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise InvalidImage('Upload a valid image. The file you uploaded was either not an image or a corrupted image.')
+    uploaded_file.seek(0)
+    # Name the file after its actual format, the client's file name may say anything
+    name = PathAndRename('images/')(None, f"upload.{image_format.lower()}")
+    return default_storage.save(name, uploaded_file)
+
+
+def _rational(value):
+    return float(value[0]) / float(value[1]) if isinstance(value, tuple) else float(value)
+
+
+def _coordinate(dms, ref):
+    """Decimal degrees from an EXIF (degrees, minutes, seconds) tuple."""
+    if not dms or not ref:
+        return None
+    try:
+        degrees, minutes, seconds = (_rational(part) for part in dms)
+        value = degrees + minutes / 60 + seconds / 3600
+        value = -value if ref in ('S', 'W') else value
+        return Decimal(str(round(value, 6)))
+    except (TypeError, ValueError, ZeroDivisionError, InvalidOperation):
+        return None
+
+
+def _taken_at(exif_ifd, exif):
+    raw = exif_ifd.get(ExifTags.Base.DateTimeOriginal) or exif.get(ExifTags.Base.DateTime)
+    if not raw:
+        return None
+    try:
+        taken = datetime.strptime(str(raw).strip('\x00 '), '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+    # Without an offset tag the camera's local time is stored as UTC
+    offset = exif_ifd.get(ExifTags.Base.OffsetTimeOriginal)
+    tz = dt_timezone.utc
+    if offset:
+        try:
+            sign = -1 if offset.startswith('-') else 1
+            hours, minutes = offset.lstrip('+-').split(':')
+            tz = dt_timezone(sign * timedelta(hours=int(hours), minutes=int(minutes)))
+        except ValueError:
+            pass
+    return taken.replace(tzinfo=tz)
+
+
+def read_exif_metadata(image):
+    """(taken_at, latitude, longitude) of a PIL image; missing values are None."""
+    exif = image.getexif()
+    exif_ifd = exif.get_ifd(ExifTags.IFD.Exif)
+    gps = exif.get_ifd(ExifTags.IFD.GPSInfo)
+    latitude = _coordinate(gps.get(ExifTags.GPS.GPSLatitude), gps.get(ExifTags.GPS.GPSLatitudeRef))
+    longitude = _coordinate(gps.get(ExifTags.GPS.GPSLongitude), gps.get(ExifTags.GPS.GPSLongitudeRef))
+    if latitude is None or longitude is None or abs(latitude) > 90 or abs(longitude) > 180:
+        latitude = longitude = None
+    return _taken_at(exif_ifd, exif), latitude, longitude
+
+
+def _resize_original(source_name):
+    """Resize and re-encode an upload like ResizedImageField would. Returns (stored name, EXIF metadata)."""
+    field = ContentImage._meta.get_field('image')
+    image_format = (field.force_format or 'WEBP').upper()
+    tmp_path = f"{default_storage.path(source_name)}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    try:
+        with Image.open(default_storage.path(source_name)) as image:
+            metadata = read_exif_metadata(image)
+            image = ImageOps.exif_transpose(image)
+            # A dimension of None leaves that side unconstrained
+            image.thumbnail(tuple(side or max(image.size) for side in field.size), Image.Resampling.LANCZOS)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if image.mode in ('LA', 'P', 'PA') else 'RGB')
+            if image_format == 'JPEG' and image.mode == 'RGBA':
+                image = image.convert('RGB')
+            save_kwargs = {'format': image_format, 'quality': field.quality if field.quality > 0 else 75}
+            if field.keep_meta:
+                # exif_transpose already reset the orientation tag
+                save_kwargs['exif'] = image.getexif()
+            image.save(tmp_path, **save_kwargs)
+        name = move_into_storage(tmp_path, 'images', f".{image_format.lower()}")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return name, metadata
+
+
+def process_image(image_id):
+    """Job handler: finish processing an uploaded image."""
+    image = ContentImage.objects.filter(id=image_id, status=ContentImage.STATUS_PROCESSING).first()
+    if image is None or not image.image:
+        return  # Deleted or already processed
+
+    source_name = image.image.name
+    try:
+        name, (taken_at, latitude, longitude) = _resize_original(source_name)
+    except (UnidentifiedImageError, OSError, ValueError, Image.DecompressionBombError) as e:
+        # Undecodable files are not retried
+        logger.warning(f"Could not process image {image_id}: {e}")
+        ContentImage.objects.filter(id=image_id).update(status=ContentImage.STATUS_FAILED)
+        return
+
+    # The processed file is referenced before the row points at it, so cleanup never deletes it in between
+    acquire_blobs([name])
+    updated = ContentImage.objects.filter(id=image_id).update(
+        image=name,
+        status=ContentImage.STATUS_READY,
+        taken_at=taken_at,
+        latitude=latitude,
+        longitude=longitude,
+        updated_at=timezone.now(),
+    )
+    if not updated:
+        # Deleted while processing, the upload was released with the row
+        release_blobs([name])
+        return
+    release_blobs([source_name])
+    if not is_blob_name(source_name) and source_name != name:
+        # Uploaded before files were content-addressed
+        default_storage.delete(source_name)
+        delete_derivatives(source_name)
+
+    for rendition in RENDITIONS:
+        if default_storage.exists(derivative_name(name, rendition)):
+            continue  # Same content as an image processed before
+        try:
+            generate_derivative(name, rendition)
+        except (OSError, ValueError) as e:
+            # Rendered on first request instead
+            logger.warning(f"Could not render {rendition} of image {image_id}: {e}")
@@ -0,0 +1,164 @@
+"""
+Viewport queries for the map.
+
+`/api/locations/pins?bbox=west,south,east,north&zoom=z` returns only the
+locations inside the viewport. Below PIN_CLUSTER_MAX_ZOOM they are grouped into
+grid cells in SQL (count, centroid and visited count per cell), so the payload
+is bounded by the number of cells on screen rather than the number of pins.
+
+Viewports are matched against the GiST indexed `point` geography column. Its
+polygon edges are great-circle arcs, so the viewport is densified and padded
+for the index scan and then trimmed exactly on the latitude/longitude columns.
+"""
+import hashlib
+import math
+
+from django.contrib.gis.geos import Polygon
+from django.db.models import Avg, CharField, Count, FloatField, Max, Min, Q
+from django.db.models.functions import Cast, Floor
+
+PIN_CLUSTER_MAX_ZOOM = 12  # zoom levels below this are clustered
+PIN_MAX_ZOOM = 22
+CLUSTER_CELLS_PER_TILE = 4  # grid cells per 256px map tile edge, i.e. 64px cells
+ENVELOPE_MAX_WIDTH = 90  # degrees; wider viewports are split, geography polygons must stay well below a hemisphere
+ENVELOPE_STEP = 1  # degrees between the vertices of a densified viewport edge
+ENVELOPE_PADDING = 0.01  # degrees, covers the arcs between the vertices
+MAX_LATITUDE = 89.99
+
+
+class InvalidViewport(ValueError):
+    pass
+
+
+def parse_bbox(value):
+    """(west, south, east, north) from 'west,south,east,north'. West > east crosses the antimeridian."""
+    try:
+        west, south, east, north = (float(part) for part in value.split(','))
+    except (AttributeError, ValueError):
+        raise InvalidViewport('bbox must be "west,south,east,north" in degrees')
+    if not all(math.isfinite(v) for v in (west, south, east, north)):
+        raise InvalidViewport('bbox must be "west,south,east,north" in degrees')
+    if south > north or not -90 <= south <= 90 or not -90 <= north <= 90:
+        raise InvalidViewport('bbox latitudes must be between -90 and 90, south first')
+    if east - west >= 360:
+        west, east = -180, 180
+    # Map libraries report longitudes beyond ±180 when the world wraps
+    west = (west + 180) % 360 - 180
+    east = (east + 180) % 360 - 180 if east != 180 else 180
+    return west, south, east, north
+
+
+def parse_zoom(value):
+    try:
+        zoom = int(value)
+    except (TypeError, ValueError):
+        raise InvalidViewport('zoom must be an integer')
+    if not 0 <= zoom <= PIN_MAX_ZOOM:
+        raise InvalidViewport(f'zoom must be between 0 and {PIN_MAX_ZOOM}')
+    return zoom
+
+
+def _longitude_ranges(west, east):
+    if west <= east:
+        return [(west, east)]
+    return [(west, 180), (-180, east)]
+
+
+def _densified_envelope(west, south, east, north):
+    west, east = max(-180, west - ENVELOPE_PADDING), min(180, east + ENVELOPE_PADDING)
+    south, north = max(-MAX_LATITUDE, south - ENVELOPE_PADDING), min(MAX_LATITUDE, north + ENVELOPE_PADDING)
+    steps = max(1, math.ceil((east - west) / ENVELOPE_STEP))
+    bottom = [(west + (east - west) * i / steps, south) for i in range(steps + 1)]
+    top = [(east - (east - west) * i / steps, north) for i in range(steps + 1)]
+    return Polygon([*bottom, *top, bottom[0]], srid=4326)
+
+
+def bbox_q(bbox, point_field='point', latitude_field='latitude', longitude_field='longitude'):
+    """Q matching rows whose point lies inside the bbox, using the spatial index."""
+    west, south, east, north = bbox
+    q = Q()
+    for range_west, range_east in _longitude_ranges(west, east):
+        envelopes = Q()
+        start = range_west
+        while True:
+            end = min(range_east, start + ENVELOPE_MAX_WIDTH)
+            envelopes |= Q(**{f'{point_field}__intersects': _densified_envelope(start, south, end, north)})
+            if end >= range_east:
+                break
+            start = end
+        q |= envelopes & Q(**{
+            f'{longitude_field}__gte': range_west, f'{longitude_field}__lte': range_east,
+        })
+    return q & Q(**{f'{latitude_field}__gte': south, f'{latitude_field}__lte': north})
+
+
+def bbox_envelopes(bbox):
+    """Rectangles covering the bbox, for geometry (not geography) columns; two if it crosses the antimeridian."""
+    west, south, east, north = bbox
+    envelopes = []
+    for range_west, range_east in _longitude_ranges(west, east):
+        envelope = Polygon.from_bbox((range_west, south, range_east, north))
+        envelope.srid = 4326
+        envelopes.append(envelope)
+    return envelopes
+
+
+def cluster_cell_size(zoom):
+    """Grid cell edge in degrees at a zoom level."""
+    return 360 / (2 ** zoom * CLUSTER_CELLS_PER_TILE)
+
+
+def cluster_locations(queryset, zoom):
+    """
+    Group locations into grid cells in SQL. Returns (clusters, ids of locations
+    alone in their cell); single locations are returned as regular pins.
+    """
+    cell = cluster_cell_size(zoom)
+    cells = (
+        queryset.order_by().filter(latitude__isnull=False, longitude__isnull=False)
+        .annotate(
+            cell_x=Floor(Cast('longitude', FloatField()) / cell),
+            cell_y=Floor(Cast('latitude', FloatField()) / cell),
+        )
+        .values('cell_x', 'cell_y')
+        .annotate(
+            count=Count('id'),
+            visited_count=Count('id', filter=Q(is_visited=True)),
+            latitude=Avg('latitude'),
+            longitude=Avg('longitude'),
+            # Postgres has no min(uuid); only used for cells with a single location
+            location_id=Min(Cast('id', CharField())),
+        )
+    )
+    clusters = []
+    single_ids = []
+    for row in cells:
+        if row['count'] == 1:
+            single_ids.append(row['location_id'])
+            continue
+        clusters.append({
+            'latitude': round(float(row['latitude']), 6),
+            'longitude': round(float(row['longitude']), 6),
+            'count': row['count'],
+            'visited_count': row['visited_count'],
+            'not_visited_count': row['count'] - row['visited_count'],
+        })
+    return clusters, single_ids
+
+
+def pins_etag(queryset, categories, params):
+    """
+    Weak fingerprint of everything the pins response is built from: per category
+    the number of pins, visited pins and the latest change, plus the categories
+    themselves and the request parameters. One grouped query over the viewport.
+    """
+    summary = list(
+        queryset.order_by().values('category_id').annotate(
+            count=Count('id'),
+            visited_count=Count('id', filter=Q(is_visited=True)),
+            last_updated=Max('updated_at'),
+        ).order_by('category_id').values_list('category_id', 'count', 'visited_count', 'last_updated')
+    )
+    category_rows = list(categories.order_by('id').values_list('id', 'name', 'display_name', 'icon'))
+    digest = hashlib.sha256(repr((sorted(params.items()), summary, category_rows)).encode()).hexdigest()
+    return f'W/"{digest[:32]}"'
@@ -0,0 +1,162 @@
+"""
+Shared cache of media permission decisions.
+
+checkFilePermission decides whether a user may read an image or attachment
+requested without a signed URL. Decisions are cached in the Django cache
+(memcached) per (content object, user), i.e. every user's set of readable
+content objects is built up lazily, so repeat views of a gallery skip the
+object lookup and the collection membership queries. File paths are mapped to
+their content objects in a separate entry, shared by all users.
+
+Cached decisions are not deleted one by one. Instead every decision records two
+tokens and is only used while both are unchanged:
+- the object token, replaced when the content object or a collection it belongs
+  to changes (publicity, ownership, collection membership), and
+- the user token, replaced when the user is added to or removed from a shared
+  collection.
+Tokens are random and created on first use; decisions are never recorded
+without both tokens, so a token evicted by memcached can never make an older
+decision valid again. They are replaced once the change is committed; earlier,
+a request could still cache a decision on the old data under the new token.
+Cache errors are ignored; the check then simply runs against the database.
+"""
+import uuid
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import transaction
+
+MEDIA_ACL_CACHE_TTL = getattr(settings, 'MEDIA_ACL_CACHE_TTL', 60 * 60)  # 1 hour
+MEDIA_ACL_PATH_TTL = 60 * 60 * 24  # 1 day, a file's content object rarely changes
+
+CACHE_KEY_PREFIX = 'media_acl:v3'
+
+
+def object_ref(model, pk):
+    """Cache identity of a content object: '<content type id>:<pk>'."""
+    return f"{ContentType.objects.get_for_model(model).id}:{pk}"
+
+
+def _user_key(user):
+    return str(user.pk) if user.is_authenticated else 'anon'
+
+
+def _path_key(path):
+    return f"{CACHE_KEY_PREFIX}:path:{path}"
+
+
+def _object_token_key(ref):
+    return f"{CACHE_KEY_PREFIX}:object:{ref}"
+
+
+def _user_token_key(user_key):
+    return f"{CACHE_KEY_PREFIX}:user:{user_key}"
+
+
+def _decision_key(ref, user_key):
+    return f"{CACHE_KEY_PREFIX}:decision:{ref}:{user_key}"
+
+
+def _get_many(keys):
+    try:
+        return cache.get_many(keys)
+    except Exception:
+        return {}
+
+
+def _get_tokens(keys):
+    """
+    Current values of these tokens, creating missing ones, so that a decision is
+    never recorded against an absent token (which an evicted token would match).
+    """
+    tokens = _get_many(keys)
+    missing = [key for key in keys if key not in tokens]
+    if missing:
+        try:
+            for key in missing:
+                cache.add(key, uuid.uuid4().hex, timeout=None)
+        except Exception:
+            return tokens
+        tokens.update(_get_many(missing))
+    return tokens
+
+
+def _set(key, value, timeout):
+    try:
+        cache.set(key, value, timeout)
+    except Exception:
+        pass
+
+
+def cached_permission(path, user, resolve_refs, check):
+    """
+    Whether `user` may read the media file at `path`.
+
+    resolve_refs() returns the object_ref()s of the content objects the file
+    belongs to (empty if there is no such file; content-addressed files can be
+    shared by several objects); check(ref, user) runs the actual permission
+    check. Access is allowed if any of the objects allows it.
+    """
+    user_key = _user_key(user)
+    refs = _get_many([_path_key(path)]).get(_path_key(path))
+
+    if refs is None:
+        refs = tuple(resolve_refs())
+        if not refs:
+            return False
+        _set(_path_key(path), refs, MEDIA_ACL_PATH_TTL)
+        # The objects were loaded before their tokens could be read, so these decisions are not cached
+        return any(check(ref, user) for ref in refs)
+
+    # Tokens are read before checking, so a change during the check invalidates the result
+    tokens = _get_tokens([_user_token_key(user_key), *(_object_token_key(ref) for ref in refs)])
+    decisions = _get_many([_decision_key(ref, user_key) for ref in refs])
+    for ref in refs:
+        current = (tokens.get(_object_token_key(ref)), tokens.get(_user_token_key(user_key)))
+        decision = decisions.get(_decision_key(ref, user_key))
+        if None not in current and decision is not None and tuple(decision[1:]) == current:
+            allowed = decision[0]
+        else:
+            allowed = check(ref, user)
+            if None not in current:
+                _set(_decision_key(ref, user_key), (allowed, *current), MEDIA_ACL_CACHE_TTL)
+        if allowed:
+            return True
+    return False
+
+
+def _replace_tokens(keys):
+    if not keys:
+        return
+
+    def replace():
+        try:
+            cache.set_many({key: uuid.uuid4().hex for key in keys}, timeout=None)
+        except Exception:
+            pass
+    transaction.on_commit(replace)
+
+
+def invalidate_objects(model, pks):
+    """Drop cached decisions about the media of these content objects."""
+    _replace_tokens([_object_token_key(object_ref(model, pk)) for pk in pks])
+
+
+def invalidate_users(user_ids):
+    """Drop cached decisions of these users."""
+    _replace_tokens([_user_token_key(str(user_id)) for user_id in user_ids])
+
+
+def forget_paths(paths):
+    """Drop the content object mapping of these files, e.g. after they were moved or deleted."""
+    keys = [_path_key(path) for path in paths if path]
+    if not keys:
+        return
+
+    def delete():
+        try:
+            cache.delete_many(keys)
+        except Exception:
+            pass
+    transaction.on_commit(delete)
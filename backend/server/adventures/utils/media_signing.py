@@ -0,0 +1,58 @@
+"""
+Signed, time-limited media URLs.
+
+Serializers append `?expires=<unix time>&signature=<hmac>` to the URLs of images
+and attachments they return, i.e. only to users who may already see them.
+serve_protected_media accepts a valid signature without querying the database
+and lets the browser cache the file until the URL expires. Unsigned, expired or
+tampered URLs fall back to the checkFilePermission lookup.
+
+Expiry times are rounded up to MEDIA_URL_BUCKET, so a file keeps the same URL
+across API responses for a while and the browser cache is actually reused.
+"""
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+# Minimum seconds a signed URL stays valid
+MEDIA_URL_TTL = getattr(settings, 'MEDIA_URL_TTL', 60 * 60 * 24)
+# Expiry granularity in seconds; URLs signed within the same bucket are identical
+MEDIA_URL_BUCKET = getattr(settings, 'MEDIA_URL_BUCKET', 60 * 60)
+SIGNED_MEDIA_PATHS = ('images/', 'attachments/')
+
+_SALT = 'adventures.utils.media_signing'
+
+
+def _signature(path, expires):
+    return salted_hmac(_SALT, f'{path}:{expires}', algorithm='sha256').hexdigest()
+
+
+def sign_media_path(path, now=None):
+    """Query string (without `?`) granting access to a media path, e.g. `images/<uuid>.webp`."""
+    now = int(time.time() if now is None else now)
+    expires = -(-(now + MEDIA_URL_TTL) // MEDIA_URL_BUCKET) * MEDIA_URL_BUCKET
+    return urlencode({'expires': expires, 'signature': _signature(path, expires)})
+
+
+def signed_media_url(public_url, path):
+    return f"{public_url}/media/{path}?{sign_media_path(path)}"
+
+
+def verify_media_signature(path, expires, signature, now=None):
+    """Seconds the signature is still valid for, or None if it is missing, invalid or expired."""
+    if not expires or not signature:
+        return None
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return None
+
+    remaining = expires - int(time.time() if now is None else now)
+    # Signatures are never issued further ahead than TTL + one bucket
+    if remaining <= 0 or remaining > MEDIA_URL_TTL + MEDIA_URL_BUCKET:
+        return None
+    if not constant_time_compare(signature, _signature(path, expires)):
+        return None
+    return remaining
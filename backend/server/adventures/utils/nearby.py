@@ -0,0 +1,142 @@
+"""
+Radius and nearest-neighbour search over what users have logged.
+
+`/api/locations/nearby?lat=..&lon=..&radius=20` returns the locations, lodging
+and public trail reports (visits shared with `public_report`) within `radius`
+km of a point, closest first. Only rows the user can see are searched: their
+own, those in collections they own or share, and public ones. The category,
+difficulty_level and point_type filters apply to locations and to the
+locations of trail reports.
+
+Both the radius filter (ST_DWithin) and the ordering (the KNN `<->` operator)
+run on the GiST indexed `point` geography columns, so the query reads only the
+index entries near the point instead of every row. It is meant to be asked
+before any external POI lookup (see RecommendationsViewSet).
+"""
+import math
+
+from django.contrib.gis.db.models.functions import Distance, GeometryDistance
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D
+from django.db.models import Q
+
+from adventures.models import Location, Lodging, Visit
+
+NEARBY_DEFAULT_RADIUS_KM = 20
+NEARBY_MAX_RADIUS_KM = 500
+NEARBY_DEFAULT_LIMIT = 50
+NEARBY_MAX_LIMIT = 200
+NEARBY_KINDS = ('locations', 'lodging', 'trail_reports')
+
+
+class InvalidNearbyQuery(ValueError):
+    pass
+
+
+class NearbyQuery:
+    """Validated query parameters of a nearby search."""
+
+    def __init__(self, params):
+        try:
+            latitude = float(params.get('lat'))
+            longitude = float(params.get('lon'))
+        except (TypeError, ValueError):
+            raise InvalidNearbyQuery('lat and lon are required and must be numbers')
+        if not (math.isfinite(latitude) and math.isfinite(longitude)):
+            raise InvalidNearbyQuery('lat and lon are required and must be numbers')
+        if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+            raise InvalidNearbyQuery('lat must be between -90 and 90, lon between -180 and 180')
+        self.origin = Point(longitude, latitude, srid=4326)
+
+        self.radius_km = self._number(params, 'radius', NEARBY_DEFAULT_RADIUS_KM, float)
+        if not 0 < self.radius_km <= NEARBY_MAX_RADIUS_KM:
+            raise InvalidNearbyQuery(f'radius must be between 0 and {NEARBY_MAX_RADIUS_KM} km')
+        self.limit = self._number(params, 'limit', NEARBY_DEFAULT_LIMIT, int)
+        if not 1 <= self.limit <= NEARBY_MAX_LIMIT:
+            raise InvalidNearbyQuery(f'limit must be between 1 and {NEARBY_MAX_LIMIT}')
+
+        self.kinds = self._choices(params, 'include', NEARBY_KINDS) or list(NEARBY_KINDS)
+        self.categories = self._list(params, 'category')
+        self.difficulty_levels = self._choices(
+            params, 'difficulty_level', [value for value, _ in Location._meta.get_field('difficulty_level').choices]
+        )
+        self.point_types = self._choices(
+            params, 'point_type', [value for value, _ in Location._meta.get_field('point_type').choices]
+        )
+        self.include_public = params.get('include_public', 'true') != 'false'
+
+    @staticmethod
+    def _number(params, name, default, cast):
+        value = params.get(name)
+        if value in (None, ''):
+            return default
+        try:
+            number = cast(value)
+        except ValueError:
+            raise InvalidNearbyQuery(f'{name} must be a number')
+        if not math.isfinite(number):
+            raise InvalidNearbyQuery(f'{name} must be a number')
+        return number
+
+    @staticmethod
+    def _list(params, name):
+        return [value for value in params.get(name, '').split(',') if value]
+
+    @classmethod
+    def _choices(cls, params, name, allowed):
+        values = cls._list(params, name)
+        invalid = [value for value in values if value not in allowed]
+        if invalid:
+            raise InvalidNearbyQuery(f"Invalid {name}: {', '.join(invalid)}. Expected one of: {', '.join(allowed)}")
+        return values
+
+    def location_q(self, prefix=''):
+        """The category/difficulty/point type filters, on Location or through a relation to it."""
+        q = Q()
+        if self.categories:
+            q &= Q(**{f'{prefix}category__name__in': self.categories})
+        if self.difficulty_levels:
+            q &= Q(**{f'{prefix}difficulty_level__in': self.difficulty_levels})
+        if self.point_types:
+            q &= Q(**{f'{prefix}point_type__in': self.point_types})
+        return q
+
+
+def _closest(queryset, point_field, query):
+    """Rows within the radius, annotated with `distance` and ordered by it (index assisted KNN)."""
+    return (
+        queryset.filter(**{f'{point_field}__dwithin': (query.origin, D(km=query.radius_km))})
+        .annotate(distance=Distance(point_field, query.origin))
+        .order_by(GeometryDistance(point_field, query.origin))[:query.limit]
+    )
+
+
+def visible_locations(user, include_public=True):
+    return Location.objects.retrieve_locations(
+        user, include_owned=True, include_shared=True, include_public=include_public,
+    ).values('id')
+
+
+def nearby_locations(user, query):
+    locations = Location.objects.filter(
+        query.location_q(), id__in=visible_locations(user, query.include_public),
+    ).select_related('category')
+    return _closest(locations, 'point', query)
+
+
+def nearby_lodging(user, query):
+    visible = Q(user=user) | Q(collection__shared_with=user) | Q(collection__user=user)
+    if query.include_public:
+        visible |= Q(is_public=True)
+    lodging = Lodging.objects.filter(id__in=Lodging.objects.filter(visible).values('id'))
+    return _closest(lodging, 'point', query)
+
+
+def nearby_trail_reports(user, query):
+    """Visits shared as trail reports, at locations the user can see."""
+    visits = Visit.objects.filter(
+        query.location_q('location__'),
+        public_report=True,
+        location__in=visible_locations(user, query.include_public),
+    ).select_related('location')
+    return _closest(visits, 'location__point', query)
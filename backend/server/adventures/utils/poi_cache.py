@@ -0,0 +1,468 @@
+"""
+Cache for the recommendations (points of interest) lookups.
+
+Overpass and Google Places used to be queried for every request, although
+users panning around a city keep asking for the same area.
+
+Overpass results are cached per (category, radius bucket, geohash tile):
+
+- The requested radius is rounded up to a bucket (RADIUS_BUCKETS), which fixes
+  the geohash precision, so a request is covered by a handful of tiles.
+- A request is answered from the union of its covering tiles, trimmed to the
+  requested circle and sorted by distance. All missing tiles of a request are
+  fetched with one bbox query.
+
+Google Places only takes circles and returns at most 20 places per call, so a
+tile cannot be covered by one call. Its results are cached per rounded circle
+instead (google_circle): the center snapped to a small geohash cell and the
+radius rounded up to contain the requested circle.
+
+For both:
+
+- Entries are fresh for POI_CACHE_TTL seconds. For POI_CACHE_STALE_TTL seconds
+  after that they are still served, while a `refresh_poi_tiles` job fetches
+  them again in the background (stale-while-revalidate).
+- Missing entries are fetched under a per-entry lock in the cache, so
+  concurrent requests for the same area wait for the one fetch in flight
+  instead of each querying the provider.
+"""
+import hashlib
+import json
+import logging
+import math
+import time
+import zlib
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from geopy.distance import geodesic
+
+from adventures.utils import http_client
+
+logger = logging.getLogger(__name__)
+
+POI_CACHE_TTL = getattr(settings, 'POI_CACHE_TTL', 60 * 60 * 24 * 7)  # 1 week
+POI_CACHE_STALE_TTL = getattr(settings, 'POI_CACHE_STALE_TTL', 60 * 60 * 24 * 30)  # 30 days
+OVERPASS_TIMEOUT = getattr(settings, 'OVERPASS_TIMEOUT', 25)  # seconds, server side query limit
+OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+GOOGLE_PLACES_URL = "https://places.googleapis.com/v1/places:searchNearby"
+GOOGLE_MAX_RADIUS = 50000  # meters, limit of searchNearby
+
+GOOGLE_CENTER_ERROR = 8  # a rounded Google center is at most radius/8 from the requested one
+METERS_PER_DEGREE = 111320  # at the equator
+
+CACHE_KEY_PREFIX = 'poi:v2'
+CACHE_ITEM_MAX_SIZE = getattr(settings, 'POI_CACHE_ITEM_MAX_SIZE', 900 * 1024)  # bytes, below memcached's 1 MB item limit
+FETCH_WAIT_INTERVAL = 0.2  # seconds between checks for a tile another request is fetching
+FETCH_LOCK_TIMEOUT = OVERPASS_TIMEOUT + 10  # seconds a fetch holds its lock; waiters give up after twice that
+
+# Radius bucket in meters -> geohash precision. Tiles are about as large as the
+# bucket's circle (smaller in width away from the equator), so a request
+# touches a few tiles of its bucket.
+RADIUS_BUCKETS = (
+    (2000, 5),  # 4.9 x 4.9 km tiles
+    (10000, 4),  # 39 x 19.5 km
+    (50000, 3),  # 156 x 156 km
+)
+
+CATEGORIES = {
+    'tourism': {
+        'overpass': 'node[~"^(tourism|leisure|historic|sport|natural|attraction|museum|zoo|aquarium)$"~"."];',
+        'google': 'tourist_attraction',
+    },
+    'lodging': {
+        'overpass': 'node["tourism"~"^(hotel|motel|guest_house|hostel|camp_site|caravan_site|chalet|alpine_hut|apartment)$"];',
+        'google': 'lodging',
+    },
+    'food': {
+        'overpass': 'node["amenity"~"^(restaurant|cafe|fast_food|pub|bar|food_court|ice_cream|bakery|confectionery)$"];',
+        'google': 'restaurant',
+    },
+}
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+# Geohash
+
+def geohash_cell_size(precision):
+    """(longitude width, latitude height) in degrees of a geohash cell."""
+    bits = 5 * precision
+    return 360 / 2 ** math.ceil(bits / 2), 180 / 2 ** (bits // 2)
+
+
+def geohash_encode(latitude, longitude, precision):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash = []
+    bit, char, even = 0, 0, True
+    while len(geohash) < precision:
+        value, bounds = (longitude, lon_range) if even else (latitude, lat_range)
+        middle = (bounds[0] + bounds[1]) / 2
+        if value >= middle:
+            char = (char << 1) | 1
+            bounds[0] = middle
+        else:
+            char <<= 1
+            bounds[1] = middle
+        even = not even
+        bit += 1
+        if bit == 5:
+            geohash.append(GEOHASH_ALPHABET[char])
+            bit, char = 0, 0
+    return ''.join(geohash)
+
+
+def geohash_bbox(geohash):
+    """(west, south, east, north) of a geohash cell."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            bounds = lon_range if even else lat_range
+            middle = (bounds[0] + bounds[1]) / 2
+            if (value >> shift) & 1:
+                bounds[0] = middle
+            else:
+                bounds[1] = middle
+            even = not even
+    return lon_range[0], lat_range[0], lon_range[1], lat_range[1]
+
+
+def covering_tiles(latitude, longitude, radius, precision):
+    """Geohashes of the cells intersecting the bounding box of the circle (radius in meters)."""
+    width, height = geohash_cell_size(precision)
+    lat_delta = radius / METERS_PER_DEGREE
+    lon_delta = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+    south, north = max(-90.0, latitude - lat_delta), min(90.0, latitude + lat_delta)
+    rows = range(math.floor((south + 90) / height), min(math.floor((north + 90) / height), round(180 / height) - 1) + 1)
+    if lon_delta >= 180:
+        columns = range(round(360 / width))
+    else:
+        # Columns wrap around the antimeridian
+        columns = range(math.floor((longitude - lon_delta + 180) / width), math.floor((longitude + lon_delta + 180) / width) + 1)
+    column_count = round(360 / width)
+    tiles = set()
+    for row in rows:
+        for column in columns:
+            center_lat = -90 + (row + 0.5) * height
+            center_lon = -180 + (column % column_count + 0.5) * width
+            tiles.add(geohash_encode(center_lat, center_lon, precision))
+    return sorted(tiles)
+
+
+def radius_bucket(radius):
+    """(bucket radius, geohash precision) for a requested radius in meters."""
+    for bucket, precision in RADIUS_BUCKETS:
+        if radius <= bucket:
+            return bucket, precision
+    return RADIUS_BUCKETS[-1]
+
+
+# Providers
+
+def parse_overpass_elements(data):
+    places = []
+    for node in data.get('elements', []):
+        if node.get('type') not in ['node', 'way', 'relation']:
+            continue
+        lat = node.get('lat')
+        lon = node.get('lon')
+        if lat is None or lon is None:
+            continue
+        tags = node.get('tags', {})
+        name = tags.get('name', tags.get('official_name', ''))
+
+        # Flatten address
+        address_parts = [tags.get(f'addr:{k}') for k in ['housenumber', 'street', 'suburb', 'city', 'state', 'postcode', 'country']]
+        formatted_address = ", ".join(filter(None, address_parts)) or name
+
+        places.append({
+            "id": f"osm:{node.get('id')}",
+            "type": "place",
+            "name": name,
+            "description": tags.get('description'),
+            "latitude": lat,
+            "longitude": lon,
+            "address": formatted_address,
+            "tag": next((tags.get(key) for key in ['leisure', 'tourism', 'natural', 'historic', 'amenity'] if key in tags), None),
+            "powered_by": "osm"
+        })
+    return places
+
+
+def parse_google_places(data):
+    places = []
+    for place in data.get('places', []):
+        location = place.get('location', {})
+        types = place.get('types', [])
+        formatted_address = place.get("formattedAddress") or place.get("shortFormattedAddress")
+        display_name = place.get("displayName", {})
+        name = display_name.get("text") if isinstance(display_name, dict) else display_name
+
+        lat = location.get('latitude')
+        lon = location.get('longitude')
+        if not name or not lat or not lon:
+            continue
+
+        places.append({
+            "id": place.get('id'),
+            "type": 'place',
+            "name": name,
+            "description": place.get('businessStatus', None),
+            "latitude": lat,
+            "longitude": lon,
+            "address": formatted_address,
+            "tag": types[0] if types else None,
+        })
+    return places
+
+
+def fetch_overpass(category, tiles):
+    """All places of the tiles, with a single query over their bounding box."""
+    boxes = [geohash_bbox(tile) for tile in tiles]
+    west, south = min(box[0] for box in boxes), min(box[1] for box in boxes)
+    east, north = max(box[2] for box in boxes), max(box[3] for box in boxes)
+    if east - west > 180:
+        # The tiles straddle the antimeridian; one query per tile keeps the boxes small
+        places = {}
+        for tile in tiles:
+            places.update(fetch_overpass(category, [tile]))
+        return places
+
+    query = (
+        f"[out:json][timeout:{OVERPASS_TIMEOUT}][bbox:{south},{west},{north},{east}];"
+        f"({CATEGORIES[category]['overpass']});out;"
+    )
+    response = http_client.post(
+        OVERPASS_URL, data={'data': query}, timeout=(3.05, OVERPASS_TIMEOUT + 5),
+    )
+    response.raise_for_status()
+
+    precision = len(tiles[0])
+    places = {tile: [] for tile in tiles}
+    for place in parse_overpass_elements(response.json()):
+        tile = geohash_encode(place['latitude'], place['longitude'], precision)
+        if tile in places:
+            places[tile].append(place)
+    return places
+
+
+def google_circle(latitude, longitude, radius):
+    """
+    Cache unit of a Google Places request, '<geohash>@<radius>': the center
+    rounded to a geohash cell at most radius/GOOGLE_CENTER_ERROR across, and a
+    radius rounded up so that the circle contains the requested one (up to the
+    API limit). Requests from about the same spot share it.
+    """
+    for precision in range(5, 10):
+        width, height = geohash_cell_size(precision)
+        half_diagonal = math.hypot(width, height) / 2 * METERS_PER_DEGREE
+        if half_diagonal <= radius / GOOGLE_CENTER_ERROR:
+            break
+    needed = radius + half_diagonal
+    step = 10 ** max(0, math.floor(math.log10(needed)) - 1)  # two significant digits
+    return f"{geohash_encode(latitude, longitude, precision)}@{min(GOOGLE_MAX_RADIUS, math.ceil(needed / step) * step)}"
+
+
+def fetch_google(category, circles):
+    """
+    Places of each google_circle(). Google returns at most 20 places per call,
+    ranked by prominence, so a circle holds the 20 most prominent places in it,
+    not all of them.
+    """
+    headers = {
+        'Content-Type': 'application/json',
+        'X-Goog-Api-Key': settings.GOOGLE_MAPS_API_KEY,
+        'X-Goog-FieldMask': 'places.displayName.text,places.formattedAddress,places.location,places.types,places.rating,places.userRatingCount,places.businessStatus,places.id'
+    }
+    places = {}
+    for circle in circles:
+        geohash, radius = circle.split('@')
+        west, south, east, north = geohash_bbox(geohash)
+        payload = {
+            "includedTypes": [CATEGORIES[category]['google']],
+            "maxResultCount": 20,
+            "locationRestriction": {
+                "circle": {
+                    "center": {"latitude": (south + north) / 2, "longitude": (west + east) / 2},
+                    "radius": float(radius),
+                }
+            }
+        }
+        response = http_client.post(GOOGLE_PLACES_URL, json=payload, headers=headers, timeout=10)
+        response.raise_for_status()
+        places[circle] = parse_google_places(response.json())
+    return places
+
+
+PROVIDERS = {
+    'overpass': fetch_overpass,
+    'google': fetch_google,
+}
+
+
+# Cache
+
+def _tile_key(provider, category, bucket, tile):
+    return f"{CACHE_KEY_PREFIX}:{provider}:{category}:{bucket}:{tile}"
+
+
+def _lock_key(provider, category, bucket, tile):
+    return f"{CACHE_KEY_PREFIX}:lock:{provider}:{category}:{bucket}:{tile}"
+
+
+def _cache_get_many(keys):
+    if not keys:
+        return {}
+    try:
+        return cache.get_many(keys)
+    except Exception:
+        return {}
+
+
+def _store(provider, category, bucket, places):
+    """
+    Cache tiles as compressed JSON. Tiles larger than CACHE_ITEM_MAX_SIZE (dense
+    city tiles) do not fit into one memcached item and are split into chunks.
+    """
+    now = time.time()
+    entries = {}
+    for tile, tile_places in places.items():
+        key = _tile_key(provider, category, bucket, tile)
+        data = zlib.compress(json.dumps(tile_places, separators=(',', ':')).encode())
+        if len(data) <= CACHE_ITEM_MAX_SIZE:
+            entries[key] = {'fetched_at': now, 'data': data}
+            continue
+        chunks = [data[i:i + CACHE_ITEM_MAX_SIZE] for i in range(0, len(data), CACHE_ITEM_MAX_SIZE)]
+        entries[key] = {'fetched_at': now, 'chunks': len(chunks)}
+        entries.update({f"{key}:{i}": chunk for i, chunk in enumerate(chunks)})
+    try:
+        failed = cache.set_many(entries, POI_CACHE_TTL + POI_CACHE_STALE_TTL)
+    except Exception as e:
+        failed = entries
+        logger.warning(f"[POI cache] Could not cache {len(places)} tiles: {e}")
+    if failed:
+        logger.warning(f"[POI cache] {len(failed)} of {len(entries)} cache items were not stored")
+
+
+def _load(provider, category, bucket, tiles):
+    """Tile -> (places, fetched_at) of the cached tiles; tiles with an evicted chunk are left out."""
+    keys = {_tile_key(provider, category, bucket, tile): tile for tile in tiles}
+    entries = _cache_get_many(list(keys))
+    chunks = _cache_get_many([
+        f"{key}:{i}" for key, entry in entries.items() for i in range(entry.get('chunks', 0))
+    ])
+    loaded = {}
+    for key, entry in entries.items():
+        if 'chunks' in entry:
+            parts = [chunks.get(f"{key}:{i}") for i in range(entry['chunks'])]
+            if any(part is None for part in parts):
+                continue
+            data = b''.join(parts)
+        else:
+            data = entry['data']
+        loaded[keys[key]] = (json.loads(zlib.decompress(data)), entry['fetched_at'])
+    return loaded
+
+
+def _acquire(lock_key):
+    try:
+        return cache.add(lock_key, 1, FETCH_LOCK_TIMEOUT)
+    except Exception:
+        return True  # Without a cache there is nothing to coalesce on
+
+
+def _fetch_locked(provider, category, bucket, tiles, refresh=False):
+    """
+    Tile -> places for all tiles. Tiles nobody else is fetching are fetched here;
+    for the others this waits until they are cached. A tile whose lock is gone
+    while it is still not cached (the other fetch failed, or its lock expired)
+    is taken over right away. With refresh, only entries cached after the call
+    started count, so stale tiles are fetched again.
+    """
+    not_before = time.time() if refresh else 0
+    places = {}
+    remaining = list(tiles)
+    deadline = time.monotonic() + 2 * FETCH_LOCK_TIMEOUT
+    while True:
+        for tile, (tile_places, fetched_at) in _load(provider, category, bucket, remaining).items():
+            if fetched_at >= not_before:
+                places[tile] = tile_places
+        remaining = [tile for tile in remaining if tile not in places]
+        if not remaining:
+            return places
+
+        owned = [tile for tile in remaining if _acquire(_lock_key(provider, category, bucket, tile))]
+        if owned:
+            try:
+                fetched = PROVIDERS[provider](category, owned)
+                _store(provider, category, bucket, fetched)
+            finally:
+                try:
+                    cache.delete_many([_lock_key(provider, category, bucket, tile) for tile in owned])
+                except Exception:
+                    pass
+            places.update(fetched)
+            remaining = [tile for tile in remaining if tile not in places]
+            continue
+
+        if time.monotonic() >= deadline:
+            raise requests.exceptions.Timeout(f"Timed out waiting for {len(remaining)} tiles fetched by another request")
+        time.sleep(FETCH_WAIT_INTERVAL)
+
+
+def refresh_poi_tiles(provider, category, bucket, tiles):
+    """Job handler: fetch stale tiles again."""
+    _fetch_locked(provider, category, bucket, tiles, refresh=True)
+
+
+def _queue_refresh(provider, category, bucket, tiles):
+    from adventures.jobs import enqueue_job
+
+    dedupe_key = hashlib.sha256(f"{provider}:{category}:{bucket}:{','.join(tiles)}".encode()).hexdigest()
+    try:
+        enqueue_job('refresh_poi_tiles', dedupe_key, {
+            'provider': provider, 'category': category, 'bucket': bucket, 'tiles': tiles,
+        })
+    except Exception as e:
+        logger.warning(f"[POI cache] Could not queue a refresh of {len(tiles)} tiles: {e}")
+
+
+def get_places(provider, category, latitude, longitude, radius, include_unnamed=False):
+    """
+    Places within `radius` meters, closest first, each with `distance_km`.
+    Raises requests exceptions when a missing tile cannot be fetched.
+    """
+    if provider == 'google':
+        bucket = 'circle'
+        tiles = [google_circle(latitude, longitude, radius)]
+    else:
+        bucket, precision = radius_bucket(radius)
+        tiles = covering_tiles(latitude, longitude, min(radius, bucket), precision)
+
+    now = time.time()
+    places = {}
+    stale = []
+    for tile, (tile_places, fetched_at) in _load(provider, category, bucket, tiles).items():
+        places[tile] = tile_places
+        if now - fetched_at > POI_CACHE_TTL:
+            stale.append(tile)
+    if stale:
+        _queue_refresh(provider, category, bucket, stale)
+
+    missing = [tile for tile in tiles if tile not in places]
+    if missing:
+        places.update(_fetch_locked(provider, category, bucket, missing))
+
+    origin = (latitude, longitude)
+    results = {}
+    for tile_places in places.values():
+        for place in tile_places:
+            if not place['name'] and not include_unnamed:
+                continue
+            distance = geodesic(origin, (place['latitude'], place['longitude'])).m
+            if distance <= radius:
+                results[place['id']] = {**place, 'distance_km': round(distance / 1000, 2)}
+    return sorted(results.values(), key=lambda place: place['distance_km'])
@@ -0,0 +1,247 @@
+"""
+GPX track analytics on NumPy arrays.
+
+A GPX file is parsed once into contiguous arrays (latitude, longitude, elevation,
+time); everything else is computed from those arrays: distance, elevation
+gain/loss with smoothing and hysteresis, moving time, speed and pace
+percentiles, and per-kilometre splits.
+
+Used when activities are uploaded, by the activity_elevation_fix command and by
+the activity stats endpoint.
+"""
+import gpxpy
+import numpy as np
+from django.conf import settings
+
+EARTH_RADIUS_M = 6371008.8
+
+# Centered moving-average window (points) applied to elevations before gain/loss
+ELEVATION_SMOOTHING_WINDOW = getattr(settings, 'GPX_ELEVATION_SMOOTHING_WINDOW', 3)
+# Elevation changes smaller than this (m) are treated as noise and not counted
+ELEVATION_HYSTERESIS = getattr(settings, 'GPX_ELEVATION_HYSTERESIS', 0.0)
+# Slower than this (m/s) counts as stopped for moving time
+MOVING_SPEED_THRESHOLD = getattr(settings, 'GPX_MOVING_SPEED_THRESHOLD', 0.5)
+SPLIT_DISTANCE = 1000  # metres
+
+
+class Track:
+    """
+    Points of a GPX file as arrays. Missing elevations/times are NaN.
+    `segment_start` marks the first point of every track segment, so no
+    distance is counted across gaps between segments.
+    """
+
+    def __init__(self, lat, lon, ele, time, segment_start, waypoint_ele=None):
+        self.lat = lat
+        self.lon = lon
+        self.ele = ele
+        self.time = time
+        self.segment_start = segment_start
+        self.waypoint_ele = waypoint_ele if waypoint_ele is not None else np.empty(0)
+
+    def __len__(self):
+        return len(self.lat)
+
+
+def parse_gpx(gpx_file):
+    """Parse a GPX file (Django file or file-like object) into a Track."""
+    if hasattr(gpx_file, 'seek'):
+        gpx_file.seek(0)
+    gpx = gpxpy.parse(gpx_file)
+
+    # Routes are only used for files without tracks
+    segments = [segment.points for track in gpx.tracks for segment in track.segments]
+    if not any(segments):
+        segments = [route.points for route in gpx.routes]
+
+    points = [point for segment in segments for point in segment]
+    count = len(points)
+
+    lat = np.fromiter((p.latitude for p in points), dtype=np.float64, count=count)
+    lon = np.fromiter((p.longitude for p in points), dtype=np.float64, count=count)
+    ele = np.fromiter(
+        (p.elevation if p.elevation is not None else np.nan for p in points),
+        dtype=np.float64, count=count,
+    )
+    time = np.fromiter(
+        (p.time.timestamp() if getattr(p, 'time', None) else np.nan for p in points),
+        dtype=np.float64, count=count,
+    )
+
+    segment_start = np.zeros(count, dtype=bool)
+    offset = 0
+    for segment in segments:
+        if segment:
+            segment_start[offset] = True
+            offset += len(segment)
+
+    waypoint_ele = np.array(
+        [w.elevation for w in gpx.waypoints if w.elevation is not None], dtype=np.float64
+    )
+    return Track(lat, lon, ele, time, segment_start, waypoint_ele)
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres; works element-wise on arrays."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def step_distances(track):
+    """Distance from the previous point to each point (0 for segment starts)."""
+    if len(track) == 0:
+        return np.empty(0)
+    steps = np.zeros(len(track))
+    steps[1:] = haversine(track.lat[:-1], track.lon[:-1], track.lat[1:], track.lon[1:])
+    steps[track.segment_start] = 0.0
+    return steps
+
+
+def smooth(values, window):
+    """
+    Centered moving average in O(n). The window shrinks at both ends, so the
+    output has the same length as the input.
+    """
+    if window <= 1 or len(values) < window:
+        return values
+    kernel = np.ones(window)
+    sums = np.convolve(values, kernel, mode='same')
+    counts = np.convolve(np.ones(len(values)), kernel, mode='same')
+    return sums / counts
+
+
+def elevation_gain_loss(elevations, window=None, hysteresis=None):
+    """
+    Total ascent and descent of an elevation profile after smoothing. With a
+    hysteresis threshold, a climb or descent is only counted once the elevation
+    has moved more than the threshold away from the last counted point.
+    """
+    window = ELEVATION_SMOOTHING_WINDOW if window is None else window
+    hysteresis = ELEVATION_HYSTERESIS if hysteresis is None else hysteresis
+    if len(elevations) < 2:
+        return 0.0, 0.0
+
+    smoothed = smooth(elevations, window)
+    if hysteresis <= 0:
+        diffs = np.diff(smoothed)
+        return float(diffs[diffs > 0].sum()), float(-diffs[diffs < 0].sum())
+
+    gain = loss = 0.0
+    reference = smoothed[0]
+    for value in smoothed[1:]:
+        change = value - reference
+        if change >= hysteresis:
+            gain += change
+            reference = value
+        elif change <= -hysteresis:
+            loss -= change
+            reference = value
+    return float(gain), float(loss)
+
+
+def _percentiles(values, percentiles=(50, 90, 95)):
+    if len(values) == 0:
+        return None
+    return {f'p{p}': round(float(v), 2) for p, v in zip(percentiles, np.percentile(values, percentiles))}
+
+
+def _splits(track, steps, ele):
+    """Per-kilometre splits: time, pace and elevation change of every full or partial km."""
+    cumulative = np.cumsum(steps)
+    total = cumulative[-1] if len(cumulative) else 0.0
+    if total <= 0:
+        return []
+
+    boundaries = np.arange(SPLIT_DISTANCE, total, SPLIT_DISTANCE)
+    # Index of the first point at or beyond each boundary, plus the last point
+    ends = np.append(np.searchsorted(cumulative, boundaries), len(track) - 1)
+    splits = []
+    start = 0
+    for number, end in enumerate(ends, start=1):
+        distance = float(cumulative[end] - cumulative[start])
+        if distance <= 0:
+            continue
+        duration = float(track.time[end] - track.time[start])
+        split_ele = ele[start:end + 1]
+        split_ele = split_ele[~np.isnan(split_ele)]
+        gain, loss = elevation_gain_loss(split_ele)
+        splits.append({
+            'split': number,
+            'distance': round(distance, 1),
+            'elapsed_time': round(duration, 1) if not np.isnan(duration) else None,
+            'pace': round(duration / (distance / 1000), 1) if not np.isnan(duration) else None,  # s/km
+            'elevation_gain': round(gain, 1),
+            'elevation_loss': round(loss, 1),
+        })
+        start = end
+    return splits
+
+
+def analyze_track(track, include_splits=True):
+    """
+    Compute the summary of a Track. Distances are in metres, times in seconds,
+    speeds in m/s and paces in seconds per kilometre.
+    """
+    ele = track.ele
+    track_ele = ele[~np.isnan(ele)]
+    # Waypoint elevations only count toward high/low, or if the track has none
+    profile = track_ele if len(track_ele) else track.waypoint_ele
+    all_ele = np.concatenate([track_ele, track.waypoint_ele])
+    gain, loss = elevation_gain_loss(profile)
+
+    result = {
+        'point_count': len(track),
+        'distance': 0.0,
+        'elapsed_time': None,
+        'moving_time': None,
+        'elevation_gain': gain,
+        'elevation_loss': loss,
+        'elev_high': float(all_ele.max()) if len(all_ele) else 0.0,
+        'elev_low': float(all_ele.min()) if len(all_ele) else 0.0,
+        'average_speed': None,
+        'max_speed': None,
+        'speed_percentiles': None,
+        'pace_percentiles': None,
+        'start_lat': float(track.lat[0]) if len(track) else None,
+        'start_lng': float(track.lon[0]) if len(track) else None,
+        'end_lat': float(track.lat[-1]) if len(track) else None,
+        'end_lng': float(track.lon[-1]) if len(track) else None,
+        'start_time': None,
+        'splits': [],
+    }
+    if len(track) < 2:
+        return result
+
+    steps = step_distances(track)
+    result['distance'] = float(steps.sum())
+
+    times = track.time
+    if not np.isnan(times).all():
+        result['start_time'] = float(np.nanmin(times))
+        result['elapsed_time'] = float(np.nanmax(times) - np.nanmin(times))
+
+        dt = np.diff(times)
+        dist = steps[1:]
+        valid = (dt > 0) & ~np.isnan(dt) & ~track.segment_start[1:]
+        speeds = dist[valid] / dt[valid]
+        moving = speeds >= MOVING_SPEED_THRESHOLD
+        moving_time = float(dt[valid][moving].sum())
+        moving_speeds = speeds[moving]
+
+        result['moving_time'] = moving_time
+        if moving_time > 0:
+            result['average_speed'] = float(dist[valid][moving].sum() / moving_time)
+        if len(moving_speeds):
+            result['max_speed'] = float(moving_speeds.max())
+            result['speed_percentiles'] = _percentiles(moving_speeds)
+            result['pace_percentiles'] = _percentiles(1000 / moving_speeds)
+
+    if include_splits:
+        result['splits'] = _splits(track, steps, ele)
+    return result
+
+
+def analyze_gpx(gpx_file, include_splits=True):
+    """Parse and analyze a GPX file in one call."""
+    return analyze_track(parse_gpx(gpx_file), include_splits=include_splits)
@@ -0,0 +1,222 @@
+"""
+Mapbox Vector Tiles rendered by PostGIS.
+
+`/api/tiles/<layer>/<z>/<x>/<y>.mvt` returns one tile of a layer for the
+requesting user, encoded with ST_AsMVT/ST_AsMVTGeom:
+
+    locations   the user's locations and those in collections they own or share
+    regions     visited regions (centroids)
+    cities      visited cities
+    activities  GPX tracks of the user's and the shared locations' activities,
+                simplified to the tile's resolution
+
+The rows of a tile are selected with the ORM (visibility and the spatially
+indexed bounding box, see map_pins.py) and embedded as a subquery into the
+encoding SQL.
+
+Rendered tiles are kept in the Django cache. Every user has a tile token that is
+part of the cache key and of the ETag, and is replaced (once the change is
+committed) whenever something on their map changes, which drops all their
+cached tiles at once.
+"""
+import math
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Q
+
+from adventures.models import Activity, Collection, Location
+from adventures.utils import map_pins
+from worldtravel.models import City, Region, VisitedCity, VisitedRegion
+
+TILE_CACHE_TTL = getattr(settings, 'TILE_CACHE_TTL', 60 * 60 * 24)  # 1 day
+TILE_MAX_ZOOM = 22
+TILE_EXTENT = 4096
+TILE_BUFFER = 64  # in tile units, so symbols and lines crossing the edge are not cut off
+
+CACHE_KEY_PREFIX = 'tiles:v1'
+
+
+class InvalidTile(ValueError):
+    pass
+
+
+def tile_bbox(z, x, y):
+    """(west, south, east, north) in degrees of a tile, padded by TILE_BUFFER."""
+    if not 0 <= z <= TILE_MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise InvalidTile(f'Tile {z}/{x}/{y} does not exist')
+    n = 2 ** z
+    pad = TILE_BUFFER / TILE_EXTENT
+
+    def longitude(tx):
+        return max(-180.0, min(180.0, (tx / n) * 360 - 180))
+
+    def latitude(ty):
+        ty = max(0.0, min(float(n), ty))
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    return longitude(x - pad), latitude(y + 1 + pad), longitude(x + 1 + pad), latitude(y - pad)
+
+
+def _visible_locations(user):
+    return Location.objects.filter(
+        Q(user=user) | Q(collections__shared_with=user) | Q(collections__user=user)
+    ).values('id')
+
+
+def _locations_rows(user, bbox):
+    return Location.objects.filter(map_pins.bbox_q(bbox), id__in=_visible_locations(user)).values('id')
+
+
+def _regions_rows(user, bbox):
+    return Region.objects.filter(
+        map_pins.bbox_q(bbox), id__in=VisitedRegion.objects.filter(user=user).values('region_id'),
+    ).values('id')
+
+
+def _cities_rows(user, bbox):
+    return City.objects.filter(
+        map_pins.bbox_q(bbox), id__in=VisitedCity.objects.filter(user=user).values('city_id'),
+    ).values('id')
+
+
+def _activities_rows(user, bbox):
+    overlaps = Q()
+    for envelope in map_pins.bbox_envelopes(bbox):
+        overlaps |= Q(gpx_geometry__track__bboverlaps=envelope)
+    return Activity.objects.filter(
+        overlaps, Q(user=user) | Q(visit__location__in=_visible_locations(user)),
+    ).values('id')
+
+
+def _geom(column):
+    return (
+        f"ST_AsMVTGeom(ST_Transform({column}, 3857), ST_TileEnvelope(%s, %s, %s), "
+        f"{TILE_EXTENT}, {TILE_BUFFER}, true)"
+    )
+
+
+# layer -> (rows of the tile, SELECT list with %(geom)s, FROM clause `t`, geometry in SRID 4326)
+LAYERS = {
+    'locations': (
+        _locations_rows,
+        "%(geom)s AS geom, t.id::text AS id, t.name, t.is_visited, c.display_name AS category, c.icon",
+        "adventures_location t LEFT JOIN adventures_category c ON c.id = t.category_id",
+        "t.point::geometry",
+    ),
+    'regions': (
+        _regions_rows,
+        "%(geom)s AS geom, t.id, t.name",
+        "worldtravel_region t",
+        "t.point",
+    ),
+    'cities': (
+        _cities_rows,
+        "%(geom)s AS geom, t.id, t.name",
+        "worldtravel_city t",
+        "t.point",
+    ),
+    'activities': (
+        _activities_rows,
+        "%(geom)s AS geom, t.id::text AS id, t.name, t.sport_type, t.distance",
+        "adventures_activity t JOIN adventures_gpxgeometry g ON g.id = t.gpx_geometry_id",
+        "ST_Simplify(g.track, %(tolerance)s)",
+    ),
+}
+
+
+def render_tile(layer, user, z, x, y):
+    """The encoded tile (bytes, empty if the tile has no features)."""
+    rows, select, source, column = LAYERS[layer]
+    bbox = tile_bbox(z, x, y)
+    # Tracks are simplified to half a tile unit (in degrees); finer detail is snapped away anyway
+    tolerance = 360 / (2 ** z * TILE_EXTENT * 2)
+    geom = _geom(column % {'tolerance': repr(tolerance)})
+    subquery, subquery_params = rows(user, bbox).query.sql_with_params()
+    sql = (
+        f"SELECT ST_AsMVT(tile.*, %s, {TILE_EXTENT}, 'geom') FROM ("
+        f"SELECT {select % {'geom': geom}} FROM {source} WHERE t.id IN ({subquery})"
+        f") AS tile WHERE tile.geom IS NOT NULL"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [layer, z, x, y, *subquery_params])
+        row = cursor.fetchone()
+    return bytes(row[0]) if row and row[0] else b''
+
+
+def _token_key(user_id):
+    return f"{CACHE_KEY_PREFIX}:user:{user_id}"
+
+
+def _tile_key(layer, user_id, token, z, x, y):
+    return f"{CACHE_KEY_PREFIX}:tile:{layer}:{user_id}:{token}:{z}:{x}:{y}"
+
+
+def user_token(user):
+    """The user's current tile token, created on first use."""
+    try:
+        token = cache.get(_token_key(user.pk))
+        if token is None:
+            cache.add(_token_key(user.pk), uuid.uuid4().hex, timeout=None)
+            token = cache.get(_token_key(user.pk))
+    except Exception:
+        token = None
+    return token
+
+
+def get_tile(layer, user, z, x, y, token):
+    """Cached tile for the token, rendering it on a miss. Without a token nothing is cached."""
+    key = _tile_key(layer, user.pk, token, z, x, y)
+    if token:
+        try:
+            tile = cache.get(key)
+        except Exception:
+            tile = None
+        if tile is not None:
+            return tile
+
+    tile = render_tile(layer, user, z, x, y)
+    if token:
+        try:
+            cache.set(key, tile, TILE_CACHE_TTL)
+        except Exception:
+            pass  # e.g. larger than the memcached item size
+    return tile
+
+
+def invalidate_users(user_ids):
+    """Drop the cached tiles of these users."""
+    keys = [_token_key(user_id) for user_id in set(user_ids) if user_id is not None]
+    if not keys:
+        return
+
+    def replace():
+        try:
+            cache.set_many({key: uuid.uuid4().hex for key in keys}, timeout=None)
+        except Exception:
+            pass
+    transaction.on_commit(replace)
+
+
+def users_seeing_locations(location_ids):
+    """Ids of the users whose map shows any of these locations."""
+    location_ids = list(location_ids)
+    if not location_ids:
+        return set()
+    collections = Collection.objects.filter(locations__in=location_ids)
+    return {
+        *Location.objects.filter(id__in=location_ids).values_list('user_id', flat=True),
+        *collections.values_list('user_id', flat=True),
+        *collections.filter(shared_with__isnull=False).values_list('shared_with', flat=True),
+    }
+
+
+def invalidate_locations(location_ids):
+    invalidate_users(users_seeing_locations(location_ids))
+
+
+def invalidate_collection(collection):
+    """A collection's locations are shown to its owner and everyone it is shared with."""
+    invalidate_users([collection.user_id, *collection.shared_with.values_list('id', flat=True)])
@@ -17,4 +17,5 @@ from .recommendations_view import *
 from .import_export_view import *
 from .trail_view import *
 from .activity_view import *
-from .visit_view import *
\ No newline at end of file
+from .visit_view import *
+from .tile_view import *
@@ -4,8 +4,13 @@ from adventures.models import Location, Activity
 from adventures.serializers import ActivitySerializer
 from adventures.permissions import IsOwnerOrSharedWithFullAccess
 from rest_framework.exceptions import PermissionDenied
-import gpxpy
-from typing import Tuple
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from adventures.utils.track_analytics import analyze_gpx
+from datetime import datetime, timedelta, timezone as dt_timezone
+import logging
+
+logger = logging.getLogger(__name__)
 
 class ActivityViewSet(viewsets.ModelViewSet):
     serializer_class = ActivitySerializer
@@ -46,14 +51,10 @@ class ActivityViewSet(viewsets.ModelViewSet):
         if location and not IsOwnerOrSharedWithFullAccess().has_object_permission(self.request, self, location):
             raise PermissionDenied("You do not have permission to add an activity to this location.")
 
-        # if there is a GPX file, use it to get elevation data
+        # if there is a GPX file, use it to get elevation data and fill in missing metrics
         gpx_file = serializer.validated_data.get('gpx_file')
         if gpx_file:
-            elevation_gain, elevation_loss, elevation_high, elevation_low = self._get_elevation_data_from_gpx(gpx_file)
-            serializer.validated_data['elevation_gain'] = elevation_gain
-            serializer.validated_data['elevation_loss'] = elevation_loss
-            serializer.validated_data['elev_high'] = elevation_high
-            serializer.validated_data['elev_low'] = elevation_low
+            self._apply_gpx_analytics(serializer.validated_data, gpx_file)
 
         serializer.save(user=location.user)
 
@@ -79,72 +80,47 @@ class ActivityViewSet(viewsets.ModelViewSet):
 
         instance.delete()
 
-    def _get_elevation_data_from_gpx(self, gpx_file) -> Tuple[float, float, float, float]:
-        """
-        Extract elevation data from a GPX file.
-        Returns: (elevation_gain, elevation_loss, elevation_high, elevation_low)
-        """
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        """Detailed track statistics (speed/pace percentiles, per-km splits) from the GPX file."""
+        activity = self.get_object()
+        if not activity.gpx_file:
+            return Response({"error": "Activity has no GPX file"}, status=400)
         try:
-            # Parse the GPX file
-            gpx_file.seek(0)  # Reset file pointer if needed
-            gpx = gpxpy.parse(gpx_file)
-            
-            elevations = []
-            
-            # Extract all elevation points from tracks and track segments
-            for track in gpx.tracks:
-                for segment in track.segments:
-                    for point in segment.points:
-                        if point.elevation is not None:
-                            elevations.append(point.elevation)
-            
-            # Also check waypoints for elevation data
-            for waypoint in gpx.waypoints:
-                if waypoint.elevation is not None:
-                    elevations.append(waypoint.elevation)
-            
-            # If no elevation data found, return zeros
-            if not elevations:
-                return 0.0, 0.0, 0.0, 0.0
-            
-            # Calculate basic stats
-            elevation_high = max(elevations)
-            elevation_low = min(elevations)
-            
-            # Calculate gain and loss by comparing consecutive points
-            elevation_gain = 0.0
-            elevation_loss = 0.0
-            
-            # Apply simple smoothing to reduce GPS noise (optional)
-            smoothed_elevations = self._smooth_elevations(elevations)
-            
-            for i in range(1, len(smoothed_elevations)):
-                diff = smoothed_elevations[i] - smoothed_elevations[i-1]
-                if diff > 0:
-                    elevation_gain += diff
-                else:
-                    elevation_loss += abs(diff)
-            
-            return elevation_gain, elevation_loss, elevation_high, elevation_low
-            
+            return Response(analyze_gpx(activity.gpx_file))
         except Exception as e:
-            # Log the error and return zeros
-            print(f"Error parsing GPX file: {e}")
-            return 0.0, 0.0, 0.0, 0.0
+            logger.error(f"Error analyzing GPX file for activity {activity.id}: {e}")
+            return Response({"error": "Could not read the GPX file"}, status=400)
 
-    def _smooth_elevations(self, elevations, window_size=3):
+    def _apply_gpx_analytics(self, data, gpx_file):
         """
-        Apply simple moving average smoothing to reduce GPS elevation noise.
+        Set elevation data from the GPX track, and distance, times, speeds and
+        start/end coordinates unless they were provided.
         """
-        if len(elevations) < window_size:
-            return elevations
-        
-        smoothed = []
-        half_window = window_size // 2
-        
-        for i in range(len(elevations)):
-            start = max(0, i - half_window)
-            end = min(len(elevations), i + half_window + 1)
-            smoothed.append(sum(elevations[start:end]) / (end - start))
-        
-        return smoothed
\ No newline at end of file
+        try:
+            stats = analyze_gpx(gpx_file, include_splits=False)
+        except Exception as e:
+            logger.error(f"Error parsing GPX file: {e}")
+            data.update({'elevation_gain': 0.0, 'elevation_loss': 0.0, 'elev_high': 0.0, 'elev_low': 0.0})
+            return
+        finally:
+            gpx_file.seek(0)
+
+        for field in ('elevation_gain', 'elevation_loss', 'elev_high', 'elev_low'):
+            data[field] = stats[field]
+
+        defaults = {
+            'distance': stats['distance'] or None,
+            'moving_time': timedelta(seconds=stats['moving_time']) if stats['moving_time'] else None,
+            'elapsed_time': timedelta(seconds=stats['elapsed_time']) if stats['elapsed_time'] else None,
+            'average_speed': stats['average_speed'],
+            'max_speed': stats['max_speed'],
+            'start_date': datetime.fromtimestamp(stats['start_time'], tz=dt_timezone.utc) if stats['start_time'] else None,
+            'start_lat': stats['start_lat'],
+            'start_lng': stats['start_lng'],
+            'end_lat': stats['end_lat'],
+            'end_lng': stats['end_lng'],
+        }
+        for field, value in defaults.items():
+            if data.get(field) is None and value is not None:
+                data[field] = value
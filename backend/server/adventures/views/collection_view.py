@@ -1,10 +1,10 @@
-from django.db.models import Q, Prefetch
+from django.db.models import Q
 from django.db.models.functions import Lower
 from django.db import transaction
 from rest_framework import viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from adventures.models import Collection, Location, Transportation, Note, Checklist, CollectionInvite, ContentImage
+from adventures.models import Collection, Location, Transportation, Note, Checklist, CollectionInvite
 from adventures.permissions import CollectionShared
 from adventures.serializers import CollectionSerializer, CollectionInviteSerializer, UltraSlimCollectionSerializer
 from users.models import CustomUser as User
@@ -80,13 +80,7 @@ class CollectionViewSet(viewsets.ModelViewSet):
 
     def get_optimized_queryset_for_listing(self):
         """Get optimized queryset for list actions with prefetching"""
-        return self.get_base_queryset().select_related('user').prefetch_related(
-            Prefetch(
-                'locations__images',
-                queryset=ContentImage.objects.filter(is_primary=True).select_related('user'),
-                to_attr='primary_images'
-            )
-        )
+        return UltraSlimCollectionSerializer.optimize_queryset(self.get_base_queryset())
 
     def get_base_queryset(self):
         """Base queryset logic extracted for reuse"""
@@ -124,6 +118,8 @@ class CollectionViewSet(viewsets.ModelViewSet):
         """Get queryset with optimizations for list actions"""
         if self.action in ['list', 'all', 'archived', 'shared']:
             return self.get_optimized_queryset_for_listing()
+        if self.action == 'retrieve':
+            return CollectionSerializer.optimize_queryset(self.get_base_queryset(), self.get_serializer_context())
         return self.get_base_queryset()
     
     def list(self, request):
@@ -131,14 +127,10 @@ class CollectionViewSet(viewsets.ModelViewSet):
         if not request.user.is_authenticated:
             return Response({"error": "User is not authenticated"}, status=400)
         
-        queryset = Collection.objects.filter(
-            (Q(user=request.user.id) | Q(shared_with=request.user)) & Q(is_archived=False)
-        ).distinct().select_related('user').prefetch_related(
-            Prefetch(
-                'locations__images',
-                queryset=ContentImage.objects.filter(is_primary=True).select_related('user'),
-                to_attr='primary_images'
-            )
+        queryset = UltraSlimCollectionSerializer.optimize_queryset(
+            Collection.objects.filter(
+                (Q(user=request.user.id) | Q(shared_with=request.user)) & Q(is_archived=False)
+            ).distinct()
         )
         
         queryset = self.apply_sorting(queryset)
@@ -149,13 +141,9 @@ class CollectionViewSet(viewsets.ModelViewSet):
         if not request.user.is_authenticated:
             return Response({"error": "User is not authenticated"}, status=400)
        
-        queryset = Collection.objects.filter(
-            Q(user=request.user)
-        ).select_related('user').prefetch_related(
-            Prefetch(
-                'locations__images',
-                queryset=ContentImage.objects.filter(is_primary=True).select_related('user'),
-                to_attr='primary_images'
+        queryset = UltraSlimCollectionSerializer.optimize_queryset(
+            Collection.objects.filter(
+                Q(user=request.user)
             )
         )
         
@@ -169,13 +157,9 @@ class CollectionViewSet(viewsets.ModelViewSet):
         if not request.user.is_authenticated:
             return Response({"error": "User is not authenticated"}, status=400)
        
-        queryset = Collection.objects.filter(
-            Q(user=request.user.id) & Q(is_archived=True)
-        ).select_related('user').prefetch_related(
-            Prefetch(
-                'locations__images',
-                queryset=ContentImage.objects.filter(is_primary=True).select_related('user'),
-                to_attr='primary_images'
+        queryset = UltraSlimCollectionSerializer.optimize_queryset(
+            Collection.objects.filter(
+                Q(user=request.user.id) & Q(is_archived=True)
             )
         )
         
@@ -252,13 +236,9 @@ class CollectionViewSet(viewsets.ModelViewSet):
         if not request.user.is_authenticated:
             return Response({"error": "User is not authenticated"}, status=400)
         
-        queryset = Collection.objects.filter(
-            shared_with=request.user
-        ).select_related('user').prefetch_related(
-            Prefetch(
-                'locations__images',
-                queryset=ContentImage.objects.filter(is_primary=True).select_related('user'),
-                to_attr='primary_images'
+        queryset = UltraSlimCollectionSerializer.optimize_queryset(
+            Collection.objects.filter(
+                shared_with=request.user
             )
         )
         
@@ -4,6 +4,7 @@ import urllib.parse
 from difflib import SequenceMatcher
 
 import requests
+from adventures.utils import http_client
 from django.conf import settings
 from rest_framework import viewsets
 from rest_framework.decorators import action
@@ -189,7 +190,7 @@ class GenerateDescription(viewsets.ViewSet):
             'utf8': 1,
         }
 
-        response = requests.get(url, headers=self.get_headers(lang), params=params, timeout=10)
+        response = http_client.get(url, headers=self.get_headers(lang), params=params, timeout=10)
         response.raise_for_status()
 
         try:
@@ -295,7 +296,7 @@ class GenerateDescription(viewsets.ViewSet):
         if extra_params:
             params.update(extra_params)
 
-        response = requests.get(
+        response = http_client.get(
             self.build_api_url(lang),
             headers=self.get_headers(lang),
             params=params,
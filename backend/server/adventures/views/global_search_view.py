@@ -34,12 +34,14 @@ class GlobalSearchView(viewsets.ViewSet):
         locations = Location.objects.annotate(
             search=SearchVector('name', 'description', 'location')
         ).filter(search=SearchQuery(search_term), user=request.user)
+        locations = LocationSerializer.optimize_queryset(locations)
         results["locations"] = LocationSerializer(locations, many=True).data
 
         # Collections: Partial Match Search
         collections = Collection.objects.filter(
             Q(name__icontains=search_term) & Q(user=request.user)
         )
+        collections = CollectionSerializer.optimize_queryset(collections)
         results["collections"] = CollectionSerializer(collections, many=True).data
 
         # Users: Public Profiles Only
@@ -1,6 +1,7 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.db import transaction
 from django.db.models import Q
 from django.core.files.base import ContentFile
 from django.contrib.contenttypes.models import ContentType
@@ -9,7 +10,10 @@ from adventures.serializers import ContentImageSerializer
 from integrations.models import ImmichIntegration
 from adventures.permissions import IsOwnerOrSharedWithFullAccess  # Your existing permission class
 import requests
+from adventures.utils import http_client
 from adventures.permissions import ContentImagePermission
+from adventures.jobs import enqueue_job
+from adventures.utils.image_processing import InvalidImage, store_upload
 
 
 class ContentImageViewSet(viewsets.ModelViewSet):
@@ -195,10 +199,11 @@ class ContentImageViewSet(viewsets.ModelViewSet):
         
         # Download the image from the shared user's Immich server
         try:
-            immich_response = requests.get(
+            immich_response = http_client.get(
                 f'{user_integration.server_url}/assets/{immich_id}/thumbnail?size=preview',
                 headers={'x-api-key': user_integration.api_key},
-                timeout=10
+                timeout=10,
+                circuit_key=f'immich:{user_integration.id}',
             )
             immich_response.raise_for_status()
             
@@ -291,13 +296,21 @@ class ContentImageViewSet(viewsets.ModelViewSet):
             'object_id': object_id,
         }
         
-        # Add image file if provided
+        # Uploads are stored as received; resizing and EXIF extraction run in the background
         if image_file:
-            save_kwargs['image'] = image_file
+            try:
+                save_kwargs['image'] = store_upload(image_file)
+            except InvalidImage as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            save_kwargs['status'] = ContentImage.STATUS_PROCESSING
 
         # Save with appropriate parameters
-        serializer.save(**save_kwargs)
+        instance = serializer.save(**save_kwargs)
 
+        if image_file:
+            transaction.on_commit(lambda: enqueue_job('process_image', str(instance.id), {'image_id': str(instance.id)}))
+            # Poll GET /api/images/<id>/ until status is "ready"
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     
@@ -3,14 +3,18 @@ from django.db import transaction
 from django.core.exceptions import PermissionDenied
 from django.db.models import Q, Max
 from django.db.models.functions import Lower
+from django.http import HttpResponseNotModified
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 import requests
+from adventures.utils import http_client
 from adventures.models import Location, Category
 from adventures.permissions import IsOwnerOrSharedWithFullAccess
-from adventures.serializers import LocationSerializer, MapPinSerializer
-from adventures.utils import pagination
+from adventures.serializers import (
+    LocationSerializer, MapPinSerializer, NearbyLocationSerializer, NearbyLodgingSerializer, TrailReportSerializer,
+)
+from adventures.utils import map_pins, nearby, pagination
 
 class LocationViewSet(viewsets.ModelViewSet):
     """
@@ -33,19 +37,25 @@ class LocationViewSet(viewsets.ModelViewSet):
 
         if not user.is_authenticated:
             if self.action in public_allowed_actions:
-                return Location.objects.retrieve_locations(
-                    user, include_public=True
-                ).order_by('-updated_at')
+                return LocationSerializer.optimize_queryset(
+                    Location.objects.retrieve_locations(user, include_public=True).order_by('-updated_at'),
+                    self.get_serializer_context()
+                )
             return Location.objects.none()
 
         include_public = self.action in public_allowed_actions
-        return Location.objects.retrieve_locations(
+        queryset = Location.objects.retrieve_locations(
             user,
             include_public=include_public,
             include_owned=True,
             include_shared=True
         ).order_by('-updated_at')
 
+        # Only read actions serialize straight from the queryset
+        if self.action in ('list', 'retrieve', 'additional_info'):
+            queryset = LocationSerializer.optimize_queryset(queryset, self.get_serializer_context())
+        return queryset
+
     # ==================== SORTING & FILTERING ====================
 
     def apply_sorting(self, queryset):
@@ -205,7 +215,9 @@ class LocationViewSet(viewsets.ModelViewSet):
             queryset = Location.objects.filter(base_filter, collections__isnull=True)
 
         queryset = self.apply_sorting(queryset)
-        serializer = self.get_serializer(queryset, many=True, context={'nested': nested, 'allowed_nested_fields': allowedNestedFields})
+        context = {**self.get_serializer_context(), 'nested': nested, 'allowed_nested_fields': allowedNestedFields}
+        queryset = LocationSerializer.optimize_queryset(queryset, context)
+        serializer = self.get_serializer(queryset, many=True, context=context)
         return Response(serializer.data)
 
     @action(detail=True, methods=['get'], url_path='additional-info')
@@ -233,13 +245,78 @@ class LocationViewSet(viewsets.ModelViewSet):
     # view to return location name and lat/lon for all locations a user owns for the golobal map
     @action(detail=False, methods=['get'], url_path='pins')
     def map_locations(self, request):
-        """Get all locations with name and lat/lon for map display."""
+        """
+        Get locations with name and lat/lon for map display.
+
+        Without parameters every pin of the user is returned as a list. With
+        `?bbox=west,south,east,north` only pins in the viewport are returned, and
+        with `&zoom=z` below PIN_CLUSTER_MAX_ZOOM they are grouped into clusters:
+        {"clusters": [...], "pins": [...]}. Responses carry an ETag, so an
+        unchanged viewport is answered with 304.
+        """
         if not request.user.is_authenticated:
             return Response({"error": "User is not authenticated"}, status=400)
 
+        try:
+            bbox = map_pins.parse_bbox(request.query_params['bbox']) if 'bbox' in request.query_params else None
+            zoom = map_pins.parse_zoom(request.query_params['zoom']) if 'zoom' in request.query_params else None
+        except map_pins.InvalidViewport as e:
+            return Response({"error": str(e)}, status=400)
+
         locations = Location.objects.filter(user=request.user)
-        serializer = MapPinSerializer(locations, many=True)
-        return Response(serializer.data)
+        locations = self._apply_visit_filtering(locations, request)
+        if bbox:
+            locations = locations.filter(map_pins.bbox_q(bbox))
+
+        params = {'bbox': bbox, 'zoom': zoom, 'is_visited': request.query_params.get('is_visited')}
+        etag = map_pins.pins_etag(locations, Category.objects.filter(user=request.user), params)
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponseNotModified()
+        elif zoom is not None and zoom < map_pins.PIN_CLUSTER_MAX_ZOOM:
+            clusters, single_ids = map_pins.cluster_locations(locations, zoom)
+            pins = Location.objects.filter(id__in=single_ids).select_related('category')
+            response = Response({
+                'clusters': clusters,
+                'pins': MapPinSerializer(pins, many=True).data,
+            })
+        elif bbox or zoom is not None:
+            pins = locations.select_related('category')
+            response = Response({'clusters': [], 'pins': MapPinSerializer(pins, many=True).data})
+        else:
+            response = Response(MapPinSerializer(locations.select_related('category'), many=True).data)
+        response['ETag'] = etag
+        # Cached by the browser, but revalidated on every request
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    @action(detail=False, methods=['get'], url_path='nearby')
+    def nearby_search(self, request):
+        """
+        Locations, lodging and public trail reports within `radius` km (default
+        20) of `lat`/`lon`, closest first, from the spatial index.
+
+        Optional: `limit` per kind, `include=locations,lodging,trail_reports`,
+        `category` (names), `difficulty_level` and `point_type` (comma separated),
+        `include_public=false` to search only the user's own and shared rows.
+        """
+        if not request.user.is_authenticated:
+            return Response({"error": "User is not authenticated"}, status=400)
+
+        try:
+            query = nearby.NearbyQuery(request.query_params)
+        except nearby.InvalidNearbyQuery as e:
+            return Response({"error": str(e)}, status=400)
+
+        data = {'radius_km': query.radius_km}
+        if 'locations' in query.kinds:
+            data['locations'] = NearbyLocationSerializer(nearby.nearby_locations(request.user, query), many=True).data
+        if 'lodging' in query.kinds:
+            data['lodging'] = NearbyLodgingSerializer(nearby.nearby_lodging(request.user, query), many=True).data
+        if 'trail_reports' in query.kinds:
+            data['trail_reports'] = TrailReportSerializer(
+                nearby.nearby_trail_reports(request.user, query), many=True
+            ).data
+        return Response(data)
 
     # ==================== HELPER METHODS ====================
 
@@ -302,14 +379,7 @@ class LocationViewSet(viewsets.ModelViewSet):
         else:
             return queryset
 
-        # Apply visit filtering
-        now = timezone.now().date()
-        if is_visited_bool:
-            queryset = queryset.filter(visits__start_date__lte=now).distinct()
-        else:
-            queryset = queryset.exclude(visits__start_date__lte=now).distinct()
-
-        return queryset
+        return queryset.filter(is_visited=is_visited_bool)
 
     def _has_adventure_access(self, adventure, user):
         """Check if user has access to adventure."""
@@ -344,7 +414,7 @@ class LocationViewSet(viewsets.ModelViewSet):
             )
             
             try:
-                response = requests.get(api_url)
+                response = http_client.get(api_url)
                 if response.status_code == 200:
                     data = response.json()
                     results = data.get('results', {})
@@ -364,6 +434,7 @@ class LocationViewSet(viewsets.ModelViewSet):
 
     def paginate_and_respond(self, queryset, request):
         """Paginate queryset and return response."""
+        queryset = LocationSerializer.optimize_queryset(queryset, self.get_serializer_context())
         paginator = self.pagination_class()
         page = paginator.paginate_queryset(queryset, request)
         
@@ -1,13 +1,21 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.db import connection
+from django.http import StreamingHttpResponse
 from rest_framework import viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from worldtravel.models import Region, City, VisitedRegion, VisitedCity
 from adventures.models import Location
-from adventures.serializers import LocationSerializer
-from adventures.geocoding import reverse_geocode
+from adventures.geocoding import reverse_geocode_local, reverse_geocode_remote
 from django.conf import settings
 from adventures.geocoding import search_google, search_osm
+from worldtravel.views import invalidate_visit_caches_for_region_and_user
+from adventures.utils import vector_tiles
+
+logger = logging.getLogger(__name__)
 
 class ReverseGeocodeViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
@@ -23,7 +31,11 @@ class ReverseGeocodeViewSet(viewsets.ViewSet):
             lon = float(lon)
         except ValueError:
             return Response({"error": "Invalid latitude or longitude"}, status=400)
-        data = reverse_geocode(lat, lon, self.request.user)
+        # The remote provider is tried first here because it also supplies a
+        # location name; the local resolver keeps this working offline.
+        data = reverse_geocode_remote(lat, lon, self.request.user)
+        if 'error' in data:
+            data = reverse_geocode_local(lat, lon, self.request.user)
         if 'error' in data:
             return Response({"error": "An internal error occurred while processing the request"}, status=400)
         return Response(data)
@@ -45,41 +57,116 @@ class ReverseGeocodeViewSet(viewsets.ViewSet):
 
     @action(detail=False, methods=['post'])
     def mark_visited_region(self, request):
-        # searches through all of the users locations, if the serialized data is_visited, is true, runs reverse geocode on the locations and if a region is found, marks it as visited. Use the extractIsoCode function to get the region
-        new_region_count = 0
-        new_regions = {}
-        new_city_count = 0
-        new_cities = {}
-        locations = Location.objects.filter(user=self.request.user)
-        serializer = LocationSerializer(locations, many=True)
-        for adventure, serialized_adventure in zip(locations, serializer.data):
-            if serialized_adventure['is_visited'] == True:
-                lat = adventure.latitude
-                lon = adventure.longitude
-                if not lat or not lon:
-                    continue
-
-                # Use the existing reverse_geocode function which handles both Google and OSM
-                data = reverse_geocode(lat, lon, self.request.user)
+        """
+        Mark the regions and cities of all visited locations as visited.
+        Streams newline-delimited JSON progress updates followed by a summary.
+        """
+        response = StreamingHttpResponse(
+            self._mark_visited_region_stream(request.user),
+            content_type='application/x-ndjson',
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def _mark_visited_region_stream(self, user):
+        try:
+            points = _visited_location_points(user)
+            total = len(points)
+            yield _ndjson({"stage": "resolving", "processed": 0, "total": total})
+
+            results = []
+            unresolved = []
+            for lat, lon in points:
+                data = reverse_geocode_local(lat, lon, user)
                 if 'error' in data:
-                    continue
-
-                # data already contains region_id and city_id
-                if 'region_id' in data and data['region_id'] is not None:
-                    region = Region.objects.filter(id=data['region_id']).first()
-                    visited_region = VisitedRegion.objects.filter(region=region, user=self.request.user).first()
-                    if not visited_region:
-                        visited_region = VisitedRegion(region=region, user=self.request.user)
-                        visited_region.save()
-                        new_region_count += 1
-                        new_regions[region.id] = region.name
-
-                if 'city_id' in data and data['city_id'] is not None:
-                    city = City.objects.filter(id=data['city_id']).first()
-                    visited_city = VisitedCity.objects.filter(city=city, user=self.request.user).first()
-                    if not visited_city:
-                        visited_city = VisitedCity(city=city, user=self.request.user)
-                        visited_city.save()
-                        new_city_count += 1
-                        new_cities[city.id] = city.name
-        return Response({"new_regions": new_region_count, "regions": new_regions, "new_cities": new_city_count, "cities": new_cities})
\ No newline at end of file
+                    unresolved.append((lat, lon))
+                else:
+                    results.append(data)
+            processed = total - len(unresolved)
+            yield _ndjson({"stage": "resolving", "processed": processed, "total": total})
+
+            if unresolved:
+                with ThreadPoolExecutor(max_workers=MARK_VISITED_GEOCODE_WORKERS) as executor:
+                    futures = [executor.submit(_reverse_geocode_remote_threaded, lat, lon, user) for lat, lon in unresolved]
+                    for future in as_completed(futures):
+                        data = future.result()
+                        if 'error' not in data:
+                            results.append(data)
+                        processed += 1
+                        if processed % MARK_VISITED_PROGRESS_EVERY == 0 or processed == total:
+                            yield _ndjson({"stage": "resolving", "processed": processed, "total": total})
+
+            yield _ndjson({"stage": "saving", "processed": total, "total": total})
+            yield _ndjson(_save_visited(user, results))
+        except Exception as e:
+            logger.exception(f"mark_visited_region failed for user {user.id}: {e}")
+            yield _ndjson({"error": "An internal error occurred while processing the request"})
+
+
+# Points closer than this many decimal places (~110 m) are resolved once
+MARK_VISITED_DEDUPE_PRECISION = 3
+MARK_VISITED_GEOCODE_WORKERS = getattr(settings, 'MARK_VISITED_GEOCODE_WORKERS', 4)
+MARK_VISITED_PROGRESS_EVERY = 25
+
+
+def _ndjson(data):
+    return json.dumps(data) + "\n"
+
+
+def _visited_location_points(user):
+    """Distinct, rounded coordinates of the user's visited locations."""
+    rows = (
+        Location.objects
+        .filter(
+            user=user,
+            is_visited=True,
+            latitude__isnull=False,
+            longitude__isnull=False,
+        )
+        .values_list('latitude', 'longitude')
+        .distinct()
+    )
+    return sorted({
+        (round(float(lat), MARK_VISITED_DEDUPE_PRECISION), round(float(lon), MARK_VISITED_DEDUPE_PRECISION))
+        for lat, lon in rows
+    })
+
+
+def _reverse_geocode_remote_threaded(lat, lon, user):
+    try:
+        return reverse_geocode_remote(lat, lon, user)
+    finally:
+        connection.close()
+
+
+def _save_visited(user, results):
+    region_ids = {data['region_id'] for data in results if data.get('region_id')}
+    city_ids = {data['city_id'] for data in results if data.get('city_id')}
+
+    existing_regions = set(VisitedRegion.objects.filter(user=user, region_id__in=region_ids).values_list('region_id', flat=True))
+    existing_cities = set(VisitedCity.objects.filter(user=user, city_id__in=city_ids).values_list('city_id', flat=True))
+    regions = list(Region.objects.filter(id__in=region_ids - existing_regions).select_related('country'))
+    new_regions = {region.id: region.name for region in regions}
+    cities = list(City.objects.filter(id__in=city_ids - existing_cities).select_related('region__country'))
+    new_cities = {city.id: city.name for city in cities}
+
+    VisitedRegion.objects.bulk_create(
+        [VisitedRegion(user=user, region_id=region_id) for region_id in new_regions],
+        ignore_conflicts=True,
+    )
+    VisitedCity.objects.bulk_create(
+        [VisitedCity(user=user, city_id=city_id) for city_id in new_cities],
+        ignore_conflicts=True,
+    )
+
+    if new_regions or new_cities:
+        # bulk_create sends no signals
+        vector_tiles.invalidate_users([user.id])
+
+    affected_regions = {region.id: region for region in regions}
+    affected_regions.update({city.region_id: city.region for city in cities})
+    for region in affected_regions.values():
+        invalidate_visit_caches_for_region_and_user(region, user)
+
+    return {"new_regions": len(new_regions), "regions": new_regions, "new_cities": len(new_cities), "cities": new_cities}
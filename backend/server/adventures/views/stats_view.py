@@ -3,7 +3,6 @@ from rest_framework.response import Response
 from rest_framework.decorators import action
 from django.shortcuts import get_object_or_404
 from adventures.utils.sports_types import SPORT_CATEGORIES
-from adventures.utils.get_is_visited import is_location_visited
 from django.db.models import Sum, Avg, Max, Count, Q
 from django.db.models.functions import TruncMonth
 from worldtravel.models import City, Region, Country, VisitedCity, VisitedRegion
@@ -19,16 +18,7 @@ class StatsViewSet(viewsets.ViewSet):
 
     def _get_visited_locations_count(self, user):
         """Calculate count of visited locations for a user"""
-        visited_count = 0
-        
-        # Get all locations for this user
-        user_locations = Location.objects.filter(user=user).prefetch_related('visits')
-        
-        for location in user_locations:
-            if is_location_visited(location):
-                visited_count += 1
-        
-        return visited_count
+        return Location.objects.filter(user=user, is_visited=True).count()
 
     def _get_activity_stats_by_category(self, user_activities):
         """Calculate detailed stats for each sport category"""
@@ -168,26 +158,18 @@ class StatsViewSet(viewsets.ViewSet):
             total_hiking_hours = 0
 
         # Get summits reached (locations with point_type='summit' that have been visited)
-        summits = Location.objects.filter(
+        summits_reached = Location.objects.filter(
             user=user,
-            point_type='summit'
-        ).prefetch_related('visits')
-
-        summits_reached = sum(1 for summit in summits if is_location_visited(summit))
+            point_type='summit',
+            is_visited=True
+        ).count()
 
         # Get trails hiked (any location with visits)
-        all_locations = Location.objects.filter(user=user).prefetch_related('visits')
-        trails_hiked = sum(1 for location in all_locations if is_location_visited(location))
+        trails_hiked = self._get_visited_locations_count(user)
 
         # Get routes completed (collections with at least one visited location)
-        collections = Collection.objects.filter(user=user).prefetch_related('locations__visits')
-        routes_completed = 0
-
-        for collection in collections:
-            for location in collection.locations.all():
-                if is_location_visited(location):
-                    routes_completed += 1
-                    break
+        collections = Collection.objects.filter(user=user)
+        routes_completed = collections.filter(locations__is_visited=True).distinct().count()
 
         # Get difficulty breakdown for routes
         difficulty_breakdown = collections.values('difficulty_level').annotate(
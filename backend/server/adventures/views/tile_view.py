@@ -0,0 +1,37 @@
+from django.http import HttpResponse, HttpResponseNotModified
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from adventures.utils import vector_tiles
+
+
+class VectorTileView(APIView):
+    """
+    GET /api/tiles/<layer>/<z>/<x>/<y>.mvt: one Mapbox Vector Tile of the
+    requesting user's map (see adventures/utils/vector_tiles.py).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, layer, z, x, y):
+        if layer not in vector_tiles.LAYERS:
+            return Response(
+                {"error": f"Unknown layer, expected one of: {', '.join(vector_tiles.LAYERS)}"}, status=404
+            )
+        try:
+            vector_tiles.tile_bbox(z, x, y)
+        except vector_tiles.InvalidTile as e:
+            return Response({"error": str(e)}, status=400)
+
+        token = vector_tiles.user_token(request.user)
+        etag = f'"{token}-{layer}-{z}-{x}-{y}"' if token else None
+        if etag and request.headers.get('If-None-Match') == etag:
+            response = HttpResponseNotModified()
+        else:
+            tile = vector_tiles.get_tile(layer, request.user, z, x, y, token)
+            response = HttpResponse(tile, content_type='application/vnd.mapbox-vector-tile')
+        if etag:
+            response['ETag'] = etag
+        # Tiles change with every edit, so the browser revalidates them
+        response['Cache-Control'] = 'private, no-cache'
+        return response
@@ -4,7 +4,7 @@ from adventures.models import Location, Visit
 from adventures.serializers import VisitSerializer
 from adventures.permissions import IsOwnerOrSharedWithFullAccess
 from rest_framework.exceptions import PermissionDenied
-from adventures.models import background_geocode_and_assign
+from adventures.models import enqueue_location_geocode
 
 class VisitViewSet(viewsets.ModelViewSet):
     serializer_class = VisitSerializer
@@ -47,7 +47,7 @@ class VisitViewSet(viewsets.ModelViewSet):
         serializer.save()
 
         # This will update any visited regions or cities based on if it's now visited
-        background_geocode_and_assign(str(location.id))
+        enqueue_location_geocode(location.id)
 
     def perform_update(self, serializer):
         instance = serializer.instance
@@ -63,7 +63,7 @@ class VisitViewSet(viewsets.ModelViewSet):
 
         serializer.save()
 
-        background_geocode_and_assign(str(instance.location.id))
+        enqueue_location_geocode(instance.location.id)
 
     def perform_destroy(self, instance):
         if not IsOwnerOrSharedWithFullAccess().has_object_permission(self.request, self, instance.location):
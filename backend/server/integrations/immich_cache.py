@@ -0,0 +1,181 @@
+"""
+On-disk cache of Immich thumbnails and previews.
+
+ImmichIntegrationView.get_by_integration used to download the asset from the
+Immich server and buffer it in memory on every view. Now the first request
+streams the bytes through to the client while writing them to
+IMMICH_CACHE_ROOT; later requests are served from that file by nginx
+(X-Accel-Redirect to /protectedImmichCache/), without contacting Immich.
+
+Files are named after (integration, asset, size) and carry the content type in
+their extension, which nginx uses for the Content-Type header:
+
+    <IMMICH_CACHE_ROOT>/<2 hex>/<sha256 of integration:asset:size>.<extension>
+
+The file's modification time is fixed when it is written and is part of the
+ETag, so a revalidation can be answered with a 304 from a single stat() call.
+The access time records the last use: the periodic `prune_immich_cache` job
+deletes the least recently used files once the cache outgrows
+IMMICH_CACHE_MAX_SIZE.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+IMMICH_CACHE_ROOT = str(getattr(settings, 'IMMICH_CACHE_ROOT', os.path.join(settings.BASE_DIR, 'immich_cache')))
+IMMICH_CACHE_MAX_SIZE = getattr(settings, 'IMMICH_CACHE_MAX_SIZE', 1024 * 1024 * 1024)  # bytes
+IMMICH_CACHE_URL = '/protectedImmichCache/'
+
+# Sizes Immich renders for /assets/{id}/thumbnail
+IMMICH_ASSET_SIZES = ('thumbnail', 'preview')
+CONTENT_TYPE_EXTENSIONS = {
+    'image/webp': 'webp',
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/avif': 'avif',
+}
+EXTENSION_CONTENT_TYPES = {extension: content_type for content_type, extension in CONTENT_TYPE_EXTENSIONS.items()}
+
+STREAM_CHUNK_SIZE = 64 * 1024
+ACCESS_TIME_RESOLUTION = 60  # seconds; hits within this window do not update the access time
+PRUNE_TARGET = 0.9  # pruning stops once the cache is below this fraction of the maximum size
+STALE_TEMP_FILE_AGE = 60 * 60  # seconds
+
+
+def cache_key(integration_id, asset_id, size):
+    return hashlib.sha256(f"{integration_id}:{asset_id}:{size}".encode()).hexdigest()
+
+
+def _entry_base(key):
+    return os.path.join(IMMICH_CACHE_ROOT, key[:2], key)
+
+
+def etag_for(key, mtime):
+    return f'"{key[:16]}-{int(mtime):x}"'
+
+
+class CachedAsset:
+    def __init__(self, key, path, stat):
+        self.key = key
+        self.path = path
+        self.stat = stat
+
+    @property
+    def relative_path(self):
+        return os.path.relpath(self.path, IMMICH_CACHE_ROOT).replace(os.sep, '/')
+
+    @property
+    def content_type(self):
+        return EXTENSION_CONTENT_TYPES[self.path.rsplit('.', 1)[-1]]
+
+    @property
+    def etag(self):
+        return etag_for(self.key, self.stat.st_mtime)
+
+
+def lookup(key):
+    """The cached file for a key, or None. Marks the file as recently used."""
+    base = _entry_base(key)
+    for extension in EXTENSION_CONTENT_TYPES:
+        path = f"{base}.{extension}"
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        now = time.time()
+        if now - stat.st_atime > ACCESS_TIME_RESOLUTION:
+            try:
+                # Explicit, so it also works on noatime/relatime mounts; the mtime is kept for the ETag
+                os.utime(path, (now, stat.st_mtime))
+            except OSError:
+                pass
+        return CachedAsset(key, path, stat)
+    return None
+
+
+def stream_to_cache(key, upstream, content_type, mtime):
+    """
+    Yield the body of an upstream `requests` response (opened with stream=True)
+    chunk by chunk while writing it to the cache. The file is only stored once
+    the whole body was received; the upstream response is always closed.
+    """
+    extension = CONTENT_TYPE_EXTENSIONS.get(content_type)
+    tmp_path = None
+    tmp_file = None
+    try:
+        if extension:
+            base = _entry_base(key)
+            try:
+                os.makedirs(os.path.dirname(base), exist_ok=True)
+                tmp_path = f"{base}.{os.getpid()}.{threading.get_ident()}.tmp"
+                tmp_file = open(tmp_path, 'wb')
+            except OSError as e:
+                # Still stream the image, just without caching it
+                logger.warning(f"[Immich cache] Cannot write to {IMMICH_CACHE_ROOT}: {e}")
+                tmp_path = None
+
+        for chunk in upstream.iter_content(STREAM_CHUNK_SIZE):
+            if tmp_file:
+                tmp_file.write(chunk)
+            yield chunk
+
+        if tmp_file:
+            tmp_file.close()
+            tmp_file = None
+            expected = upstream.headers.get('Content-Length')
+            if expected is None or os.path.getsize(tmp_path) == int(expected):
+                os.utime(tmp_path, (time.time(), mtime))
+                os.replace(tmp_path, f"{_entry_base(key)}.{extension}")
+    finally:
+        upstream.close()
+        if tmp_file:
+            tmp_file.close()
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def prune_immich_cache():
+    """Job handler: delete the least recently used files until the cache fits IMMICH_CACHE_MAX_SIZE."""
+    if not os.path.isdir(IMMICH_CACHE_ROOT):
+        return
+
+    now = time.time()
+    entries = []
+    total = 0
+    for directory, _, files in os.walk(IMMICH_CACHE_ROOT):
+        for name in files:
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if name.endswith('.tmp'):
+                # Left behind by a worker that was killed mid-download
+                if now - stat.st_mtime > STALE_TEMP_FILE_AGE:
+                    os.remove(path)
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+            total += stat.st_size
+
+    if total <= IMMICH_CACHE_MAX_SIZE:
+        return
+
+    entries.sort()
+    target = IMMICH_CACHE_MAX_SIZE * PRUNE_TARGET
+    deleted = 0
+    for _, size, path in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        deleted += 1
+    logger.info(f"[Immich cache] Deleted {deleted} least recently used files, {total / (1024 * 1024):.1f} MB left")
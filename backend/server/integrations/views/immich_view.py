@@ -1,4 +1,5 @@
 import os
+import time
 from rest_framework.response import Response
 from rest_framework import viewsets, status
 from integrations.serializers import ImmichIntegrationSerializer
@@ -6,14 +7,22 @@ from integrations.models import ImmichIntegration
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 import requests
-from adventures.models import ContentImage
-from django.http import HttpResponse
+from adventures.utils import http_client
+from adventures.models import ContentImage, Location
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from integrations import immich_cache
 from integrations.utils import StandardResultsSetPagination
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Images are only shown after a permission check, so shared caches must not store them
+IMMICH_CACHE_CONTROL = 'private, max-age=86400'
+
 class ImmichIntegrationView(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
     pagination_class = StandardResultsSetPagination
@@ -98,13 +107,14 @@ class ImmichIntegrationView(viewsets.ViewSet):
         # check so if the server is down, it does not tweak out like a madman and crash the server with a 500 error code
         try:
             url = f'{integration.server_url}/search/{"smart" if query else "metadata"}'
-            immich_fetch = requests.post(url, headers={
+            immich_fetch = http_client.post(url, headers={
                 'x-api-key': integration.api_key
             },
-            json = arguments
+            json = arguments,
+            circuit_key=f'immich:{integration.id}'
             )
             res = immich_fetch.json()
-        except requests.exceptions.ConnectionError:
+        except requests.exceptions.RequestException:
             return Response(
                 {
                     'message': 'The Immich server is currently down or unreachable.',
@@ -145,11 +155,11 @@ class ImmichIntegrationView(viewsets.ViewSet):
 
         # check so if the server is down, it does not tweak out like a madman and crash the server with a 500 error code
         try:
-            immich_fetch = requests.get(f'{integration.server_url}/albums', headers={
+            immich_fetch = http_client.get(f'{integration.server_url}/albums', headers={
                 'x-api-key': integration.api_key
-            })
+            }, circuit_key=f'immich:{integration.id}')
             res = immich_fetch.json()
-        except requests.exceptions.ConnectionError:
+        except requests.exceptions.RequestException:
             return Response(
                 {
                     'message': 'The Immich server is currently down or unreachable.',
@@ -187,11 +197,11 @@ class ImmichIntegrationView(viewsets.ViewSet):
         
         # check so if the server is down, it does not tweak out like a madman and crash the server with a 500 error code
         try:
-            immich_fetch = requests.get(f'{integration.server_url}/albums/{albumid}', headers={
+            immich_fetch = http_client.get(f'{integration.server_url}/albums/{albumid}', headers={
                 'x-api-key': integration.api_key
-            })
+            }, circuit_key=f'immich:{integration.id}')
             res = immich_fetch.json()
-        except requests.exceptions.ConnectionError:
+        except requests.exceptions.RequestException:
             return Response(
                 {
                     'message': 'The Immich server is currently down or unreachable.',
@@ -229,12 +239,15 @@ class ImmichIntegrationView(viewsets.ViewSet):
     def get_by_integration(self, request, integration_id=None, imageid=None):
         """
         GET an Immich image using the integration and asset ID.
-        Access levels (in order of priority):
+        `?size=thumbnail` returns the small thumbnail, the default is the preview.
+        Access levels:
         1. Public locations: accessible by anyone
         2. Private locations in public collections: accessible by anyone
-        3. Private locations in private collections shared with user: accessible by shared users, and the collection owner
-        4. Private locations: accessible only to the owner
-        5. No ContentImage: owner can still view via integration
+        3. Private locations in collections shared with the user: accessible by shared users, and the collection owner
+        4. Anything else, including images not linked to any location: only the integration owner
+
+        Images are streamed from Immich once and then served from the on-disk cache
+        (see integrations/immich_cache.py); revalidations are answered with a 304.
         """
         if not imageid or not integration_id:
             return Response({
@@ -243,124 +256,88 @@ class ImmichIntegrationView(viewsets.ViewSet):
                 'code': 'immich.missing_params'
             }, status=status.HTTP_400_BAD_REQUEST)
 
+        size = request.query_params.get('size', 'preview')
+        if size not in immich_cache.IMMICH_ASSET_SIZES:
+            return Response({
+                'message': f"Invalid size, expected one of: {', '.join(immich_cache.IMMICH_ASSET_SIZES)}.",
+                'error': True,
+                'code': 'immich.invalid_size'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
         # Lookup integration and user
         integration = get_object_or_404(ImmichIntegration, id=integration_id)
-        owner_id = integration.user
-
-        # Get all images for this immich_id and user
-        image_entries = list(
-            ContentImage.objects
-            .filter(immich_id=imageid, user=owner_id)
-            .select_related('content_type')
-        )
-
-        # Sort by access level priority and find the best match
-        def get_access_priority(image_entry):
-            """Return priority score for access control (lower = higher priority)"""
-            content_obj = image_entry.content_object
-            
-            # Only handle Location objects for now (can be extended for other types)
-            if not hasattr(content_obj, 'is_public'):
-                return 999  # Low priority for non-location objects
-            
-            # For Location objects, check access levels
-            if content_obj.is_public:
-                return 0  # Highest priority - public location
-            
-            # Check if location is in any public collection
-            if hasattr(content_obj, 'collections'):
-                collections = content_obj.collections.all()
-                if any(collection.is_public for collection in collections):
-                    return 1  # Second priority - private location in public collection
-                    
-                # Check for shared collections (if user is authenticated)
-                if (request.user.is_authenticated and 
-                    any(collection.shared_with.filter(id=request.user.id).exists() 
-                        for collection in collections)):
-                    return 2  # Third priority - shared collection access
-            
-            return 3  # Lowest priority - private location, owner access only
-
-        # Sort image entries by access priority
-        image_entries.sort(key=get_access_priority)
-        image_entry = image_entries[0] if image_entries else None
+        owner = integration.user
 
         # Access control
-        if image_entry:
-            content_obj = image_entry.content_object
-            
-            # Only apply access control to Location objects
-            if hasattr(content_obj, 'is_public'):
-                location = content_obj
-                
-                # Determine access level
-                is_authorized = False
-
-                # Level 1: Public location (highest priority)
-                if location.is_public:
-                    is_authorized = True
-
-                # Level 2: Private location in any public collection
-                elif hasattr(location, 'collections'):
-                    collections = location.collections.all()
-                    if any(collection.is_public for collection in collections):
-                        is_authorized = True
-                    
-                    # Level 3: Owner access
-                    elif request.user.is_authenticated and request.user == owner_id:
-                        is_authorized = True
-                        
-                    # Level 4: Shared collection access or collection owner access
-                    elif (request.user.is_authenticated and 
-                        (any(collection.shared_with.filter(id=request.user.id).exists() 
-                            for collection in collections) or
-                         any(collection.user == request.user for collection in collections))):
-                        is_authorized = True
-                else:
-                    # Location without collections - owner access only
-                    if request.user.is_authenticated and request.user == owner_id:
-                        is_authorized = True
-                
-                if not is_authorized:
-                    return Response({
-                        'message': 'This image belongs to a private location and you are not authorized.',
-                        'error': True,
-                        'code': 'immich.permission_denied'
-                    }, status=status.HTTP_403_FORBIDDEN)
-            else:
-                # For non-Location objects, allow only owner access for now
-                if not request.user.is_authenticated or request.user != owner_id:
-                    return Response({
-                        'message': 'This image is not publicly accessible and you are not the owner.',
-                        'error': True,
-                        'code': 'immich.permission_denied'
-                    }, status=status.HTTP_403_FORBIDDEN)
-        else:
-            # No ContentImage exists; allow only the integration owner
-            if not request.user.is_authenticated or request.user != owner_id:
+        if not (request.user.is_authenticated and request.user == owner):
+            image_entries = ContentImage.objects.filter(immich_id=imageid, user=owner)
+            if not image_entries.exists():
                 return Response({
                     'message': 'Image is not linked to any location and you are not the owner.',
                     'error': True,
                     'code': 'immich.not_found'
                 }, status=status.HTTP_404_NOT_FOUND)
 
-        # Fetch from Immich
+            # A single query instead of checking every linked location in Python
+            access = Q(is_public=True) | Q(collections__is_public=True)
+            if request.user.is_authenticated:
+                access |= Q(collections__shared_with=request.user) | Q(collections__user=request.user)
+            location_ids = image_entries.filter(
+                content_type=ContentType.objects.get_for_model(Location)
+            ).values('object_id')
+            if not Location.objects.filter(access, id__in=location_ids).exists():
+                return Response({
+                    'message': 'This image belongs to a private location and you are not authorized.',
+                    'error': True,
+                    'code': 'immich.permission_denied'
+                }, status=status.HTTP_403_FORBIDDEN)
+
+        key = immich_cache.cache_key(integration.id, imageid, size)
+        if_none_match = request.headers.get('If-None-Match')
+        cached = immich_cache.lookup(key)
+        if cached:
+            if if_none_match == cached.etag:
+                response = HttpResponseNotModified()
+            elif settings.DEBUG:
+                response = FileResponse(open(cached.path, 'rb'), content_type=cached.content_type)
+            else:
+                # nginx sends the file and sets the Content-Type from its extension
+                response = HttpResponse()
+                response['Content-Type'] = ''
+                response['X-Accel-Redirect'] = immich_cache.IMMICH_CACHE_URL + cached.relative_path
+            response['ETag'] = cached.etag
+            response['Cache-Control'] = IMMICH_CACHE_CONTROL
+            return response
+
+        # Fetch from Immich, streaming the body through to the client and into the cache
         try:
-            immich_response = requests.get(
-                f'{integration.server_url}/assets/{imageid}/thumbnail?size=preview',
+            immich_response = http_client.get(
+                f'{integration.server_url}/assets/{imageid}/thumbnail?size={size}',
                 headers={'x-api-key': integration.api_key},
-                timeout=5
+                timeout=5,
+                stream=True,
+                circuit_key=f'immich:{integration.id}',
             )
-            content_type = immich_response.headers.get('Content-Type', 'image/jpeg')
-            if not content_type.startswith('image/'):
+            content_type = immich_response.headers.get('Content-Type', 'image/jpeg').split(';')[0].strip()
+            if immich_response.status_code != 200 or not content_type.startswith('image/'):
+                immich_response.close()
                 return Response({
                     'message': 'Invalid content type returned from Immich.',
                     'error': True,
                     'code': 'immich.invalid_content'
                 }, status=status.HTTP_502_BAD_GATEWAY)
 
-            response = HttpResponse(immich_response.content, content_type=content_type, status=200)
-            response['Cache-Control'] = 'public, max-age=86400, stale-while-revalidate=3600'
+            mtime = int(time.time())
+            response = StreamingHttpResponse(
+                immich_cache.stream_to_cache(key, immich_response, content_type, mtime),
+                content_type=content_type,
+            )
+            if 'Content-Length' in immich_response.headers:
+                response['Content-Length'] = immich_response.headers['Content-Length']
+            if content_type in immich_cache.CONTENT_TYPE_EXTENSIONS:
+                # The ETag the cached copy will have
+                response['ETag'] = immich_cache.etag_for(key, mtime)
+            response['Cache-Control'] = IMMICH_CACHE_CONTROL
             return response
 
         except requests.exceptions.ConnectionError:
@@ -377,6 +354,13 @@ class ImmichIntegrationView(viewsets.ViewSet):
                 'code': 'immich.timeout'
             }, status=status.HTTP_504_GATEWAY_TIMEOUT)
 
+        except requests.exceptions.RequestException:
+            return Response({
+                'message': 'The Immich server request failed.',
+                'error': True,
+                'code': 'immich.error'
+            }, status=status.HTTP_502_BAD_GATEWAY)
+
 class ImmichIntegrationViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     serializer_class = ImmichIntegrationSerializer
@@ -413,7 +397,7 @@ class ImmichIntegrationViewSet(viewsets.ModelViewSet):
         
         for corrected_url, test_endpoint in test_configs:
             try:
-                response = requests.get(
+                response = http_client.get(
                     test_endpoint, 
                     headers=headers, 
                     timeout=10,  # 10 second timeout
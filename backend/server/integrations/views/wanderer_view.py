@@ -1,5 +1,6 @@
 # views.py
 import requests
+from adventures.utils import http_client
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
@@ -7,7 +8,7 @@ from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError, NotFound
 
 from integrations.models import WandererIntegration
-from integrations.wanderer_services import get_valid_session, login_to_wanderer, IntegrationError
+from integrations.wanderer_services import get_auth_cookies, login_to_wanderer, IntegrationError
 from django.utils import timezone
 
 class WandererIntegrationViewSet(viewsets.ViewSet):
@@ -121,7 +122,7 @@ class WandererIntegrationViewSet(viewsets.ViewSet):
 
         password = request.data.get("password")
         try:
-            session = get_valid_session(inst, password_for_reauth=password)
+            get_auth_cookies(inst, password_for_reauth=password)
         except IntegrationError:
             raise ValidationError({"detail": "An error occurred while refreshing the integration."})
 
@@ -142,7 +143,7 @@ class WandererIntegrationViewSet(viewsets.ViewSet):
         password = request.query_params.get("password")  # Allow password via query param if needed
         
         try:
-            session = get_valid_session(inst, password_for_reauth=password)
+            cookies = get_auth_cookies(inst, password_for_reauth=password)
         except IntegrationError as e:
             # If session expired and no password provided, give a helpful error
             if "password is required" in str(e).lower():
@@ -157,7 +158,7 @@ class WandererIntegrationViewSet(viewsets.ViewSet):
         
         url = f"{inst.server_url.rstrip('/')}/api/v1/trail"
         try:
-            response = session.get(url, params=params, timeout=10)
+            response = http_client.get(url, params=params, cookies=cookies, timeout=10, circuit_key=f"wanderer:{inst.id}")
             response.raise_for_status()
         except requests.RequestException:
             raise ValidationError({"detail": f"Error fetching trails"})
@@ -1,5 +1,6 @@
 # wanderer_services.py
 import requests
+from adventures.utils import http_client
 from datetime import datetime
 from datetime import timezone as dt_timezone
 from django.utils import timezone as django_timezone
@@ -39,10 +40,10 @@ def login_to_wanderer(integration: WandererIntegration, password: str):
     url = integration.server_url.rstrip("/") + LOGIN_PATH
     
     try:
-        resp = requests.post(url, json={
+        resp = http_client.post(url, json={
             "username": integration.username,
             "password": password
-        }, timeout=10)
+        }, timeout=10, circuit_key=f"wanderer:{integration.id}")
         resp.raise_for_status()
     except requests.RequestException as exc:
         logger.error("Error connecting to Wanderer login: %s", exc)
@@ -71,13 +72,12 @@ def login_to_wanderer(integration: WandererIntegration, password: str):
     logger.info(f"Successfully authenticated with Wanderer. Token expires: {expiry}")
     return token, expiry
 
-def get_valid_session(integration: WandererIntegration, password_for_reauth: str = None):
+def get_auth_cookies(integration: WandererIntegration, password_for_reauth: str = None):
     """
-    Get a requests session with valid authentication.
+    Get the auth cookies for a request to Wanderer.
     Will reuse existing token if valid, or re-authenticate if needed.
     """
     now = django_timezone.now()
-    session = requests.Session()
 
     if not integration:
         raise IntegrationError("No Wanderer integration found.")
@@ -85,8 +85,7 @@ def get_valid_session(integration: WandererIntegration, password_for_reauth: str
     # Check if we have a valid token
     if integration.token and integration.token_expiry and integration.token_expiry > now:
         logger.debug("Using existing valid token")
-        session.cookies.set(COOKIE_NAMES[0], integration.token)
-        return session
+        return {COOKIE_NAMES[0]: integration.token}
 
     # Token expired or missing - need to re-authenticate
     if password_for_reauth is None:
@@ -100,9 +99,7 @@ def get_valid_session(integration: WandererIntegration, password_for_reauth: str
     integration.token_expiry = expiry
     integration.save(update_fields=["token", "token_expiry"])
 
-    # Set the cookie in the session
-    session.cookies.set(COOKIE_NAMES[0], token)
-    return session
+    return {COOKIE_NAMES[0]: token}
 
 def make_wanderer_request(integration: WandererIntegration, endpoint: str, method: str = "GET", password_for_reauth: str = None, **kwargs):
     """
@@ -118,11 +115,13 @@ def make_wanderer_request(integration: WandererIntegration, endpoint: str, metho
     Returns:
         requests.Response object
     """
-    session = get_valid_session(integration, password_for_reauth)
+    cookies = get_auth_cookies(integration, password_for_reauth)
     url = f"{integration.server_url.rstrip('/')}{endpoint}"
     
     try:
-        response = getattr(session, method.lower())(url, timeout=10, **kwargs)
+        response = http_client.request(
+            method, url, cookies=cookies, timeout=10, circuit_key=f"wanderer:{integration.id}", **kwargs
+        )
         response.raise_for_status()
         return response
     except requests.RequestException as exc:
@@ -190,7 +190,8 @@ STORAGES = {
         "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage",
     },
     "default": {
-        "BACKEND": "django.core.files.storage.FileSystemStorage",
+        # Images, attachments and GPX files are stored by content hash, see adventures/utils/blobs.py
+        "BACKEND": "adventures.utils.blobs.ContentAddressedStorage",
     }
 }
 
@@ -339,4 +340,30 @@ COUNTRY_REGION_JSON_VERSION = 'v2.6'
 GOOGLE_MAPS_API_KEY = getenv('GOOGLE_MAPS_API_KEY', '')
 
 STRAVA_CLIENT_ID = getenv('STRAVA_CLIENT_ID', '')
-STRAVA_CLIENT_SECRET = getenv('STRAVA_CLIENT_SECRET', '')
\ No newline at end of file
+STRAVA_CLIENT_SECRET = getenv('STRAVA_CLIENT_SECRET', '')
+
+# Background job queue (see adventures/jobs.py and the run_workers command)
+JOB_QUEUE_WORKERS = int(getenv('JOB_QUEUE_WORKERS', '2'))
+# Seconds a background backup export stays downloadable before it is deleted
+BACKUP_EXPORT_TTL = int(getenv('BACKUP_EXPORT_TTL', str(60 * 60 * 24)))
+# Seconds deletions are kept for delta backups (?since=); older deltas are refused
+BACKUP_TOMBSTONE_RETENTION = int(getenv('BACKUP_TOMBSTONE_RETENTION', str(60 * 60 * 24 * 90)))
+# Seconds signed image/attachment URLs stay valid (and cacheable by browsers)
+MEDIA_URL_TTL = int(getenv('MEDIA_URL_TTL', str(60 * 60 * 24)))
+# Seconds media permission decisions for unsigned URLs are cached
+MEDIA_ACL_CACHE_TTL = int(getenv('MEDIA_ACL_CACHE_TTL', str(60 * 60)))
+# Format of resized image renditions: webp, or avif if Pillow was built with libavif
+IMAGE_DERIVATIVE_FORMAT = getenv('IMAGE_DERIVATIVE_FORMAT', 'webp')
+# Seconds an image/attachment/GPX file nothing references anymore is kept before it is deleted
+BLOB_CLEANUP_GRACE = int(getenv('BLOB_CLEANUP_GRACE', str(60 * 60)))
+# On-disk cache of Immich thumbnails and previews, served by nginx (/protectedImmichCache/)
+IMMICH_CACHE_ROOT = getenv('IMMICH_CACHE_ROOT', str(BASE_DIR / 'immich_cache'))
+# Size in MB the Immich cache is pruned to, least recently used files first
+IMMICH_CACHE_MAX_SIZE = int(getenv('IMMICH_CACHE_MAX_SIZE', '1024')) * 1024 * 1024
+# Seconds a rendered vector tile (/api/tiles/...) stays cached; tiles are also dropped when the map changes
+TILE_CACHE_TTL = int(getenv('TILE_CACHE_TTL', str(60 * 60 * 24)))
+# Seconds recommendation (Overpass/Google Places) tiles are fresh, then served stale while refreshed in the background
+POI_CACHE_TTL = int(getenv('POI_CACHE_TTL', str(60 * 60 * 24 * 7)))
+POI_CACHE_STALE_TTL = int(getenv('POI_CACHE_STALE_TTL', str(60 * 60 * 24 * 30)))
+# Seconds the Overpass server may spend on a recommendations query
+OVERPASS_TIMEOUT = int(getenv('OVERPASS_TIMEOUT', '25'))
@@ -2,9 +2,11 @@ from django.http import JsonResponse
 from django.middleware.csrf import get_token
 from os import getenv
 from django.conf import settings
-from django.http import HttpResponse, HttpResponseForbidden
+from django.http import Http404, HttpResponse, HttpResponseForbidden
 from django.views.static import serve
 from adventures.utils.file_permissions import checkFilePermission
+from adventures.utils.media_signing import SIGNED_MEDIA_PATHS, verify_media_signature
+from adventures.utils.image_derivatives import ensure_derivative, parse_derivative_name
 
 def get_csrf_token(request):
     csrf_token = get_token(request)
@@ -13,23 +15,35 @@ def get_csrf_token(request):
 def get_public_url(request):
     return JsonResponse({'PUBLIC_URL': getenv('PUBLIC_URL')})
 
-protected_paths = ['images/', 'attachments/']
+protected_paths = ['images/', 'attachments/', 'exports/']
 
 def serve_protected_media(request, path):
     if any([path.startswith(protected_path) for protected_path in protected_paths]):
         image_id = path.split('/')[1]
         user = request.user
         media_type =  path.split('/')[0] + '/'
-        if checkFilePermission(image_id, user, media_type):
+        # URLs signed by the serializers are trusted without a database lookup
+        signed_for = None
+        if media_type in SIGNED_MEDIA_PATHS:
+            signed_for = verify_media_signature(path, request.GET.get('expires'), request.GET.get('signature'))
+        if signed_for or checkFilePermission(image_id, user, media_type):
+            # Image renditions are rendered on their first request
+            if parse_derivative_name(path) and not ensure_derivative(path):
+                raise Http404()
             if settings.DEBUG:
                 # In debug mode, serve the file directly
-                return serve(request, path, document_root=settings.MEDIA_ROOT)
+                response = serve(request, path, document_root=settings.MEDIA_ROOT)
             else:
                 # In production, use X-Accel-Redirect to serve the file using Nginx
                 response = HttpResponse()
                 response['Content-Type'] = ''
                 response['X-Accel-Redirect'] = '/protectedMedia/' + path
-                return response
+                if media_type == 'exports/':
+                    response['Content-Disposition'] = 'attachment; filename="adventurelog_backup.zip"'
+            if signed_for:
+                # Files never change under a name, so the browser can keep them for the URL's lifetime
+                response['Cache-Control'] = f'private, max-age={signed_for}, immutable'
+            return response
         else:
             return HttpResponseForbidden()
     else:
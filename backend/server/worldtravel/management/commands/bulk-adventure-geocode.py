@@ -1,26 +1,21 @@
 from django.core.management.base import BaseCommand
-from adventures.models import Location
-import time
+from adventures.models import Location, enqueue_location_geocode
 
 class Command(BaseCommand):
-	help = 'Bulk geocode all adventures by triggering save on each one'
+	help = 'Bulk geocode all adventures by queueing a geocode job for each one'
 
 	def handle(self, *args, **options):
-		adventures = Location.objects.all()
+		adventures = Location.objects.filter(latitude__isnull=False, longitude__isnull=False).only('id', 'name')
 		total = adventures.count()
 		
-		self.stdout.write(self.style.SUCCESS(f'Starting bulk geocoding of {total} adventures'))
+		self.stdout.write(self.style.SUCCESS(f'Queueing geocoding of {total} adventures'))
 		
-		for i, adventure in enumerate(adventures):
+		for i, adventure in enumerate(adventures.iterator()):
 			try:
-				self.stdout.write(f'Processing adventure {i+1}/{total}: {adventure}')
-				adventure.save()  # This should trigger any geocoding in the save method
-				self.stdout.write(self.style.SUCCESS(f'Successfully processed adventure {i+1}/{total}'))
+				# Jobs are deduplicated per location and rate limited by the worker pool
+				enqueue_location_geocode(adventure.id)
+				self.stdout.write(f'Queued adventure {i+1}/{total}: {adventure}')
 			except Exception as e:
-				self.stdout.write(self.style.ERROR(f'Error processing adventure {i+1}/{total}: {adventure} - {e}'))
-			
-			# Sleep for 2 seconds between each save
-			if i < total - 1:  # Don't sleep after the last one
-				time.sleep(2)
+				self.stdout.write(self.style.ERROR(f'Error queueing adventure {i+1}/{total}: {adventure} - {e}'))
 		
-		self.stdout.write(self.style.SUCCESS('Finished processing all adventures'))
+		self.stdout.write(self.style.SUCCESS('Finished queueing all adventures, run `python manage.py run_workers` to process them'))
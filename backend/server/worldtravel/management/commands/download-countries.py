@@ -1,6 +1,6 @@
 import os
 from django.core.management.base import BaseCommand
-import requests
+from adventures.utils import http_client
 from worldtravel.models import Country, Region, City
 from django.db import transaction
 import ijson
@@ -30,7 +30,7 @@ def saveCountryFlag(country_code):
         print(f'Flag for {country_code} already exists')
         return
 
-    res = requests.get(f'https://flagcdn.com/h240/{country_code}.png'.lower())
+    res = http_client.get(f'https://flagcdn.com/h240/{country_code}.png'.lower())
     if res.status_code == 200:
         with open(flag_path, 'wb') as f:
             f.write(res.content)
@@ -95,7 +95,7 @@ class Command(BaseCommand):
         # Download or validate JSON file
         if not os.path.exists(countries_json_path) or force:
             self.stdout.write('Downloading JSON file...')
-            res = requests.get(f'https://raw.githubusercontent.com/dr5hn/countries-states-cities-database/{COUNTRY_REGION_JSON_VERSION}/json/countries%2Bstates%2Bcities.json')
+            res = http_client.get(f'https://raw.githubusercontent.com/dr5hn/countries-states-cities-database/{COUNTRY_REGION_JSON_VERSION}/json/countries%2Bstates%2Bcities.json')
             if res.status_code == 200:
                 with open(countries_json_path, 'w') as f:
                     f.write(res.text)
@@ -131,7 +131,10 @@ class Command(BaseCommand):
             self.stdout.write('Step 4: Processing cities...')
             self._process_cities_from_temp(temp_conn, batch_size)
             
-            self.stdout.write('Step 5: Cleaning up obsolete records...')
+            self.stdout.write('Step 5: Updating spatial points...')
+            self._sync_points()
+
+            self.stdout.write('Step 6: Cleaning up obsolete records...')
             self._cleanup_obsolete_records(temp_conn)
 
         self.stdout.write(self.style.SUCCESS('All data imported successfully with minimal memory usage'))
@@ -495,6 +498,21 @@ class Command(BaseCommand):
             
             cursor.execute(sql, params)
 
+    def _sync_points(self):
+        """Rebuild the indexed region/city points used by the local reverse geocoder"""
+        from django.db import connection
+
+        with connection.cursor() as cursor:
+            for table in ('worldtravel_region', 'worldtravel_city'):
+                cursor.execute(f"""
+                    UPDATE {table}
+                    SET point = ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)
+                    WHERE longitude IS NOT NULL AND latitude IS NOT NULL
+                """)
+                cursor.execute(f"UPDATE {table} SET point = NULL WHERE longitude IS NULL OR latitude IS NULL")
+
+        self.stdout.write('✓ Spatial points updated')
+
     def _cleanup_obsolete_records(self, temp_conn):
         """Clean up obsolete records using temporary database"""
         # Get IDs from temp database to avoid loading large lists into memory
@@ -0,0 +1,34 @@
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('worldtravel', '0018_rename_user_id_visitedcity_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='region',
+            name='point',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='city',
+            name='point',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, null=True, srid=4326),
+        ),
+        # Backfill the indexed points from the existing coordinates
+        migrations.RunSQL(
+            sql="""
+                UPDATE worldtravel_region
+                SET point = ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)
+                WHERE longitude IS NOT NULL AND latitude IS NOT NULL;
+                UPDATE worldtravel_city
+                SET point = ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)
+                WHERE longitude IS NOT NULL AND latitude IS NOT NULL;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
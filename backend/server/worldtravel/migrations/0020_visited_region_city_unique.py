@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('worldtravel', '0019_region_point_city_point'),
+    ]
+
+    operations = [
+        # Drop duplicate visits that slipped past the save() check before adding the constraints
+        migrations.RunSQL(
+            sql="""
+                DELETE FROM worldtravel_visitedregion a
+                USING worldtravel_visitedregion b
+                WHERE a.user_id = b.user_id AND a.region_id = b.region_id AND a.id > b.id;
+                DELETE FROM worldtravel_visitedcity a
+                USING worldtravel_visitedcity b
+                WHERE a.user_id = b.user_id AND a.city_id = b.city_id AND a.id > b.id;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddConstraint(
+            model_name='visitedregion',
+            constraint=models.UniqueConstraint(fields=('user', 'region'), name='unique_visited_region_per_user'),
+        ),
+        migrations.AddConstraint(
+            model_name='visitedcity',
+            constraint=models.UniqueConstraint(fields=('user', 'city'), name='unique_visited_city_per_user'),
+        ),
+    ]
@@ -2,12 +2,19 @@ from django.db import models
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.contrib.gis.db import models as gis_models
+from django.contrib.gis.geos import Point
 
 
 User = get_user_model()
 
 default_user = 1  # Replace with an actual user ID
 
+def point_from_lat_lon(latitude, longitude):
+    """Build a WGS84 point from a lat/lon pair, or None if either is missing."""
+    if latitude is None or longitude is None:
+        return None
+    return Point(float(longitude), float(latitude), srid=4326)
+
 class Country(models.Model):
 
     id = models.AutoField(primary_key=True)
@@ -31,6 +38,12 @@ class Region(models.Model):
     country = models.ForeignKey(Country, on_delete=models.CASCADE)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    # Spatially indexed copy of latitude/longitude used for nearest-neighbour lookups
+    point = gis_models.PointField(srid=4326, null=True, blank=True)
+
+    def save(self, *args, **kwargs):
+        self.point = point_from_lat_lon(self.latitude, self.longitude)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
@@ -41,10 +54,16 @@ class City(models.Model):
     region = models.ForeignKey(Region, on_delete=models.CASCADE)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    # Spatially indexed copy of latitude/longitude used for nearest-neighbour lookups
+    point = gis_models.PointField(srid=4326, null=True, blank=True)
 
     class Meta:
         verbose_name_plural = "Cities"
 
+    def save(self, *args, **kwargs):
+        self.point = point_from_lat_lon(self.latitude, self.longitude)
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.name
 
@@ -54,6 +73,11 @@ class VisitedRegion(models.Model):
         User, on_delete=models.CASCADE, default=default_user)
     region = models.ForeignKey(Region, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'region'], name='unique_visited_region_per_user'),
+        ]
+
     def __str__(self):
         return f'{self.region.name} ({self.region.country.country_code}) visited by: {self.user.username}'
     
@@ -68,6 +92,11 @@ class VisitedCity(models.Model):
         User, on_delete=models.CASCADE, default=default_user)
     city = models.ForeignKey(City, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'city'], name='unique_visited_city_per_user'),
+        ]
+
     def __str__(self):
         return f'{self.city.name} ({self.city.region.name}) visited by: {self.user.username}'
     
@@ -17,7 +17,9 @@ class CountrySerializer(serializers.ModelSerializer):
         return public_url + '/media/' + 'flags/' + obj.country_code.lower() + '.png'
     
     def get_num_regions(self, obj):
-        # get the number of regions in the country
+        # get the number of regions in the country (annotated when prefetched for locations)
+        if hasattr(obj, 'region_count'):
+            return obj.region_count
         return Region.objects.filter(country=obj).count()
     
     def get_num_visits(self, obj):
@@ -25,6 +27,8 @@ class CountrySerializer(serializers.ModelSerializer):
         user = getattr(request, 'user', None)
         
         if user and user.is_authenticated:
+            if hasattr(obj, 'visit_count'):
+                return obj.visit_count
             return VisitedRegion.objects.filter(region__country=obj, user=user).count()
         
         return 0
@@ -44,6 +48,8 @@ class RegionSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'name', 'country', 'longitude', 'latitude', 'num_cities', 'country_name']
 
     def get_num_cities(self, obj):
+        if hasattr(obj, 'city_count'):
+            return obj.city_count
         return City.objects.filter(region=obj).count()
 
 class CitySerializer(serializers.ModelSerializer):
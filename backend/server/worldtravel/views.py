@@ -5,11 +5,11 @@ from rest_framework import viewsets, status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes, action
-from django.contrib.gis.geos import Point
 from django.core.cache import cache
 from django.views.decorators.cache import cache_page
 from django.utils.decorators import method_decorator
 from adventures.models import Location
+from adventures.geocoding import reverse_geocode_local
 
 # Cache TTL
 CACHE_TTL = 60 * 60 * 24  # 1 day
@@ -107,31 +107,34 @@ class CountryViewSet(viewsets.ReadOnlyModelViewSet):
 
     @action(detail=False, methods=['get'])
     def check_point_in_region(self, request):
-        lat = float(request.query_params.get('lat'))
-        lon = float(request.query_params.get('lon'))
-        point = Point(lon, lat, srid=4326)
-        region = Region.objects.filter(geometry__contains=point).first()
-        if region:
-            return Response({'in_region': True, 'region_name': region.name, 'region_id': region.id})
+        try:
+            lat = float(request.query_params.get('lat'))
+            lon = float(request.query_params.get('lon'))
+        except (TypeError, ValueError):
+            return Response({"error": "Invalid latitude or longitude"}, status=400)
+        data = reverse_geocode_local(lat, lon, request.user)
+        if 'error' not in data:
+            return Response({'in_region': True, 'region_name': data['region'], 'region_id': data['region_id']})
         else:
             return Response({'in_region': False})
 
     @action(detail=False, methods=['post'])
     def region_check_all_adventures(self, request):
-        adventures = Location.objects.filter(user=request.user.id, type='visited')
+        adventures = Location.objects.filter(user=request.user, is_visited=True, latitude__isnull=False, longitude__isnull=False)
         count = 0
         for adventure in adventures:
-            if adventure.latitude is not None and adventure.longitude is not None:
-                try:
-                    point = Point(float(adventure.longitude), float(adventure.latitude), srid=4326)
-                    region = Region.objects.filter(geometry__contains=point).first()
-                    if region:
-                        if not VisitedRegion.objects.filter(user=request.user.id, region=region).exists():
-                            VisitedRegion.objects.create(user=request.user, region=region)
-                            count += 1
-                except Exception as e:
-                    print(f"Error processing adventure {adventure.id}: {e}")
+            try:
+                data = reverse_geocode_local(adventure.latitude, adventure.longitude, request.user)
+                if 'error' in data:
                     continue
+                region = Region.objects.get(id=data['region_id'])
+                _, created = VisitedRegion.objects.get_or_create(user=request.user, region=region)
+                if created:
+                    invalidate_visit_caches_for_region_and_user(region, request.user)
+                    count += 1
+            except Exception as e:
+                print(f"Error processing adventure {adventure.id}: {e}")
+                continue
         return Response({'regions_visited': count})
 
 @method_decorator(cache_page(CACHE_TTL), name='list')
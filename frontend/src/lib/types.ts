@@ -18,8 +18,15 @@ export type User = {
 export type ContentImage = {
 	id: string;
 	image: string;
+	// Signed URLs of the resized renditions, null for Immich images
+	srcset?: { thumb: string; card: string; full: string } | null;
 	is_primary: boolean;
 	immich_id: string | null;
+	// Uploads are resized in the background; poll /api/images/<id>/ while "processing"
+	status?: 'processing' | 'ready' | 'failed';
+	taken_at?: string | null;
+	latitude?: string | null;
+	longitude?: string | null;
 };
 
 export type Location = {
@@ -32,14 +32,33 @@ export const GET: RequestHandler = async (event) => {
 		const integrationData = await integrationFetch.json();
 		const integrationId = integrationData.id;
 
-		// Proxy the request to the backend{
-		const res = await fetch(`${endpoint}/api/integrations/immich/${integrationId}/get/${key}`, {
-			method: 'GET',
-			headers: {
-				'Content-Type': 'application/json',
-				Cookie: `sessionid=${sessionid}`
+		// Proxy the request to the backend, including ?size= and the browser's cached ETag
+		const headers: Record<string, string> = {
+			'Content-Type': 'application/json',
+			Cookie: `sessionid=${sessionid}`
+		};
+		const ifNoneMatch = event.request.headers.get('If-None-Match');
+		if (ifNoneMatch) {
+			headers['If-None-Match'] = ifNoneMatch;
+		}
+		const res = await fetch(
+			`${endpoint}/api/integrations/immich/${integrationId}/get/${key}${event.url.search}`,
+			{
+				method: 'GET',
+				headers
 			}
-		});
+		);
+
+		const cacheHeaders: Record<string, string> = {};
+		for (const name of ['ETag', 'Cache-Control']) {
+			const value = res.headers.get(name);
+			if (value) {
+				cacheHeaders[name] = value;
+			}
+		}
+		if (res.status === 304) {
+			return new Response(null, { status: 304, headers: cacheHeaders });
+		}
 
 		if (!res.ok) {
 			// Return an error response if the backend request fails
@@ -50,13 +69,11 @@ export const GET: RequestHandler = async (event) => {
 			});
 		}
 
-		// Get the image as a Blob
-		const image = await res.blob();
-
-		// Create a Response to pass the image back
-		return new Response(image, {
+		// Stream the image back instead of buffering it
+		return new Response(res.body, {
 			status: res.status,
 			headers: {
+				...cacheHeaders,
 				'Content-Type': res.headers.get('Content-Type') || 'image/jpeg'
 			}
 		});